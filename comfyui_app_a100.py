@@ -5,6 +5,8 @@ from typing import Optional
 from huggingface_hub import hf_hub_download
 import modal
 
+from comfyui_base_image import DEFAULT_COMFY_DIR, comfyui_base_image
+
 # Paths
 DATA_ROOT = "/data/comfy"
 DATA_BASE = os.path.join(DATA_ROOT, "ComfyUI")
@@ -12,9 +14,6 @@ CUSTOM_NODES_DIR = os.path.join(DATA_BASE, "custom_nodes")
 MODELS_DIR = os.path.join(DATA_BASE, "models")
 TMP_DL = "/tmp/download"
 
-# ComfyUI default install location
-DEFAULT_COMFY_DIR = "/root/comfy/ComfyUI"
-
 def git_clone_cmd(node_repo: str, recursive: bool = False, install_reqs: bool = False) -> str:
     name = node_repo.split("/")[-1]
     dest = os.path.join(DEFAULT_COMFY_DIR, "custom_nodes", name)
@@ -31,20 +30,11 @@ def hf_download(subdir: str, filename: str, repo_id: str, subfolder: Optional[st
     os.makedirs(target, exist_ok=True)
     shutil.move(out, os.path.join(target, filename))
 
-# Build image with ComfyUI installed to default location /root/comfy/ComfyUI
+# Stack image: shared ComfyUI base (comfyui_base_image.py) + stack-specific layers
 image = (
-    modal.Image.debian_slim(python_version="3.12")
-    .apt_install("git", "wget", "libgl1-mesa-glx", "libglib2.0-0", "ffmpeg")
+    comfyui_base_image()
     # 👇 ВИПРАВЛЕННЯ: Додано необхідні бібліотеки для кастомних нод
     .pip_install("psd-tools", "PyWavelets", "tiktoken")
-    .run_commands([
-        "pip install --upgrade pip",
-        "pip install --no-cache-dir comfy-cli uv",
-        "uv pip install --system --compile-bytecode huggingface_hub[hf_transfer]==0.28.1",
-        # Install ComfyUI to default location
-        "comfy --skip-prompt install --nvidia"
-    ])
-    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
 )
 
 # Install nodes to default ComfyUI location during build
@@ -180,6 +170,9 @@ extra_cmds = [
     f"wget https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth -P {MODELS_DIR}/upscale_models",
 ]
 
+# The base image module is imported at container start too.
+image = image.add_local_python_source("comfyui_base_image")
+
 # Create volume
 vol = modal.Volume.from_name("comfyui-app", create_if_missing=True)
 
@@ -217,6 +210,8 @@ def ui():
         result = subprocess.run("git symbolic-ref HEAD", shell=True, capture_output=True, text=True)
         if result.returncode != 0:
             print("Detected detached HEAD, checking out main branch...")
+            # Fetch first: the copied clone may not carry an origin/main ref.
+            subprocess.run("git fetch origin +refs/heads/main:refs/remotes/origin/main", shell=True, check=True, capture_output=True, text=True)
             subprocess.run("git checkout -B main origin/main", shell=True, check=True, capture_output=True, text=True)
             print("Successfully checked out main branch")
         
@@ -5,6 +5,8 @@ from typing import Optional
 from huggingface_hub import hf_hub_download
 import modal
 
+from comfyui_base_image import DEFAULT_COMFY_DIR, comfyui_base_image
+
 # Paths
 DATA_ROOT = "/data/comfy"
 DATA_BASE = os.path.join(DATA_ROOT, "ComfyUI")
@@ -12,9 +14,6 @@ CUSTOM_NODES_DIR = os.path.join(DATA_BASE, "custom_nodes")
 MODELS_DIR = os.path.join(DATA_BASE, "models")
 TMP_DL = "/tmp/download"
 
-# ComfyUI default install location
-DEFAULT_COMFY_DIR = "/root/comfy/ComfyUI"
-
 def git_clone_cmd(node_repo: str, recursive: bool = False, install_reqs: bool = False) -> str:
     name = node_repo.split("/")[-1]
     dest = os.path.join(DEFAULT_COMFY_DIR, "custom_nodes", name)
@@ -66,20 +65,11 @@ def download_model(subdir: str, filename: str, primary_source: dict, backup_sour
             else:
                 print("Trying next source...")
 
-# Build image with ComfyUI installed to default location /root/comfy/ComfyUI
+# Stack image: shared ComfyUI base (comfyui_base_image.py) + stack-specific layers
 image = (
-    modal.Image.debian_slim(python_version="3.12")
-    .apt_install("git", "wget", "libgl1-mesa-glx", "libglib2.0-0", "ffmpeg", "imagemagick", "libmagickwand-dev")
+    comfyui_base_image()
     # 👇 ВИПРАВЛЕННЯ: Додано необхідні бібліотеки для кастомних нод
     .pip_install("psd-tools", "PyWavelets", "tiktoken", "Wand", "gguf", "diffusers", "peft", "rotary_embedding_torch", "omegaconf")
-    .run_commands([
-        "pip install --upgrade pip",
-        "pip install --no-cache-dir comfy-cli uv",
-        "uv pip install --system --compile-bytecode huggingface_hub[hf_transfer]==0.28.1",
-        # Install ComfyUI to default location
-        "comfy --skip-prompt install --nvidia"
-    ])
-    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
 )
 
 # Install nodes to default ComfyUI location during build
@@ -277,6 +267,9 @@ extra_cmds = [
     f"wget https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth -P {MODELS_DIR}/upscale_models",
 ]
 
+# The base image module is imported at container start too.
+image = image.add_local_python_source("comfyui_base_image")
+
 # Create volume
 vol = modal.Volume.from_name("comfyui-app", create_if_missing=True)
 
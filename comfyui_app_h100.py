@@ -12,9 +12,6 @@ CUSTOM_NODES_DIR = os.path.join(DATA_BASE, "custom_nodes")
 MODELS_DIR = os.path.join(DATA_BASE, "models")
 TMP_DL = "/tmp/download"
 
-# ComfyUI default install location
-DEFAULT_COMFY_DIR = "/root/comfy/ComfyUI"
-
 def git_clone_cmd(node_repo: str, recursive: bool = False, install_reqs: bool = False) -> str:
     name = node_repo.split("/")[-1]
     dest = os.path.join(DEFAULT_COMFY_DIR, "custom_nodes", name)
@@ -41,18 +38,10 @@ def hf_download(subdir: str, filename: str, repo_id: str, subfolder: Optional[st
 
 import modal
 
-# Build image with ComfyUI installed to default location /root/comfy/ComfyUI
-image = (
-    modal.Image.debian_slim(python_version="3.12")
-    .apt_install("git", "wget", "libgl1-mesa-glx", "libglib2.0-0")
-    .run_commands([
-        "pip install --upgrade pip comfy-cli uv",
-        "uv pip install --system --compile-bytecode huggingface_hub[hf_transfer]==0.28.1",
-        # Install ComfyUI to default location
-        "comfy --skip-prompt install --nvidia"
-    ])
-    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
-)
+from comfyui_base_image import DEFAULT_COMFY_DIR, comfyui_base_image
+
+# Stack image: shared ComfyUI base (comfyui_base_image.py) + stack-specific layers
+image = comfyui_base_image()
 
 # Install nodes to default ComfyUI location during build
 image = image.run_commands([
@@ -83,6 +72,9 @@ extra_cmds = [
 #     civitai_download("upscale_models", "4xUltrasharp_4xUltrasharpV10.pt", "https://civitai.com/api/download/models/125843?type=Model&format=PickleTensor")
 ]
 
+# The base image module is imported at container start too.
+image = image.add_local_python_source("comfyui_base_image")
+
 # Create volume
 vol = modal.Volume.from_name("comfyui-app", create_if_missing=True)
 app = modal.App(name="comfyui", image=image)
@@ -8,6 +8,8 @@ from typing import Optional
 from huggingface_hub import hf_hub_download
 import modal
 
+from comfyui_base_image import DEFAULT_COMFY_DIR, comfyui_base_image
+
 # Paths
 DATA_ROOT = "/data/comfy"
 DATA_BASE = os.path.join(DATA_ROOT, "ComfyUI")
@@ -27,9 +29,6 @@ CUSTOM_NODE_REPOS = [
     ("ClownsharkBatwing/RES4LYF", True),
 ]
 
-# ComfyUI default install location
-DEFAULT_COMFY_DIR = "/root/comfy/ComfyUI"
-
 def git_clone_cmd(node_repo: str, recursive: bool = False, install_reqs: bool = False) -> str:
     name = node_repo.split("/")[-1]
     dest = os.path.join(DEFAULT_COMFY_DIR, "custom_nodes", name)
@@ -366,21 +365,11 @@ def download_model(subdir: str, filename: str, primary_source: dict, backup_sour
             else:
                 print("Trying next source...")
 
-# Build image with ComfyUI installed to default location /root/comfy/ComfyUI
+# Stack image: shared ComfyUI base (comfyui_base_image.py) + stack-specific layers
 image = (
-    modal.Image.debian_slim(python_version="3.12")
-    .apt_install("git", "wget", "libgl1-mesa-glx", "libglib2.0-0", "ffmpeg", "imagemagick", "libmagickwand-dev")
+    comfyui_base_image()
     # 👇 ВИПРАВЛЕННЯ: Додано необхідні бібліотеки для кастомних нод
     .pip_install("psd-tools", "PyWavelets", "tiktoken", "Wand", "gguf", "diffusers", "peft", "rotary_embedding_torch", "omegaconf", "blake3", "comfy-aimdo", "comfy-kitchen", "piexif")
-    .run_commands([
-        "pip install --upgrade pip",
-        "pip install --no-cache-dir --force-reinstall --index-url https://download.pytorch.org/whl/cu126 torch==2.11.0 torchvision==0.26.0 torchaudio==2.11.0",
-        "pip install --no-cache-dir comfy-cli uv",
-        "uv pip install --system --compile-bytecode huggingface_hub[hf_transfer]==0.28.1",
-        # Install ComfyUI to default location
-        "comfy --skip-prompt install --nvidia"
-    ])
-    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
 )
 
 # Custom nodes synchronized with QuickPod `quick_download_quickpod_codex_v2.sh`
@@ -464,6 +453,9 @@ model_tasks = [
     ("loras/FLUX9bKlein", "Pussy FIX - Klein9B - pusfix,pubic area,genital area.safetensors", "EllaPriest45/Klein9B_Actions", None),
 ]
 
+# The base image module is imported at container start too.
+image = image.add_local_python_source("comfyui_base_image")
+
 # Create volume
 vol = modal.Volume.from_name("comfyui-app", create_if_missing=True)
 
@@ -1,22 +1,71 @@
+import gzip
 import hashlib
-from concurrent.futures import ThreadPoolExecutor
+import importlib
+import importlib.util
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+import json
 import os
+import re
 import shutil
+import site
 import subprocess
 import sys
-from importlib.metadata import PackageNotFoundError, version
+import sysconfig
+import threading
+import time
+import urllib.error
+import urllib.request
+from importlib.metadata import PackageNotFoundError, distributions, version
 from typing import Optional
-from huggingface_hub import hf_hub_download
+from huggingface_hub import get_hf_file_metadata, hf_hub_download, hf_hub_url
 import modal
 
+from comfyui_base_image import BASE_IMAGE_VERSION, DEFAULT_COMFY_DIR, comfyui_base_image, git_compact_history_cmd
+
 # Paths
 DATA_ROOT = "/data/comfy"
 DATA_BASE = os.path.join(DATA_ROOT, "ComfyUI")
-CUSTOM_NODES_DIR = os.path.join(DATA_BASE, "custom_nodes")
+# Code layout, chosen at deploy time (COMFY_CODE_LAYOUT=local modal deploy ...):
+#   "volume" - ComfyUI and custom nodes live on the volume and are git-updated at boot.
+#   "local"  - code runs from the image copy at DEFAULT_COMFY_DIR with precompiled
+#              bytecode and is updated by rebuilding the image; only models/, user/,
+#              input/ and output/ live on the volume.
+CODE_LAYOUT = os.environ.get("COMFY_CODE_LAYOUT", "volume")
+COMFY_CODE_DIR = DEFAULT_COMFY_DIR if CODE_LAYOUT == "local" else DATA_BASE
+CUSTOM_NODES_DIR = os.path.join(COMFY_CODE_DIR, "custom_nodes")
 MODELS_DIR = os.path.join(DATA_BASE, "models")
-TMP_DL = "/tmp/download"
+VOLUME_DATA_DIRS = ("user", "input", "output")
+# Downloads are staged on the volume so a partial file left by a shutdown is
+# resumed by the next container (hf_hub_download / wget -c) instead of restarted.
+TMP_DL = os.path.join(DATA_ROOT, ".downloads")
 RUNTIME_STATE_DIR = os.path.join(DATA_ROOT, ".runtime_state")
 FRONTEND_REQUIREMENTS_HASH = os.path.join(RUNTIME_STATE_DIR, "requirements.sha256")
+# Environment fingerprint of the last completed bootstrap. While it matches and is
+# younger than the TTL, git pulls / pip steps are skipped (delete the file to force).
+ENVIRONMENT_FINGERPRINT_PATH = os.path.join(RUNTIME_STATE_DIR, "environment_fingerprint.json")
+ENVIRONMENT_FINGERPRINT_TTL = 12 * 3600
+# Site-packages delta left by the runtime pip steps, stored per dependency
+# fingerprint and mounted on the next boot instead of re-running pip.
+SITE_PACKAGES_OVERLAY_ROOT = os.path.join(RUNTIME_STATE_DIR, "site_packages_overlay")
+SITE_PACKAGES_OVERLAY_KEEP = 2
+SITE_PACKAGES_OVERLAY_PTH = "launcher_site_packages_overlay.pth"
+RUNTIME_UPGRADE_PACKAGES = ["comfy-kitchen", "comfy-aimdo"]
+# Command / bootstrap telemetry, buffered in memory and appended as JSON lines.
+TELEMETRY_PATH = os.path.join(RUNTIME_STATE_DIR, "telemetry.jsonl")
+# Lines of stdout/stderr kept per command for error reports.
+SUBPROCESS_TAIL_LINES = 200
+# Bytecode cache: sources are compiled to unchecked-hash pycs after each sync, so
+# imports never stat or re-hash sources on the volume. Data dirs are not scanned.
+BYTECODE_SKIP_DIRS = {".git", "__pycache__", "node_modules", "models", "input", "output", "user", "temp"}
+BYTECODE_SCAN_WORKERS = 32
+# Torch inductor / Triton / CUDA JIT kernel caches, persisted per
+# (GPU type, torch version, driver) key so compiled kernels survive restarts.
+# Least recently used keys (then oldest files) are evicted past the budget.
+KERNEL_CACHE_ROOT = os.path.join(DATA_ROOT, ".kernel_cache")
+KERNEL_CACHE_BUDGET_BYTES = 8 * 2**30
+KERNEL_CACHE_MARKER = ".last_used"
 GPU_TYPE = "L40S"
 BASE_MODEL_NAME = "krea2_turbo"
 APP_NAME = "comfyui-l40s-krea2-turbo-v2"
@@ -32,31 +81,267 @@ CUSTOM_NODE_REPOS = [
     ("erosDiffusion/ComfyUI-EulerDiscreteScheduler", False),
     ("capitan01R/ComfyUI-Krea2T-Enhancer", False),
 ]
-
-# ComfyUI default install location
-DEFAULT_COMFY_DIR = "/root/comfy/ComfyUI"
+# Optional commit pins (full SHAs). The image node layer is keyed by the sorted
+# repo/pin set, and runtime sync checks pinned repos out at exactly that commit
+# instead of following their default branch.
+CUSTOM_NODE_PINS = {}
+
+# Clone base for custom nodes (a file:// directory of bare repos works for local testing).
+GIT_BASE_URL = "https://github.com"
+
+# Launcher hooks custom node (model refresh route + frontend extension).
+# Shipped next to this script and copied into custom_nodes/ on every boot.
+LAUNCHER_HOOKS_NAME = "comfyui_launcher_hooks"
+LAUNCHER_HOOKS_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), LAUNCHER_HOOKS_NAME)
+# Per-custom-node import time / RSS growth, written by the launcher hooks'
+# prestartup script on every launch.
+IMPORT_PROFILE_PATH = os.path.join(RUNTIME_STATE_DIR, "custom_node_import_profile.json")
+# Only this stack's nodes (CUSTOM_NODE_REPOS + launcher hooks) are loaded, so
+# nodes left in custom_nodes/ by other installs do not slow startup. Add
+# directory names to the extra list to keep nodes installed via the Manager UI.
+PRUNE_UNLISTED_CUSTOM_NODES = True
+CUSTOM_NODE_ALLOWLIST_EXTRA = []
+# The gateway (comfyui_gateway.py) owns the public port from the first second of
+# ComfyUIServer.ui: it serves bootstrap status, then proxies to ComfyUI on its
+# internal port.
+GATEWAY_PORT = 8000
+COMFYUI_PORT = 8188
+COMFYUI_LOCAL_URL = f"http://127.0.0.1:{COMFYUI_PORT}"
+COMFYUI_READY_TIMEOUT = 900
+# Wall time of the last successful bootstrap, used as the status page ETA.
+BOOTSTRAP_DURATION_PATH = os.path.join(RUNTIME_STATE_DIR, "bootstrap_duration.json")
+DOWNLOAD_PROGRESS_INTERVAL = 2
+# Precomputed /object_info payloads keyed by frontend_inventory_key(); the gateway
+# serves them so page loads never wait for ComfyUI to rescan node and model folders.
+OBJECT_INFO_SNAPSHOT_DIR = os.path.join(RUNTIME_STATE_DIR, "object_info")
+OBJECT_INFO_SNAPSHOT_KEEP = 4
+# Prompts accepted through the gateway are journaled here and replayed by the
+# next container if this one dies first. Journal writes mark the volume dirty;
+# it is committed at most every VOLUME_COMMIT_INTERVAL seconds.
+PROMPT_JOURNAL_PATH = os.path.join(RUNTIME_STATE_DIR, "prompt_journal.sqlite")
+VOLUME_COMMIT_INTERVAL = 10
+# Prompts that opt in with "X-Launcher-Coalesce: on", leave their seeds to the
+# gateway (seed -1) and arrive from one client within this many seconds of each
+# other run as one latent batch (see comfyui_gateway); 0 disables coalescing.
+PROMPT_COALESCE_WAIT = 0.25
+# Priority lanes (name -> weight) in the gateway: prompts from the ComfyUI editor
+# go to "interactive", API clients to "bulk" unless they send X-Launcher-Lane.
+# /prompt replies as soon as a prompt is held; ComfyUI's later rejections show in
+# /history/<id>. Held prompts are listed and cancelled through /queue as usual.
+# Per-lane queue wait: GET /launcher/lanes. None sends prompts straight to ComfyUI.
+PROMPT_LANES = {"interactive": 4, "bulk": 1}
+# Outputs of completed prompts, keyed by canonical graph + referenced file hashes
+# (see comfyui_result_cache); repeated prompts are answered without running.
+# Hit rate and size: GET /launcher/results. A budget of 0 disables the cache.
+RESULT_CACHE_DIR = os.path.join(DATA_ROOT, ".result_cache")
+RESULT_CACHE_BUDGET_BYTES = 20 * 2**30
+# When Modal stops the container (scale-down, preemption, timeout), its exit hook
+# refuses new prompts, gives the running prompt this long to finish, then stops
+# ComfyUI and commits the volume. Modal kills the container 30s after SIGTERM,
+# so the whole drain fits in
+# DRAIN_BUDGET_SECONDS: the grace shrinks to leave room for stopping ComfyUI and
+# the commit, and whatever is still running at the deadline is abandoned.
+DRAIN_GRACE_SECONDS = 20
+DRAIN_BUDGET_SECONDS = 28
+DRAIN_TERMINATE_SECONDS = 5
+DRAIN_COMMIT_RESERVE_SECONDS = 5
+DRAIN_POLL_INTERVAL = 1.0
+# Keepalive: Modal scales a web container down after SCALEDOWN_WINDOW seconds
+# without requests. While there is work (bootstrap, queued or running prompts)
+# or an editor tab holds a websocket open, the activity monitor requests its own
+# public URL every KEEPALIVE_INTERVAL, so a short window (60s, was 300s) releases
+# the GPU soon after the last job or closed tab instead of a fixed idle tail.
+# Decisions and counters: GET /launcher/activity.
+SCALEDOWN_WINDOW = 60
+KEEPALIVE_INTERVAL = 20
+# Prewarm scheduler, chosen at deploy time (COMFY_PREWARM_MODE=container modal deploy ...):
+#   "hydrate"   - a CPU job refreshes the volume (git/pip/overlay, models, bytecode,
+#                 fingerprint) ahead of an expected session, so the GPU boot takes the fast path.
+#   "container" - the public URL is requested ahead of time and the GPU container is
+#                 held (keepalive?hold=) until the expected session starts.
+#   "off"       - no schedule (default).
+# Sessions are predicted from the session_start telemetry: the recency-weighted
+# share of past days with a session in the same time-of-day window. Warm time
+# (GPU seconds, or CPU seconds when hydrating) is capped per UTC day; a hydration
+# is charged up front with the duration of the previous one. While hydrating,
+# the scheduler holds a lease file on the volume and a GPU bootstrap waits for it.
+PREWARM_MODE = os.environ.get("COMFY_PREWARM_MODE", "off")
+PREWARM_CHECK_MINUTES = 10
+PREWARM_WINDOW_SECONDS = 30 * 60
+PREWARM_LOOKBACK_DAYS = 21
+PREWARM_HALF_LIFE_DAYS = 7
+PREWARM_MIN_HISTORY_DAYS = 3
+PREWARM_THRESHOLD = 0.5
+PREWARM_DAILY_BUDGET_SECONDS = 3600
+PREWARM_DEFAULT_BOOTSTRAP_SECONDS = 300
+PREWARM_LEDGER_PATH = os.path.join(RUNTIME_STATE_DIR, "prewarm_ledger.json")
+PREWARM_HYDRATE_TIMEOUT = 3600
+VOLUME_LEASE_PATH = os.path.join(RUNTIME_STATE_DIR, "volume_sync.lease")
+VOLUME_LEASE_POLL_INTERVAL = 10
+# Poll interval for new model files; partially written files are ignored
+# until their size/mtime is stable across two polls.
+MODEL_WATCH_INTERVAL = 10
+MODEL_VOLUME_RELOAD_INTERVAL = 60
+MODEL_WATCH_IGNORED_SUFFIXES = (".tmp", ".part", ".incomplete", ".lock")
+# Base models streamed into the page cache while the bootstrap runs, in priority
+# order, so the first prompt does not wait on volume reads. Each file is split
+# into segments read sequentially by parallel workers. The total is capped at a
+# fraction of the memory available at start; files that do not fit are skipped.
+PREFETCH_MODEL_FILES = [
+    ("diffusion_models", "Krea2_Turbo_fp8mixed.safetensors"),
+    ("text_encoders", "qwen3vl_4b_fp8_scaled.safetensors"),
+    ("vae", "qwen_image_vae.safetensors"),
+]
+PREFETCH_WORKERS = 4
+PREFETCH_SEGMENT_BYTES = 256 * 2**20
+PREFETCH_CHUNK_BYTES = 16 * 2**20
+PREFETCH_MEMORY_FRACTION = 0.5
+# Container-local LRU tier for models (launcher hooks node): models ComfyUI
+# loads are copied here in the background and served from local disk next
+# time. Stats: GET /launcher/models/cache. Set the budget to 0 to disable.
+MODEL_CACHE_DIR = "/root/model_cache"
+MODEL_CACHE_BUDGET_BYTES = 80 * 2**30
+# Post-launch warm-up: once ComfyUI answers, a tiny 8-step 512px Krea 2 Turbo
+# prompt loads the base models into VRAM and compiles kernels before the first
+# real prompt. It is cancelled as soon as any other prompt is queued.
+WARMUP_ENABLED = True
+WARMUP_TIMEOUT = 600
+WARMUP_POLL_INTERVAL = 1.0
+WARMUP_CLIENT_ID = "launcher-warmup"
 
 def git_clone_cmd(node_repo: str, recursive: bool = False, install_reqs: bool = False) -> str:
     name = node_repo.split("/")[-1]
     dest = os.path.join(DEFAULT_COMFY_DIR, "custom_nodes", name)
-    cmd = "git clone"
+    # Shallow single-branch clone: image builds never need node history.
+    cmd = "git clone --depth 1 --single-branch"
     if recursive:
-        cmd += " --recursive"
-    cmd += f" https://github.com/{node_repo} {dest}"
+        cmd += " --recursive --shallow-submodules"
+    cmd += f" {GIT_BASE_URL}/{node_repo} {dest}"
     if install_reqs:
         cmd += f" && if [ -f {dest}/requirements.txt ]; then pip install -r {dest}/requirements.txt; fi"
     return cmd
 
 
-def run_shell(command: str, cwd: Optional[str] = None, check: bool = True) -> subprocess.CompletedProcess:
-    return subprocess.run(
-        command,
-        shell=True,
-        check=check,
-        capture_output=True,
-        text=True,
+_telemetry_lock = threading.Lock()
+_telemetry_events = []
+
+
+def record_telemetry(event: str, **fields):
+    with _telemetry_lock:
+        _telemetry_events.append({"event": event, "ts": round(time.time(), 3), **fields})
+
+
+def flush_telemetry():
+    with _telemetry_lock:
+        events = list(_telemetry_events)
+        _telemetry_events.clear()
+    if not events:
+        return
+    try:
+        os.makedirs(RUNTIME_STATE_DIR, exist_ok=True)
+        with open(TELEMETRY_PATH, "a", encoding="utf-8") as handle:
+            for event in events:
+                handle.write(json.dumps(event, sort_keys=True) + "\n")
+    except OSError as e:
+        print(f"Failed to write telemetry: {e}")
+
+
+def run_streaming(
+    args,
+    label: str,
+    cwd: Optional[str] = None,
+    check: bool = False,
+    echo: bool = True,
+    shell: bool = False,
+) -> subprocess.CompletedProcess:
+    """Run a command, streaming its output line by line as it is produced.
+
+    Lines are printed with a timestamp and label prefix when echo is set.
+    Only the last SUBPROCESS_TAIL_LINES lines of each stream are kept and
+    returned in the CompletedProcess, so long pip/git logs never accumulate
+    in memory. Duration and exit code are recorded as telemetry.
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        args,
+        shell=shell,
         cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        bufsize=1,
     )
+    tails = {"stdout": deque(maxlen=SUBPROCESS_TAIL_LINES), "stderr": deque(maxlen=SUBPROCESS_TAIL_LINES)}
+
+    def pump(stream, name: str):
+        for line in stream:
+            line = line.rstrip("\n")
+            tails[name].append(line)
+            if echo and line:
+                print(f"[{time.strftime('%H:%M:%S')}][{label}] {line}", flush=True)
+        stream.close()
+
+    pumps = [
+        threading.Thread(target=pump, args=(process.stdout, "stdout"), daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, "stderr"), daemon=True),
+    ]
+    for thread in pumps:
+        thread.start()
+    returncode = process.wait()
+    for thread in pumps:
+        thread.join()
+
+    duration = time.perf_counter() - started
+    record_telemetry("command", label=label, returncode=returncode, duration=round(duration, 3))
+    result = subprocess.CompletedProcess(args, returncode, "\n".join(tails["stdout"]), "\n".join(tails["stderr"]))
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args, output=result.stdout, stderr=result.stderr)
+    return result
+
+
+def custom_node_layer_cmd(node_repos: list, pins: dict) -> str:
+    """Build one image layer that clones all custom nodes in parallel.
+
+    The command text is the layer's cache key, so entries are sorted and
+    carry their pin: the order of CUSTOM_NODE_REPOS does not matter, and
+    adding or re-pinning a node rebuilds only this layer. Requirements of
+    nodes with install_reqs are resolved together in a single pip install.
+    """
+    nodes_dir = os.path.join(DEFAULT_COMFY_DIR, "custom_nodes")
+    clone_jobs = []
+    requirement_dirs = []
+    for repo, install_reqs in sorted(node_repos):
+        dest = os.path.join(nodes_dir, repo.split("/")[-1])
+        pin = pins.get(repo)
+        if pin:
+            job = (
+                f"git init -q {dest} && git -C {dest} remote add origin {GIT_BASE_URL}/{repo}"
+                f" && git -C {dest} fetch -q --depth 1 origin {pin} && git -C {dest} checkout -q --detach FETCH_HEAD"
+            )
+        else:
+            job = git_clone_cmd(repo)
+        clone_jobs.append(f"( {job} ) & pids=\"$pids $!\"")
+        if install_reqs:
+            requirement_dirs.append(dest)
+
+    cmd = "pids=''; " + "; ".join(clone_jobs) + "; for pid in $pids; do wait $pid || exit 1; done"
+    if requirement_dirs:
+        cmd += "; reqs=''"
+        for dest in requirement_dirs:
+            cmd += f"; if [ -f {dest}/requirements.txt ]; then reqs=\"$reqs -r {dest}/requirements.txt\"; fi"
+        cmd += "; if [ -n \"$reqs\" ]; then pip install $reqs; fi"
+    return cmd
+
+
+def run_shell(
+    command: str,
+    cwd: Optional[str] = None,
+    check: bool = True,
+    label: Optional[str] = None,
+) -> subprocess.CompletedProcess:
+    # Probes pass no label and stay quiet; long-running commands stream under their label.
+    return run_streaming(command, label or command, cwd=cwd, check=check, echo=label is not None, shell=True)
 
 
 def file_sha256(path: str) -> str:
@@ -83,22 +368,38 @@ def ensure_comfyui_on_volume():
     os.makedirs(DATA_BASE, exist_ok=True)
 
 
+def link_volume_data_dirs():
+    """Local code layout: point the image's data dirs at the volume."""
+    for name in VOLUME_DATA_DIRS:
+        volume_dir = os.path.join(DATA_BASE, name)
+        local_dir = os.path.join(COMFY_CODE_DIR, name)
+        os.makedirs(volume_dir, exist_ok=True)
+        if os.path.islink(local_dir):
+            continue
+        if os.path.isdir(local_dir):
+            # Image copies only hold placeholders/examples, never user data.
+            shutil.rmtree(local_dir)
+        os.symlink(volume_dir, local_dir)
+        print(f"Linked {local_dir} -> {volume_dir}")
+
+    # Models are registered through extra_model_paths.yaml (auto-loaded from the
+    # ComfyUI directory) with is_default so downloads also land on the volume.
+    folders = {"checkpoints", "clip_vision", "controlnet", "diffusion_models", "embeddings", "loras", "text_encoders", "upscale_models", "vae"}
+    folders.update(entry for entry in os.listdir(MODELS_DIR) if os.path.isdir(os.path.join(MODELS_DIR, entry)))
+    lines = ["launcher_volume:", f"    base_path: {MODELS_DIR}", "    is_default: true"]
+    lines += [f"    {name}: {name}" for name in sorted(folders)]
+    config_path = os.path.join(COMFY_CODE_DIR, "extra_model_paths.yaml")
+    with open(config_path, "w", encoding="utf-8") as handle:
+        handle.write("\n".join(lines) + "\n")
+    print(f"Wrote {config_path} pointing models at {MODELS_DIR}")
+
+
 def update_comfyui_backend_author_style():
     print("Updating ComfyUI backend to the latest version...")
-    os.chdir(DATA_BASE)
     try:
-        result = subprocess.run("git symbolic-ref HEAD", shell=True, capture_output=True, text=True)
-        if result.returncode != 0:
-            print("Detected detached HEAD, fetching and checking out main branch...")
-            subprocess.run("git fetch --all", shell=True, check=True, capture_output=True, text=True)
-            subprocess.run("git checkout -B main origin/main", shell=True, check=True, capture_output=True, text=True)
-            print("Successfully checked out main branch")
-
-        subprocess.run("git config pull.ff only", shell=True, check=True, capture_output=True, text=True)
-        result = subprocess.run("git pull --ff-only", shell=True, check=True, capture_output=True, text=True)
-        print("Git pull output:", result.stdout)
-    except subprocess.CalledProcessError as e:
-        print(f"Error updating ComfyUI backend: {e.stderr}")
+        # Same targeted (shallow-aware) fetch as custom nodes instead of `git fetch --all`;
+        # also re-attaches the detached HEAD left by the image build.
+        update_git_repo(COMFY_CODE_DIR, "ComfyUI backend")
     except Exception as e:
         print(f"Unexpected error during backend update: {e}")
 
@@ -111,7 +412,7 @@ def update_comfyui_manager_author_style():
     else:
         print("ComfyUI-Manager directory not found, installing...")
         try:
-            subprocess.run("comfy node install ComfyUI-Manager", shell=True, check=True, capture_output=True, text=True)
+            run_shell("comfy node install ComfyUI-Manager", label="manager install")
             print("ComfyUI-Manager installed successfully")
         except subprocess.CalledProcessError as e:
             print(f"Error installing ComfyUI-Manager: {e.stderr}")
@@ -119,17 +420,11 @@ def update_comfyui_manager_author_style():
 
 def update_comfyui_frontend_author_style():
     print("Updating ComfyUI frontend by installing requirements...")
-    requirements_path = os.path.join(DATA_BASE, "requirements.txt")
+    requirements_path = os.path.join(COMFY_CODE_DIR, "requirements.txt")
     if os.path.exists(requirements_path):
         try:
-            result = subprocess.run(
-                f"/usr/local/bin/python -m pip install -r {requirements_path}",
-                shell=True,
-                check=True,
-                capture_output=True,
-                text=True,
-            )
-            print("Frontend update output:", result.stdout)
+            run_shell(f"/usr/local/bin/python -m pip install -r {requirements_path}", label="frontend pip")
+            print("Frontend update finished.")
         except subprocess.CalledProcessError as e:
             print(f"Error updating ComfyUI frontend: {e.stderr}")
         except Exception as e:
@@ -141,8 +436,8 @@ def update_comfyui_frontend_author_style():
 def upgrade_runtime_tools_author_style():
     print("Upgrading pip at runtime...")
     try:
-        result = subprocess.run("pip install --upgrade pip", shell=True, check=True, capture_output=True, text=True)
-        print("pip upgrade output:", result.stdout)
+        run_shell("pip install --upgrade pip", label="pip upgrade")
+        print("pip upgrade finished.")
     except subprocess.CalledProcessError as e:
         print(f"Error upgrading pip: {e.stderr}")
     except Exception as e:
@@ -150,8 +445,8 @@ def upgrade_runtime_tools_author_style():
 
     print("Upgrading comfy-cli at runtime...")
     try:
-        result = subprocess.run("pip install --no-cache-dir --upgrade comfy-cli", shell=True, check=True, capture_output=True, text=True)
-        print("comfy-cli upgrade output:", result.stdout)
+        run_shell("pip install --no-cache-dir --upgrade comfy-cli", label="comfy-cli upgrade")
+        print("comfy-cli upgrade finished.")
     except subprocess.CalledProcessError as e:
         print(f"Error upgrading comfy-cli: {e.stderr}")
     except Exception as e:
@@ -173,7 +468,18 @@ def configure_comfyui_manager_author_style():
         print(f"Updated {config_path} with network_mode=private, security_level=weak, log_to_file=false")
 
 
+def is_shallow_repo(repo_dir: str) -> bool:
+    probe = run_shell("git rev-parse --is-shallow-repository", cwd=repo_dir, check=False)
+    return probe.stdout.strip() == "true"
+
+
 def detect_remote_branch(repo_dir: str) -> Optional[str]:
+    # Ask the remote directly: shallow single-branch clones have no origin/HEAD.
+    remote_head = run_shell("git ls-remote --symref origin HEAD", cwd=repo_dir, check=False)
+    for line in remote_head.stdout.splitlines():
+        if line.startswith("ref: refs/heads/") and line.endswith("\tHEAD"):
+            return line[len("ref: refs/heads/"):-len("\tHEAD")]
+
     run_shell("git remote set-head origin -a", cwd=repo_dir, check=False)
 
     origin_head = run_shell(
@@ -204,12 +510,43 @@ def update_git_repo(repo_dir: str, label: str):
         print(f"Skipping {label} update: {repo_dir} is not a git repository.")
         return
 
-    run_shell("git fetch origin", cwd=repo_dir, check=False)
     branch = detect_remote_branch(repo_dir)
     if not branch:
         print(f"Skipping {label} update: could not determine remote branch for origin.")
         return
 
+    # Fetch only the tracked branch; shallow clones stay at depth 1.
+    shallow = is_shallow_repo(repo_dir)
+    depth = " --depth 1" if shallow else ""
+    fetch = run_shell(
+        f"git fetch{depth} origin +refs/heads/{branch}:refs/remotes/origin/{branch}",
+        cwd=repo_dir,
+        check=False,
+        label=label,
+    )
+    if fetch.returncode != 0:
+        details = fetch.stderr.strip() or fetch.stdout.strip()
+        print(f"Skipping {label} update: failed to fetch origin/{branch}: {details}")
+        return
+
+    if shallow:
+        # A depth-1 history cannot prove a fast-forward, so move the branch to the
+        # fetched tip directly (hard reset only if local edits block the checkout).
+        checkout = run_shell(f"git checkout -B {branch} origin/{branch}", cwd=repo_dir, check=False, label=label)
+        if checkout.returncode != 0:
+            print(f"{label} checkout failed ({checkout.stderr.strip()}), performing hard reset to origin/{branch}...")
+            checkout = run_shell(
+                f"git reset --hard origin/{branch} && git checkout -B {branch} origin/{branch}",
+                cwd=repo_dir,
+                check=False,
+                label=label,
+            )
+        if checkout.returncode == 0:
+            print(f"{label} updated to origin/{branch} at {git_head_sha(repo_dir)[:12]}")
+        else:
+            print(f"Error updating {label}: {checkout.stderr.strip()}")
+        return
+
     head_probe = run_shell("git symbolic-ref --short HEAD", cwd=repo_dir, check=False)
     if head_probe.returncode != 0:
         print(f"Detected detached HEAD in {label}, checking out origin/{branch}...")
@@ -217,6 +554,7 @@ def update_git_repo(repo_dir: str, label: str):
             f"git checkout -B {branch} origin/{branch}",
             cwd=repo_dir,
             check=False,
+            label=label,
         )
         if checkout.returncode != 0:
             details = checkout.stderr.strip() or checkout.stdout.strip()
@@ -224,7 +562,7 @@ def update_git_repo(repo_dir: str, label: str):
             return
 
     run_shell("git config pull.ff only", cwd=repo_dir, check=False)
-    pull = run_shell(f"git pull --ff-only origin {branch}", cwd=repo_dir, check=False)
+    pull = run_shell(f"git pull --ff-only origin {branch}", cwd=repo_dir, check=False, label=label)
     if pull.returncode == 0:
         output = pull.stdout.strip() or "Already up to date."
         print(f"{label} git pull output: {output}")
@@ -232,13 +570,49 @@ def update_git_repo(repo_dir: str, label: str):
 
     # Fallback to hard reset if working directory has local modifications
     print(f"{label} git pull failed ({pull.stderr.strip()}), performing hard reset to origin/{branch}...")
-    reset = run_shell(f"git reset --hard origin/{branch}", cwd=repo_dir, check=False)
+    reset = run_shell(f"git reset --hard origin/{branch}", cwd=repo_dir, check=False, label=label)
     if reset.returncode == 0:
         print(f"{label} hard reset output: {reset.stdout.strip()}")
     else:
         print(f"Error updating {label}: {reset.stderr.strip()}")
 
 
+def checkout_pinned_commit(repo_dir: str, commit: str, label: str):
+    if git_head_sha(repo_dir) == commit:
+        print(f"{label} already at pinned commit {commit[:12]}")
+        return
+    checkout = run_shell(
+        f"git fetch --depth 1 origin {commit} && git checkout -q --detach FETCH_HEAD",
+        cwd=repo_dir,
+        check=False,
+        label=label,
+    )
+    if checkout.returncode == 0:
+        print(f"{label} checked out pinned commit {commit[:12]}")
+    else:
+        print(f"Error checking out pinned commit {commit[:12]} for {label}: {checkout.stderr.strip()}")
+
+
+def install_custom_node_requirements(repo: str):
+    repo_name = repo.split("/")[-1]
+    repo_dir = os.path.join(CUSTOM_NODES_DIR, repo_name)
+    label = f"custom node {repo_name}"
+    requirements_path = os.path.join(repo_dir, "requirements.txt")
+    if not os.path.exists(requirements_path):
+        return
+
+    try:
+        run_streaming(
+            ["/usr/local/bin/python", "-m", "pip", "install", "-r", requirements_path],
+            f"{label} pip",
+            cwd=repo_dir,
+            check=True,
+        )
+        print(f"{label} requirements installed.")
+    except subprocess.CalledProcessError as e:
+        print(f"Error installing requirements for {label}: {e.stderr}")
+
+
 def _sync_single_node(repo: str, install_reqs: bool):
     """Sync a single custom node repo (clone or pull + optional pip install)."""
     repo_name = repo.split("/")[-1]
@@ -248,40 +622,39 @@ def _sync_single_node(repo: str, install_reqs: bool):
     if not os.path.exists(os.path.join(repo_dir, ".git")):
         print(f"Cloning {label}...")
         clone = run_shell(
-            f"git clone https://github.com/{repo} {repo_dir}",
+            f"git clone --depth 1 --single-branch {GIT_BASE_URL}/{repo} {repo_dir}",
             cwd=CUSTOM_NODES_DIR,
             check=False,
+            label=label,
         )
         if clone.returncode != 0:
             details = clone.stderr.strip() or clone.stdout.strip()
             print(f"Error cloning {label}: {details}")
             return
+        if repo in CUSTOM_NODE_PINS:
+            checkout_pinned_commit(repo_dir, CUSTOM_NODE_PINS[repo], label)
+    elif repo in CUSTOM_NODE_PINS:
+        checkout_pinned_commit(repo_dir, CUSTOM_NODE_PINS[repo], label)
     else:
         update_git_repo(repo_dir, label)
 
     if install_reqs:
-        requirements_path = os.path.join(repo_dir, "requirements.txt")
-        if os.path.exists(requirements_path):
-            try:
-                result = subprocess.run(
-                    ["/usr/local/bin/python", "-m", "pip", "install", "-r", requirements_path],
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                    cwd=repo_dir,
-                )
-                print(f"{label} requirements output:", result.stdout)
-            except subprocess.CalledProcessError as e:
-                print(f"Error installing requirements for {label}: {e.stderr}")
-
-
-def sync_custom_node_repos():
+        install_custom_node_requirements(repo)
+
+
+def sync_custom_node_repos(install_reqs: bool = True):
     print(f"Synchronizing custom nodes for {BASE_MODEL_NAME}...")
     os.makedirs(CUSTOM_NODES_DIR, exist_ok=True)
 
     # Parallel git pulls (~3-4s saved vs sequential)
     with ThreadPoolExecutor(max_workers=len(CUSTOM_NODE_REPOS)) as pool:
-        pool.map(lambda args: _sync_single_node(*args), CUSTOM_NODE_REPOS)
+        pool.map(lambda args: _sync_single_node(args[0], args[1] and install_reqs), CUSTOM_NODE_REPOS)
+
+
+def install_all_custom_node_requirements():
+    for repo, install_reqs in CUSTOM_NODE_REPOS:
+        if install_reqs:
+            install_custom_node_requirements(repo)
 
 
 def sync_frontend_requirements(requirements_path: str):
@@ -301,14 +674,13 @@ def sync_frontend_requirements(requirements_path: str):
         return
 
     print("Installing ComfyUI frontend requirements because requirements.txt changed...")
-    result = subprocess.run(
+    run_streaming(
         ["/usr/local/bin/python", "-m", "pip", "install", "-r", requirements_path],
+        "frontend pip",
+        cwd=COMFY_CODE_DIR,
         check=True,
-        capture_output=True,
-        text=True,
-        cwd=DATA_BASE,
     )
-    print("Frontend update output:", result.stdout)
+    print("Frontend requirements installed.")
 
     with open(FRONTEND_REQUIREMENTS_HASH, "w", encoding="utf-8") as handle:
         handle.write(current_hash)
@@ -328,9 +700,9 @@ STRIP_HEAVY_TEMPLATES = [
 def strip_workflow_template_media():
     """Remove heavy workflow template packages to speed up frontend loading."""
     print("Stripping heavy workflow template media packages...")
-    result = subprocess.run(
+    result = run_streaming(
         ["/usr/local/bin/python", "-m", "pip", "uninstall", "-y"] + STRIP_HEAVY_TEMPLATES,
-        capture_output=True, text=True,
+        "strip templates",
     )
     if result.returncode == 0:
         print("Stripped workflow template media packages successfully.")
@@ -350,16 +722,365 @@ def probe_runtime_dependencies():
 def ensure_comfy_kitchen_upgraded():
     print("Ensuring comfy-kitchen and comfy-aimdo are up to date for latest ComfyUI backend...")
     try:
-        result = subprocess.run(
-            ["/usr/local/bin/python", "-m", "pip", "install", "--upgrade", "comfy-kitchen", "comfy-aimdo"],
+        run_streaming(
+            ["/usr/local/bin/python", "-m", "pip", "install", "--upgrade"] + RUNTIME_UPGRADE_PACKAGES,
+            "comfy-kitchen pip",
             check=True,
-            capture_output=True,
-            text=True,
         )
-        print("comfy-kitchen upgrade output:", result.stdout)
+        print("comfy-kitchen upgrade finished.")
     except Exception as e:
         print(f"Warning: Failed to upgrade comfy-kitchen/comfy-aimdo: {e}")
 
+def git_head_sha(repo_dir: str) -> str:
+    if not os.path.isdir(repo_dir):
+        return "missing"
+    result = run_shell("git rev-parse HEAD", cwd=repo_dir, check=False)
+    return result.stdout.strip() if result.returncode == 0 else "missing"
+
+
+def installed_distributions() -> dict:
+    """Map normalized package name -> Distribution; the first one on sys.path wins, like imports."""
+    found = {}
+    for dist in distributions():
+        name = dist.metadata["Name"]
+        if name:
+            found.setdefault(re.sub(r"[-_.]+", "-", name).lower(), dist)
+    return found
+
+
+def installed_package_versions() -> dict:
+    return {name: dist.version for name, dist in installed_distributions().items()}
+
+
+def installed_packages_digest() -> str:
+    packages = sorted(f"{name}=={package_version}" for name, package_version in installed_package_versions().items())
+    return hashlib.sha256("\n".join(packages).encode("utf-8")).hexdigest()
+
+
+def inventory_digest() -> str:
+    inventory = {"nodes": CUSTOM_NODE_REPOS, "pins": CUSTOM_NODE_PINS, "models": model_tasks}
+    return hashlib.sha256(json.dumps(inventory, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def requirement_file_hashes() -> dict:
+    requirement_paths = [os.path.join(COMFY_CODE_DIR, "requirements.txt")]
+    requirement_paths += [
+        os.path.join(CUSTOM_NODES_DIR, repo.split("/")[-1], "requirements.txt")
+        for repo, install_reqs in CUSTOM_NODE_REPOS
+        if install_reqs
+    ]
+    return {path: file_sha256(path) if os.path.exists(path) else "missing" for path in requirement_paths}
+
+
+def compute_environment_fingerprint() -> dict:
+    return {
+        "comfyui": git_head_sha(COMFY_CODE_DIR),
+        "nodes": {repo: git_head_sha(os.path.join(CUSTOM_NODES_DIR, repo.split("/")[-1])) for repo, _ in CUSTOM_NODE_REPOS},
+        "requirements": requirement_file_hashes(),
+        "packages": installed_packages_digest(),
+        "inventory": inventory_digest(),
+    }
+
+
+def load_environment_fingerprint() -> Optional[dict]:
+    if not os.path.exists(ENVIRONMENT_FINGERPRINT_PATH):
+        return None
+    try:
+        with open(ENVIRONMENT_FINGERPRINT_PATH, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable environment fingerprint: {e}")
+        return None
+
+
+def save_environment_fingerprint(components: dict, refreshed_at: float):
+    os.makedirs(RUNTIME_STATE_DIR, exist_ok=True)
+    tmp_path = f"{ENVIRONMENT_FINGERPRINT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump({"components": components, "refreshed_at": refreshed_at}, handle, indent=2, sort_keys=True)
+    os.replace(tmp_path, ENVIRONMENT_FINGERPRINT_PATH)
+
+
+def check_environment_fingerprint(current: dict, stored: Optional[dict], now: float, ttl: float = ENVIRONMENT_FINGERPRINT_TTL) -> tuple:
+    """Return (volume_fresh, packages_fresh) for the current environment.
+
+    The volume part (git SHAs, requirement hashes, inventory) persists across
+    containers and expires after ttl so remote updates are still picked up on a
+    schedule. The package part describes this container's site-packages, so it
+    only matches when the runtime pip work is already reflected in it.
+    """
+    if not stored or now - stored.get("refreshed_at", 0) >= ttl:
+        return False, False
+
+    previous = stored.get("components", {})
+    volume_keys = ("comfyui", "nodes", "requirements", "inventory")
+    volume_fresh = all(current.get(key) == previous.get(key) for key in volume_keys)
+    packages_fresh = volume_fresh and current.get("packages") == previous.get("packages")
+    return volume_fresh, packages_fresh
+
+
+class BootstrapGraph:
+    """Run bootstrap steps concurrently, ordered only by the resources they touch.
+
+    Each step declares the resources it reads (inputs) and writes (outputs).
+    A step waits for every earlier step it conflicts with: read-after-write,
+    write-after-write and write-after-read on a shared resource. Declaration
+    order therefore still defines the meaning of the bootstrap, while steps on
+    disjoint directories (git repos, models, user config) run in parallel and
+    the pip steps stay serialized on "site_packages".
+    """
+
+    def __init__(self, max_workers: int = 8, listener=None):
+        self.max_workers = max_workers
+        # Optional progress listener with step_started(name) / step_finished(name, duration, ok).
+        self.listener = listener
+        self.steps = {}
+
+    def add(self, name: str, fn, inputs: tuple = (), outputs: tuple = ()):
+        deps = set()
+        for other in self.steps.values():
+            if (set(inputs) & other["outputs"]) or (set(outputs) & (other["outputs"] | other["inputs"])):
+                deps.add(other["name"])
+        self.steps[name] = {
+            "name": name,
+            "fn": fn,
+            "inputs": set(inputs),
+            "outputs": set(outputs),
+            "deps": deps,
+            "duration": 0.0,
+            "error": None,
+        }
+
+    def _run_step(self, step: dict):
+        started = time.perf_counter()
+        if self.listener:
+            self.listener.step_started(step["name"])
+        try:
+            step["fn"]()
+        except Exception as e:
+            step["error"] = e
+            print(f"Bootstrap step {step['name']} failed: {e}")
+        finally:
+            step["duration"] = time.perf_counter() - started
+            record_telemetry("bootstrap_step", name=step["name"], duration=round(step["duration"], 3), ok=step["error"] is None)
+            if self.listener:
+                self.listener.step_finished(step["name"], step["duration"], step["error"] is None)
+
+    def run(self) -> list:
+        """Run all steps and return the critical path as a list of step names."""
+        started = time.perf_counter()
+        done = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(done) < len(self.steps):
+                for name, step in self.steps.items():
+                    if name not in done and name not in running.values() and step["deps"] <= done:
+                        running[pool.submit(self._run_step, step)] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done.add(running.pop(future))
+
+        critical_path = self.critical_path()
+        self.report(time.perf_counter() - started, critical_path)
+        return critical_path
+
+    def critical_path(self) -> list:
+        chain_time = {}
+        chain_prev = {}
+        for name, step in self.steps.items():
+            prev = max(step["deps"], key=lambda dep: chain_time[dep], default=None)
+            chain_time[name] = step["duration"] + (chain_time[prev] if prev else 0.0)
+            chain_prev[name] = prev
+
+        path = []
+        name = max(chain_time, key=chain_time.get, default=None)
+        while name:
+            path.append(name)
+            name = chain_prev[name]
+        return path[::-1]
+
+    def report(self, wall_time: float, critical_path: list):
+        total = sum(step["duration"] for step in self.steps.values())
+        print(f"Bootstrap finished in {wall_time:.1f}s (sequential sum {total:.1f}s).")
+        for step in self.steps.values():
+            status = "failed" if step["error"] else "ok"
+            print(f"  {step['name']:<28} {step['duration']:7.1f}s  {status}")
+        critical_time = sum(self.steps[name]["duration"] for name in critical_path)
+        print(f"Critical path ({critical_time:.1f}s): {' -> '.join(critical_path)}")
+
+
+def uninstall_pip_comfyui_manager():
+    # Uninstall pip-installed comfyui-manager so the git-cloned version in
+    # custom_nodes/ is not "Blocked by policy".  The pip package provides
+    # backend middleware but its frontend JS (Manager button) is missing,
+    # while the git clone ships both.
+    print("Removing pip-installed comfyui-manager to avoid policy block...")
+    run_streaming(
+        ["/usr/local/bin/python", "-m", "pip", "uninstall", "-y", "comfyui-manager"],
+        "manager uninstall",
+    )
+
+
+def remote_file_size(repo: str, filename: str, subfolder: Optional[str]) -> Optional[int]:
+    if repo.startswith("http"):
+        return None
+    try:
+        return get_hf_file_metadata(hf_hub_url(repo_id=repo, filename=filename, subfolder=subfolder)).size
+    except Exception:
+        return None
+
+
+def track_download_progress(status, name: str, total: Optional[int]) -> threading.Event:
+    """Report bytes landing in TMP_DL to the status until the returned event is set."""
+    stop = threading.Event()
+    baseline = directory_size(TMP_DL)
+
+    def run():
+        while not stop.wait(DOWNLOAD_PROGRESS_INTERVAL):
+            status.download_progress(name, max(directory_size(TMP_DL) - baseline, 0), total)
+
+    status.download_progress(name, 0, total)
+    threading.Thread(target=run, name="download-progress", daemon=True).start()
+    return stop
+
+
+def download_missing_models(status=None):
+    print(f"Checking and downloading missing {BASE_MODEL_NAME} models...")
+    missing = []
+    for task in model_tasks:
+        sub, fn, repo, subf = task[:4]
+        local_fn = task[4] if len(task) > 4 else None
+
+        display_name = local_fn if local_fn else fn
+        target = os.path.join(MODELS_DIR, sub, display_name)
+
+        if not os.path.exists(target):
+            missing.append((sub, fn, repo, subf, local_fn, display_name, target))
+        else:
+            print(f"Model {display_name} already exists, skipping download")
+
+    if status:
+        status.downloads_planned(len(missing))
+    for sub, fn, repo, subf, local_fn, display_name, target in missing:
+        if shutdown_requested.is_set():
+            print("Shutting down: leaving remaining downloads for the next container")
+            break
+        print(f"Downloading {fn} as {display_name} to {target}...")
+        primary = {"repo_id": repo, "subfolder": subf}
+        stop = track_download_progress(status, display_name, remote_file_size(repo, fn, subf)) if status else None
+        try:
+            download_model(sub, fn, primary, local_filename=local_fn)
+        finally:
+            if stop:
+                stop.set()
+                status.download_finished(display_name)
+
+
+def dependency_fingerprint(baseline_packages: dict, requirement_hashes: dict) -> str:
+    """Hash every input of the runtime pip steps, starting from the image's package set."""
+    inputs = {
+        "base_image": BASE_IMAGE_VERSION,
+        "python": sys.version,
+        "baseline_packages": baseline_packages,
+        "requirements": requirement_hashes,
+        "upgrade": RUNTIME_UPGRADE_PACKAGES,
+        "uninstall": STRIP_HEAVY_TEMPLATES + ["comfyui-manager"],
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def site_packages_overlay_dir(fingerprint: str) -> str:
+    return os.path.join(SITE_PACKAGES_OVERLAY_ROOT, fingerprint[:16])
+
+
+def remove_distribution_files(dist):
+    """Delete an installed distribution's files (RECORD based) and the directories it leaves empty."""
+    parents = set()
+    for file in dist.files or []:
+        path = str(dist.locate_file(file))
+        parents.add(os.path.dirname(path))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    for parent in sorted(parents, key=len, reverse=True):
+        pycache = os.path.join(parent, "__pycache__")
+        if os.path.isdir(pycache) and os.listdir(parent) == ["__pycache__"]:
+            shutil.rmtree(pycache, ignore_errors=True)
+        try:
+            os.rmdir(parent)
+        except OSError:
+            pass
+
+
+def mount_site_packages_overlay(overlay_dir: str) -> bool:
+    """Put a captured overlay on sys.path for this process and every child Python."""
+    manifest_path = os.path.join(overlay_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, "r", encoding="utf-8") as handle:
+        manifest = json.load(handle)
+
+    # Drop the image's copies of packages the overlay replaces or removed, so
+    # neither imports nor importlib.metadata can see two versions.
+    system = installed_distributions()
+    for name in manifest["removed"] + sorted(manifest["installed"]):
+        if name in system:
+            remove_distribution_files(system[name])
+
+    overlay_site = os.path.join(overlay_dir, "site-packages")
+    pth_path = os.path.join(sysconfig.get_paths()["purelib"], SITE_PACKAGES_OVERLAY_PTH)
+    with open(pth_path, "w", encoding="utf-8") as handle:
+        handle.write(f"import site; site.addsitedir({overlay_site!r})\n")
+    site.addsitedir(overlay_site)
+    importlib.invalidate_caches()
+    print(f"Mounted site-packages overlay {overlay_dir}: {len(manifest['installed'])} installed, {len(manifest['removed'])} removed.")
+    return True
+
+
+def capture_site_packages_overlay(baseline_packages: dict, overlay_dir: str):
+    """Copy every package the runtime pip steps added or changed into overlay_dir."""
+    current = installed_distributions()
+    installed = {
+        name: dist.version
+        for name, dist in current.items()
+        if baseline_packages.get(name) != dist.version
+    }
+    removed = sorted(name for name in baseline_packages if name not in current)
+
+    tmp_dir = f"{overlay_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    overlay_site = os.path.join(tmp_dir, "site-packages")
+    os.makedirs(overlay_site)
+    for name in installed:
+        dist = current[name]
+        for file in dist.files or []:
+            # Skip console scripts and data files installed outside site-packages.
+            if str(file).startswith(".."):
+                continue
+            source = str(dist.locate_file(file))
+            if not os.path.isfile(source):
+                continue
+            target = os.path.join(overlay_site, str(file))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(source, target)
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as handle:
+        json.dump({"installed": installed, "removed": removed, "created_at": time.time()}, handle, indent=2, sort_keys=True)
+    shutil.rmtree(overlay_dir, ignore_errors=True)
+    os.replace(tmp_dir, overlay_dir)
+    print(f"Captured site-packages overlay {overlay_dir}: {len(installed)} installed, {len(removed)} removed.")
+
+    overlays = sorted(
+        (os.path.join(SITE_PACKAGES_OVERLAY_ROOT, entry) for entry in os.listdir(SITE_PACKAGES_OVERLAY_ROOT)),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for stale in overlays[SITE_PACKAGES_OVERLAY_KEEP:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
 def download_model(subdir: str, filename: str, primary_source: dict, backup_source: Optional[dict] = None, local_filename: Optional[str] = None):
     target_dir = os.path.join(MODELS_DIR, subdir)
     os.makedirs(target_dir, exist_ok=True)
@@ -385,7 +1106,7 @@ def download_model(subdir: str, filename: str, primary_source: dict, backup_sour
                 # Direct download from a resolved file URL.
                 download_url = source_url or repo
                 print(f"Downloading from URL: {download_url}")
-                subprocess.run(["wget", "-O", os.path.join(TMP_DL, filename), download_url], check=True)
+                subprocess.run(["wget", "-c", "-O", os.path.join(TMP_DL, filename), download_url], check=True)
                 shutil.move(f"{TMP_DL}/{filename}", target_path)
             else:
                 # HF download
@@ -402,26 +1123,936 @@ def download_model(subdir: str, filename: str, primary_source: dict, backup_sour
             else:
                 print("Trying next source...")
 
-# Build image with ComfyUI installed to default location /root/comfy/ComfyUI
+def iter_python_sources(root: str):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in BYTECODE_SKIP_DIRS and not d.startswith(".")]
+        for filename in filenames:
+            if filename.endswith(".py"):
+                yield os.path.join(dirpath, filename)
+
+
+def bytecode_is_current(source_path: str) -> bool:
+    """True when the cached pyc is an unchecked-hash pyc of the current source."""
+    try:
+        with open(importlib.util.cache_from_source(source_path), "rb") as handle:
+            header = handle.read(16)
+        with open(source_path, "rb") as handle:
+            source = handle.read()
+    except OSError:
+        return False
+    return (
+        header[:4] == importlib.util.MAGIC_NUMBER
+        and int.from_bytes(header[4:8], "little") == 0b01  # hash-based, unchecked
+        and header[8:16] == importlib.util.source_hash(source)
+    )
+
+
+def stale_bytecode_sources(paths: list) -> list:
+    with ThreadPoolExecutor(max_workers=BYTECODE_SCAN_WORKERS) as pool:
+        current = list(pool.map(bytecode_is_current, paths))
+    return [path for path, ok in zip(paths, current) if not ok]
+
+
+def compile_stale_bytecode(root: str):
+    """Recompile only sources whose pyc is missing or no longer matches, then verify.
+
+    Unchecked-hash pycs are never validated at import time, so every source a
+    git pull/reset touched must be recompiled here; the source hash stored in
+    the pyc is how changed files are found. Sources still stale afterwards
+    (syntax errors, read-only paths) are reported because their imports fall
+    back to compiling from source on every start.
+    """
+    sources = list(iter_python_sources(root))
+    stale = stale_bytecode_sources(sources)
+    print(f"Bytecode cache: {len(stale)} of {len(sources)} sources under {root} need compiling")
+    if stale:
+        workers = min(os.cpu_count() or 1, len(stale))
+        chunks = [stale[index::workers] for index in range(workers)]
+        cmd = ["/usr/local/bin/python", "-m", "compileall", "-q", "-f", "--invalidation-mode", "unchecked-hash"]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda chunk: run_streaming(cmd + chunk, "compileall", echo=False), chunks))
+        stale = stale_bytecode_sources(stale)
+
+    record_telemetry("bytecode_cache", root=root, sources=len(sources), fallback=len(stale))
+    if stale:
+        print(f"Warning: {len(stale)} sources will compile from source at import (no valid bytecode):")
+        for path in stale[:20]:
+            print(f"  {os.path.relpath(path, root)}")
+
+
+def custom_node_allowlist() -> list:
+    names = [repo.split("/")[-1] for repo, _ in CUSTOM_NODE_REPOS]
+    return names + [LAUNCHER_HOOKS_NAME] + CUSTOM_NODE_ALLOWLIST_EXTRA
+
+
+def report_pruned_custom_nodes(allowlist: list):
+    if not os.path.isdir(CUSTOM_NODES_DIR):
+        return
+    pruned = sorted(
+        entry for entry in os.listdir(CUSTOM_NODES_DIR)
+        if entry not in allowlist
+        and not entry.startswith((".", "__"))
+        and (os.path.isdir(os.path.join(CUSTOM_NODES_DIR, entry)) or entry.endswith(".py"))
+    )
+    if pruned:
+        print(f"Not loading {len(pruned)} custom nodes outside this stack: {', '.join(pruned)}")
+
+
+def gpu_driver_version() -> str:
+    try:
+        result = run_streaming(
+            ["nvidia-smi", "--query-gpu=driver_version", "--format=csv,noheader"],
+            "nvidia-smi",
+            echo=False,
+        )
+    except OSError:
+        return "nodriver"
+    lines = result.stdout.strip().splitlines()
+    return lines[0].strip() if result.returncode == 0 and lines else "nodriver"
+
+
+def kernel_cache_key(gpu_type: str, torch_version: str, driver: str) -> str:
+    raw = f"{gpu_type}-torch{torch_version}-driver{driver}"
+    return re.sub(r"[^A-Za-z0-9.+_-]", "_", raw)
+
+
+def current_kernel_cache_key() -> str:
+    try:
+        torch_version = version("torch")
+    except PackageNotFoundError:
+        torch_version = "none"
+    return kernel_cache_key(GPU_TYPE, torch_version, gpu_driver_version())
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def configure_kernel_cache(cache_dir: str, environ: dict = os.environ) -> dict:
+    """Point torch inductor, Triton and the CUDA JIT cache at cache_dir."""
+    cache_env = {
+        "TORCHINDUCTOR_CACHE_DIR": os.path.join(cache_dir, "inductor"),
+        "TORCHINDUCTOR_FX_GRAPH_CACHE": "1",
+        "TRITON_CACHE_DIR": os.path.join(cache_dir, "triton"),
+        "CUDA_CACHE_PATH": os.path.join(cache_dir, "cuda"),
+        "CUDA_CACHE_MAXSIZE": str(4 * 2**30),
+    }
+    for key in ("TORCHINDUCTOR_CACHE_DIR", "TRITON_CACHE_DIR", "CUDA_CACHE_PATH"):
+        os.makedirs(cache_env[key], exist_ok=True)
+    with open(os.path.join(cache_dir, KERNEL_CACHE_MARKER), "w") as handle:
+        handle.write(str(time.time()))
+    environ.update(cache_env)
+    return cache_env
+
+
+def kernel_cache_last_used(cache_dir: str) -> float:
+    try:
+        return os.path.getmtime(os.path.join(cache_dir, KERNEL_CACHE_MARKER))
+    except OSError:
+        return os.path.getmtime(cache_dir)
+
+
+def evict_kernel_caches(root: str, current_key: str, budget: int) -> list:
+    """Keep root under budget: drop least recently used keys, then the oldest current files."""
+    if not os.path.isdir(root):
+        return []
+    caches = {name: os.path.join(root, name) for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))}
+    sizes = {name: directory_size(path) for name, path in caches.items()}
+    total = sum(sizes.values())
+    removed = []
+    for name in sorted((name for name in caches if name != current_key), key=lambda name: kernel_cache_last_used(caches[name])):
+        if total <= budget:
+            break
+        shutil.rmtree(caches[name], ignore_errors=True)
+        total -= sizes[name]
+        removed.append(name)
+
+    if total > budget and current_key in caches:
+        files = []
+        for dirpath, _, filenames in os.walk(caches[current_key]):
+            for filename in filenames:
+                if filename == KERNEL_CACHE_MARKER:
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(files):
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed.append(os.path.relpath(path, root))
+
+    if removed:
+        print(f"Kernel cache: evicted {len(removed)} entries, {total / 2**30:.2f} GiB kept")
+    record_telemetry("kernel_cache_evict", removed=len(removed), bytes=total)
+    return removed
+
+
+def report_kernel_cache_growth(cache_dir: str, size_before: int, label: str) -> int:
+    """Warm-up hook: log how much compiled kernel state a warm-up run produced."""
+    grown = directory_size(cache_dir) - size_before
+    print(f"Kernel cache after {label}: {grown / 2**20:+.1f} MiB in {cache_dir}")
+    record_telemetry("kernel_cache_warmup", label=label, bytes=grown)
+    return grown
+
+
+def install_launcher_hooks():
+    if not os.path.isdir(LAUNCHER_HOOKS_SRC):
+        print(f"Warning: {LAUNCHER_HOOKS_SRC} not found, model hot registration disabled")
+        return
+    target_dir = os.path.join(CUSTOM_NODES_DIR, LAUNCHER_HOOKS_NAME)
+    shutil.copytree(LAUNCHER_HOOKS_SRC, target_dir, dirs_exist_ok=True)
+    print(f"Installed launcher hooks into {target_dir}")
+
+
+def snapshot_model_files(models_dir: str) -> dict:
+    """Map each model file (relative to models_dir) to its (size, mtime)."""
+    snapshot = {}
+    for root, dirs, files in os.walk(models_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.startswith(".") or name.endswith(MODEL_WATCH_IGNORED_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[os.path.relpath(path, models_dir)] = (stat.st_size, stat.st_mtime)
+    return snapshot
+
+
+def notify_model_refresh(added: list, removed: list) -> bool:
+    body = json.dumps({"added": sorted(added), "removed": sorted(removed)}).encode("utf-8")
+    request = urllib.request.Request(
+        f"{COMFYUI_LOCAL_URL}/launcher/models/refresh",
+        data=body,
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10):
+            return True
+    except (urllib.error.URLError, OSError) as e:
+        print(f"Model refresh notification failed (ComfyUI not ready?): {e}")
+        return False
+
+
+def code_inventory() -> dict:
+    """Code revisions of ComfyUI and its loaded nodes, and the installed package set."""
+    return {
+        "comfyui": git_head_sha(COMFY_CODE_DIR),
+        "nodes": {name: git_head_sha(os.path.join(CUSTOM_NODES_DIR, name)) for name in custom_node_allowlist()},
+        "packages": installed_packages_digest(),
+    }
+
+
+def inventory_key(inventory: dict) -> str:
+    return hashlib.sha256(json.dumps(inventory, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def frontend_inventory_key(model_files, code: Optional[dict] = None) -> str:
+    """Key of everything /object_info depends on: code revisions of loaded nodes and model names."""
+    return inventory_key({**(code or code_inventory()), "models": sorted(model_files)})
+
+
+def object_info_snapshot_path(key: str) -> str:
+    return os.path.join(OBJECT_INFO_SNAPSHOT_DIR, f"{key}.json.gz")
+
+
+def load_object_info_snapshot(key: str) -> Optional[bytes]:
+    try:
+        with gzip.open(object_info_snapshot_path(key), "rb") as handle:
+            return handle.read()
+    except (OSError, EOFError):
+        return None
+
+
+def save_object_info_snapshot(key: str, body: bytes):
+    os.makedirs(OBJECT_INFO_SNAPSHOT_DIR, exist_ok=True)
+    path = object_info_snapshot_path(key)
+    with gzip.open(f"{path}.tmp", "wb") as handle:
+        handle.write(body)
+    os.replace(f"{path}.tmp", path)
+
+    snapshots = sorted(
+        (os.path.join(OBJECT_INFO_SNAPSHOT_DIR, name) for name in os.listdir(OBJECT_INFO_SNAPSHOT_DIR) if name.endswith(".json.gz")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for stale in snapshots[OBJECT_INFO_SNAPSHOT_KEEP:]:
+        os.remove(stale)
+
+
+def publish_object_info(gateway, key: str):
+    """Hand the gateway an /object_info payload for key, computing it at most once per inventory."""
+    started = time.perf_counter()
+    body = load_object_info_snapshot(key)
+    source = "volume snapshot"
+    if body is None:
+        try:
+            with urllib.request.urlopen(f"{COMFYUI_LOCAL_URL}/object_info", timeout=300) as response:
+                body = response.read()
+            json.loads(body)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"object_info snapshot skipped: {e}")
+            return
+        save_object_info_snapshot(key, body)
+        source = "ComfyUI"
+    gateway.seed_route("/object_info", key, body)
+    print(f"object_info ({len(body) / 2**20:.1f} MiB) from {source} in {time.perf_counter() - started:.1f}s, key {key[:12]}")
+    record_telemetry("object_info_snapshot", source=source, bytes=len(body), duration=round(time.perf_counter() - started, 3))
+
+
+def refresh_frontend_inventory(gateway, model_files):
+    code = code_inventory()
+    key = frontend_inventory_key(model_files, code)
+    # Result cache entries stay valid across model changes (referenced files are
+    # hashed into their keys) but not across code or package changes.
+    gateway.set_inventory_key(key, environment_key=inventory_key(code))
+    publish_object_info(gateway, key)
+
+
+def watch_model_files(interval: int = MODEL_WATCH_INTERVAL, on_change=None):
+    """Poll MODELS_DIR and push new/removed files into the running ComfyUI.
+
+    on_change(known) is called with the current model snapshot at start and
+    after every change, before ComfyUI and the browser are notified.
+    """
+    known = snapshot_model_files(MODELS_DIR)
+    pending = {}
+    last_reload = time.monotonic()
+    print(f"Watching {MODELS_DIR} for new models ({len(known)} files known)...")
+    if on_change:
+        on_change(known)
+
+    while True:
+        time.sleep(interval)
+
+        # Pick up files committed to the volume by other containers.
+        if time.monotonic() - last_reload >= MODEL_VOLUME_RELOAD_INTERVAL:
+            last_reload = time.monotonic()
+            try:
+                vol.reload()
+            except Exception as e:
+                print(f"Volume reload skipped: {e}")
+
+        current = snapshot_model_files(MODELS_DIR)
+        removed = [path for path in known if path not in current]
+        for path in removed:
+            known.pop(path)
+
+        added = []
+        unstable = {}
+        for path, entry in current.items():
+            if path in known:
+                known[path] = entry
+            elif pending.get(path) == entry:
+                known[path] = entry
+                added.append(path)
+            else:
+                unstable[path] = entry
+        pending = unstable
+
+        if added or removed:
+            for path in added:
+                print(f"New model detected: {path}")
+            for path in removed:
+                print(f"Model removed: {path}")
+            # The frontend refetches /object_info as soon as it is notified, so the
+            # gateway must already have the new inventory key by then.
+            if on_change:
+                on_change(known)
+            notify_model_refresh(added, removed)
+
+
+def available_memory_bytes() -> int:
+    """MemAvailable, further limited by the cgroup memory limit when one is set."""
+    available = 0
+    try:
+        with open("/proc/meminfo") as handle:
+            for line in handle:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        return 0
+    try:
+        with open("/sys/fs/cgroup/memory.max") as handle:
+            limit = handle.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as handle:
+            current = int(handle.read().strip())
+        if limit != "max":
+            available = min(available, int(limit) - current)
+    except (OSError, ValueError):
+        pass
+    return max(available, 0)
+
+
+def prefetch_segment(path: str, offset: int, length: int) -> int:
+    """Read one byte range sequentially so it lands in the page cache."""
+    buffer = bytearray(min(PREFETCH_CHUNK_BYTES, length))
+    view = memoryview(buffer)
+    done = 0
+    with open(path, "rb", buffering=0) as handle:
+        handle.seek(offset)
+        while done < length:
+            read = handle.readinto(view[: min(len(buffer), length - done)])
+            if not read:
+                break
+            done += read
+    return done
+
+
+def prefetch_model_files(files: list, budget: int):
+    planned = []
+    for subdir, filename in files:
+        path = os.path.join(MODELS_DIR, subdir, filename)
+        if not os.path.exists(path):
+            continue
+        size = os.path.getsize(path)
+        if sum(planned_size for _, planned_size in planned) + size > budget:
+            print(f"Prefetch: skipping {filename} ({size / 2**30:.1f} GiB), over the {budget / 2**30:.1f} GiB budget")
+            continue
+        planned.append((path, size))
+    if not planned:
+        return
+
+    started = time.perf_counter()
+    segments = [
+        (path, offset, min(PREFETCH_SEGMENT_BYTES, size - offset))
+        for path, size in planned
+        for offset in range(0, size, PREFETCH_SEGMENT_BYTES)
+    ]
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as pool:
+        total = sum(pool.map(lambda segment: prefetch_segment(*segment), segments))
+    duration = time.perf_counter() - started
+    print(f"Prefetch: read {total / 2**30:.1f} GiB of base models in {duration:.1f}s ({total / 2**20 / max(duration, 1e-6):.0f} MiB/s)")
+    record_telemetry("model_prefetch", files=len(planned), bytes=total, duration=round(duration, 3))
+
+
+def start_model_prefetch() -> threading.Thread:
+    budget = int(available_memory_bytes() * PREFETCH_MEMORY_FRACTION)
+
+    def run():
+        try:
+            prefetch_model_files(PREFETCH_MODEL_FILES, budget)
+        except OSError as e:
+            print(f"Prefetch failed: {e}")
+
+    thread = threading.Thread(target=run, name="model-prefetch", daemon=True)
+    thread.start()
+    return thread
+
+
+def comfy_api(path: str, payload: Optional[dict] = None, base_url: str = COMFYUI_LOCAL_URL, timeout: float = 10, headers: Optional[dict] = None):
+    """GET (or POST when payload is given) a ComfyUI API route and decode its JSON reply."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(
+        f"{base_url}{path}",
+        data=data,
+        headers={"Content-Type": "application/json", **(headers or {})},
+        method="POST" if data is not None else "GET",
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = response.read()
+    return json.loads(body) if body else {}
+
+
+def wait_for_comfyui(base_url: str = COMFYUI_LOCAL_URL, timeout: float = COMFYUI_READY_TIMEOUT, process=None) -> bool:
+    """Poll until ComfyUI answers; gives up early if its process has exited."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            comfy_api("/system_stats", base_url=base_url, timeout=5)
+            return True
+        except (urllib.error.URLError, OSError, ValueError):
+            time.sleep(WARMUP_POLL_INTERVAL)
+    return False
+
+
+def build_warmup_prompt() -> dict:
+    """API-format Krea 2 Turbo graph: base models, 8 steps, 512x512, preview only."""
+    return {
+        "1": {"class_type": "UNETLoader", "inputs": {"unet_name": "Krea2_Turbo_fp8mixed.safetensors", "weight_dtype": "default"}},
+        "2": {"class_type": "CLIPLoader", "inputs": {"clip_name": "qwen3vl_4b_fp8_scaled.safetensors", "type": "krea2"}},
+        "3": {"class_type": "VAELoader", "inputs": {"vae_name": "qwen_image_vae.safetensors"}},
+        "4": {"class_type": "CLIPTextEncode", "inputs": {"text": "a photo of a lighthouse at dusk", "clip": ["2", 0]}},
+        "5": {"class_type": "EmptySD3LatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "6": {
+            "class_type": "KSampler",
+            "inputs": {
+                "model": ["1", 0],
+                "positive": ["4", 0],
+                "negative": ["4", 0],
+                "latent_image": ["5", 0],
+                "seed": 0,
+                "steps": 8,
+                "cfg": 1.0,
+                "sampler_name": "euler",
+                "scheduler": "simple",
+                "denoise": 1.0,
+            },
+        },
+        "7": {"class_type": "VAEDecode", "inputs": {"samples": ["6", 0], "vae": ["3", 0]}},
+        "8": {"class_type": "PreviewImage", "inputs": {"images": ["7", 0]}},
+    }
+
+
+def queued_prompt_ids(queue: dict) -> set:
+    entries = queue.get("queue_running", []) + queue.get("queue_pending", [])
+    return {entry[1] for entry in entries if len(entry) > 1}
+
+
+def run_warmup(base_url: str = COMFYUI_LOCAL_URL, timeout: float = WARMUP_TIMEOUT) -> dict:
+    """Queue the warm-up prompt and wait for it, backing off for real prompts.
+
+    Returns {"status": completed|cancelled|skipped|failed|timeout, "duration": s}.
+    """
+    started = time.perf_counter()
+
+    def result(status: str, **fields) -> dict:
+        outcome = {"status": status, "duration": round(time.perf_counter() - started, 3), **fields}
+        record_telemetry("warmup", **outcome)
+        return outcome
+
+    try:
+        if queued_prompt_ids(comfy_api("/queue", base_url=base_url)):
+            return result("skipped", reason="queue busy")
+        reply = comfy_api("/prompt", {"prompt": build_warmup_prompt(), "client_id": WARMUP_CLIENT_ID}, base_url=base_url)
+    except urllib.error.HTTPError as e:
+        return result("failed", reason=f"HTTP {e.code}: {e.read().decode('utf-8', 'replace')[:500]}")
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        return result("failed", reason=str(e))
+    prompt_id = reply.get("prompt_id")
+    if not prompt_id:
+        return result("failed", reason=f"no prompt_id in {reply}")
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            history = comfy_api(f"/history/{prompt_id}", base_url=base_url)
+            if prompt_id in history:
+                status = history[prompt_id].get("status", {})
+                ok = status.get("status_str", "success") == "success"
+                return result("completed" if ok else "failed", prompt_id=prompt_id)
+            queue = comfy_api("/queue", base_url=base_url)
+            if queued_prompt_ids(queue) - {prompt_id}:
+                # A real prompt is waiting: drop ours if still pending, otherwise interrupt it.
+                pending = {entry[1] for entry in queue.get("queue_pending", []) if len(entry) > 1}
+                if prompt_id in pending:
+                    comfy_api("/queue", {"delete": [prompt_id]}, base_url=base_url)
+                else:
+                    comfy_api("/interrupt", {"prompt_id": prompt_id}, base_url=base_url)
+                return result("cancelled", prompt_id=prompt_id)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"Warm-up poll failed: {e}")
+        time.sleep(WARMUP_POLL_INTERVAL)
+    return result("timeout", prompt_id=prompt_id)
+
+
+def start_warmup(kernel_cache_dir: str) -> threading.Thread:
+    def run():
+        kernel_cache_size = directory_size(kernel_cache_dir)
+        outcome = run_warmup()
+        print(f"Warm-up {outcome['status']} in {outcome['duration']:.1f}s" + (f" ({outcome['reason']})" if "reason" in outcome else ""))
+        report_kernel_cache_growth(kernel_cache_dir, kernel_cache_size, "warm-up")
+        flush_telemetry()
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+volume_dirty = threading.Event()
+shutdown_requested = threading.Event()
+
+
+def commit_volume_when_dirty():
+    while True:
+        volume_dirty.wait()
+        time.sleep(VOLUME_COMMIT_INTERVAL)
+        volume_dirty.clear()
+        try:
+            vol.commit()
+        except Exception as e:
+            print(f"Volume commit failed: {e}")
+
+
+def drain_comfyui(
+    process,
+    gateway=None,
+    base_url: str = COMFYUI_LOCAL_URL,
+    grace: float = DRAIN_GRACE_SECONDS,
+    commit=None,
+    budget: float = DRAIN_BUDGET_SECONDS,
+) -> dict:
+    """Stop intake, let the running prompt finish within grace, then stop ComfyUI and persist state.
+
+    Pending prompts are cleared from ComfyUI but stay queued in the gateway
+    journal, so the next container replays them (as it does an interrupted one).
+    Every step is cut short so the drain returns within budget seconds.
+    """
+    started = time.monotonic()
+    deadline = started + budget
+    shutdown_requested.set()
+    if gateway is not None:
+        gateway.start_draining()
+
+    def remaining(reserve: float = 0.0) -> float:
+        return max(0.0, deadline - reserve - time.monotonic())
+
+    finished = interrupted = False
+    if process is not None and process.poll() is None:
+        grace_until = min(started + grace, deadline - DRAIN_TERMINATE_SECONDS - DRAIN_COMMIT_RESERVE_SECONDS)
+        try:
+            comfy_api("/queue", {"clear": True}, base_url=base_url, timeout=max(remaining(DRAIN_TERMINATE_SECONDS), 0.1))
+            while time.monotonic() < grace_until:
+                if not comfy_api("/queue", base_url=base_url, timeout=max(grace_until - time.monotonic(), 0.1)).get("queue_running"):
+                    finished = True
+                    break
+                time.sleep(min(DRAIN_POLL_INTERVAL, max(grace_until - time.monotonic(), 0.0)))
+            if not finished:
+                comfy_api("/interrupt", {}, base_url=base_url, timeout=max(remaining(DRAIN_TERMINATE_SECONDS), 0.1))
+                interrupted = True
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"Drain: ComfyUI API unavailable ({e}), stopping it directly")
+        process.terminate()
+        try:
+            process.wait(timeout=min(DRAIN_TERMINATE_SECONDS, remaining(DRAIN_COMMIT_RESERVE_SECONDS)))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    # Outputs and partial downloads are plain files on the volume: flush, then
+    # commit. Either can block on the network, so they run on a thread that is
+    # abandoned at the deadline.
+    committed = threading.Event()
+
+    def persist():
+        os.sync()
+        flush_telemetry()
+        if commit is not None:
+            try:
+                commit()
+                committed.set()
+            except Exception as e:
+                print(f"Drain: volume commit failed: {e}")
+
+    persister = threading.Thread(target=persist, name="drain-persist", daemon=True)
+    persister.start()
+    persister.join(remaining())
+    if persister.is_alive():
+        print(f"Drain: sync/commit still running after the {budget:.0f}s budget, giving up on it")
+    outcome = {
+        "duration": round(time.monotonic() - started, 3),
+        "interrupted": interrupted,
+        "committed": committed.is_set(),
+    }
+    print(f"Drained in {outcome['duration']:.1f}s (running prompt {'interrupted' if interrupted else 'finished or idle'})")
+    return outcome
+
+
+def drain_on_exit(gateway, processes: list, commit=None, **drain_args) -> Optional[dict]:
+    """Body of the container's @modal.exit hook: drain once, with whatever has started by now.
+
+    Modal owns the container's signal handlers and runs exit hooks on
+    scale-down, preemption and timeouts, inside its shutdown grace period.
+    """
+    if shutdown_requested.is_set():
+        return None
+    return drain_comfyui(processes[0] if processes else None, gateway, commit=commit, **drain_args)
+
+
+def keepalive_decision(
+    bootstrapping: bool,
+    queue_running: int,
+    queue_pending: int,
+    draining: bool,
+    held: bool = False,
+    active_websockets: int = 0,
+) -> tuple:
+    """Return (keep_alive, reason) for one monitor tick."""
+    if draining:
+        return False, "draining"
+    if bootstrapping:
+        return True, "bootstrap"
+    if queue_running or queue_pending:
+        return True, f"queue {queue_running} running / {queue_pending} pending"
+    if active_websockets:
+        return True, f"{active_websockets} websocket(s) open"
+    if held:
+        return True, "prewarm hold"
+    return False, "idle"
+
+
+def monitor_activity(gateway, status, web_url: Optional[str], interval: float = KEEPALIVE_INTERVAL):
+    metrics = {"decision": None, "reason": None, "pings": 0, "ping_failures": 0, "busy_seconds": 0.0, "idle_seconds": 0.0}
+    last_tick = time.monotonic()
+    while True:
+        queue_running = queue_pending = 0
+        if status.ready:
+            try:
+                queue = comfy_api("/queue")
+                queue_running, queue_pending = len(queue.get("queue_running", [])), len(queue.get("queue_pending", []))
+            except (urllib.error.URLError, OSError, ValueError):
+                pass
+        bootstrapping = not status.ready and status.error is None
+        activity = gateway.activity()
+        if activity["first_request_at"] is not None and not metrics.get("session_recorded"):
+            # Session history for the prewarm scheduler; prewarm pings never count.
+            record_telemetry(
+                "session_start",
+                ts=round(activity["first_request_at"], 3),
+                ready=activity["first_request_ready"],
+                prewarmed=activity["prewarmed"],
+            )
+            flush_telemetry()
+            volume_dirty.set()
+            metrics["session_recorded"] = True
+        held = activity["hold_until"] > time.time()
+        keep, reason = keepalive_decision(
+            bootstrapping,
+            queue_running,
+            queue_pending,
+            shutdown_requested.is_set(),
+            held,
+            activity["active_websockets"],
+        )
+
+        now = time.monotonic()
+        metrics["busy_seconds" if keep else "idle_seconds"] += round(now - last_tick, 1)
+        last_tick = now
+        if keep != metrics["decision"]:
+            print(f"Keepalive: {'holding' if keep else 'releasing'} container ({reason})")
+            record_telemetry("keepalive", keep=keep, reason=reason)
+        metrics.update(decision=keep, reason=reason, queue_running=queue_running, queue_pending=queue_pending, updated_at=time.time())
+
+        if keep and web_url:
+            try:
+                with urllib.request.urlopen(f"{web_url}/launcher/keepalive", timeout=10):
+                    metrics["pings"] += 1
+            except (urllib.error.URLError, OSError) as e:
+                metrics["ping_failures"] += 1
+                print(f"Keepalive ping failed: {e}")
+        gateway.set_activity_report(dict(metrics))
+        if shutdown_requested.is_set():
+            return
+        time.sleep(interval)
+
+
+def load_bootstrap_duration() -> Optional[float]:
+    try:
+        with open(BOOTSTRAP_DURATION_PATH, "r", encoding="utf-8") as handle:
+            return float(json.load(handle)["seconds"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_bootstrap_duration(seconds: float):
+    os.makedirs(RUNTIME_STATE_DIR, exist_ok=True)
+    with open(BOOTSTRAP_DURATION_PATH, "w", encoding="utf-8") as handle:
+        json.dump({"seconds": round(seconds, 1)}, handle)
+
+
+def load_session_starts(path: str = TELEMETRY_PATH) -> list:
+    """Session start times recorded by monitor_activity, oldest first."""
+    starts = []
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("event") == "session_start" and isinstance(event.get("ts"), (int, float)):
+                    starts.append(float(event["ts"]))
+    except OSError:
+        return []
+    return sorted(starts)
+
+
+def session_probability(
+    session_starts: list,
+    window_start: float,
+    window_seconds: float,
+    lookback_days: int = PREWARM_LOOKBACK_DAYS,
+    half_life_days: float = PREWARM_HALF_LIFE_DAYS,
+    min_history_days: float = PREWARM_MIN_HISTORY_DAYS,
+) -> float:
+    """Probability that a session starts in [window_start, window_start + window_seconds).
+
+    Each of the previous lookback_days contributes the same time-of-day window,
+    weighted by 0.5 ** (age / half_life_days); the result is the weighted share
+    of those days that had a session start in it. Days before the first
+    recorded session are not counted, and a history shorter than
+    min_history_days predicts nothing.
+    """
+    day = 86400
+    if not session_starts or window_start - min(session_starts) < min_history_days * day:
+        return 0.0
+    first = min(session_starts)
+    weighted_days = weighted_hits = 0.0
+    for age in range(1, lookback_days + 1):
+        start = window_start - age * day
+        if start + window_seconds <= first:
+            break
+        weight = 0.5 ** ((age - 1) / half_life_days)
+        weighted_days += weight
+        if any(start <= ts < start + window_seconds for ts in session_starts):
+            weighted_hits += weight
+    return weighted_hits / weighted_days if weighted_days else 0.0
+
+
+def prewarm_budget_day(now: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+
+def load_prewarm_ledger(path: str = PREWARM_LEDGER_PATH) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_prewarm_ledger(ledger: dict, path: str = PREWARM_LEDGER_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(ledger, handle, indent=2, sort_keys=True)
+
+
+def charge_prewarm_ledger(ledger: dict, now: float, seconds: float, covered_until: float) -> dict:
+    """Return ledger with seconds of warm time spent today and the new coverage end."""
+    day = prewarm_budget_day(now)
+    spent = ledger.get("spent_seconds", 0.0) if ledger.get("day") == day else 0.0
+    return {
+        **ledger,
+        "day": day,
+        "spent_seconds": round(spent + seconds, 1),
+        "warms": (ledger.get("warms", 0) if ledger.get("day") == day else 0) + 1,
+        "covered_until": max(covered_until, ledger.get("covered_until", 0.0)),
+    }
+
+
+def prewarm_decision(
+    session_starts: list,
+    now: float,
+    lead_seconds: float,
+    cost_seconds: float,
+    ledger: dict,
+    window_seconds: float = PREWARM_WINDOW_SECONDS,
+    threshold: float = PREWARM_THRESHOLD,
+    budget_seconds: float = PREWARM_DAILY_BUDGET_SECONDS,
+) -> tuple:
+    """Return (warm, reason, probability) for one scheduler tick.
+
+    The window looked at starts lead_seconds from now, the time a warm-up needs
+    to be ready. An earlier warm-up that still covers the window start and the
+    daily budget (cost_seconds per warm-up) both veto a warm-up.
+    """
+    window_start = now + lead_seconds
+    probability = session_probability(session_starts, window_start, window_seconds)
+    if probability < threshold:
+        return False, f"session probability {probability:.2f} below {threshold:.2f}", probability
+    if ledger.get("covered_until", 0.0) > window_start:
+        return False, "window already covered by an earlier warm-up", probability
+    spent = ledger.get("spent_seconds", 0.0) if ledger.get("day") == prewarm_budget_day(now) else 0.0
+    if spent >= budget_seconds or spent + cost_seconds > budget_seconds:
+        return False, f"daily budget reached ({spent:.0f}s of {budget_seconds:.0f}s spent, {cost_seconds:.0f}s needed)", probability
+    return True, f"session probability {probability:.2f}", probability
+
+
+def read_volume_lease(path: str = VOLUME_LEASE_PATH) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def volume_lease_active(lease: dict, now: float) -> bool:
+    return lease.get("until", 0.0) > now
+
+
+def write_volume_lease(owner: str, seconds: float, path: str = VOLUME_LEASE_PATH) -> dict:
+    """Claim the volume's code/package trees for seconds; a crashed owner's lease simply expires."""
+    lease = {"owner": owner, "acquired_at": time.time(), "until": time.time() + seconds}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(lease, handle)
+    return lease
+
+
+def release_volume_lease(path: str = VOLUME_LEASE_PATH):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def wait_for_volume_lease(status, path: str = VOLUME_LEASE_PATH, poll: float = VOLUME_LEASE_POLL_INTERVAL):
+    """Block the GPU bootstrap while a prewarm hydration is writing to the volume."""
+    lease = read_volume_lease(path)
+    if not volume_lease_active(lease, time.time()):
+        return
+    status.set_phase("waiting for volume hydration")
+    print(f"Volume is being hydrated by {lease.get('owner')}, waiting up to {lease['until'] - time.time():.0f}s")
+    started = time.monotonic()
+    while volume_lease_active(lease, time.time()):
+        time.sleep(poll)
+        try:
+            vol.reload()
+        except Exception as e:
+            print(f"Volume reload skipped: {e}")
+        lease = read_volume_lease(path)
+    record_telemetry("volume_lease_wait", seconds=round(time.monotonic() - started, 1))
+
+
+def start_model_watcher(on_change=None) -> threading.Thread:
+    watcher = threading.Thread(target=watch_model_files, kwargs={"on_change": on_change}, name="model-watcher", daemon=True)
+    watcher.start()
+    return watcher
+
+# Stack image: shared ComfyUI base (comfyui_base_image.py) + stack-specific layers
 image = (
-    modal.Image.debian_slim(python_version="3.12")
-    .apt_install("git", "wget", "libgl1-mesa-glx", "libglib2.0-0", "ffmpeg", "imagemagick", "libmagickwand-dev")
+    comfyui_base_image()
     # Libraries required by the custom nodes (kept aligned with the klein9b stack).
     .pip_install("psd-tools", "PyWavelets", "tiktoken", "Wand", "gguf", "diffusers", "peft", "rotary_embedding_torch", "omegaconf", "blake3", "comfy-aimdo", "comfy-kitchen", "piexif")
-    .run_commands([
-        # Bake latest pip/comfy-cli/uv into image to avoid runtime upgrades (~9s saved)
-        "pip install --no-cache-dir --upgrade pip comfy-cli uv",
-        "pip install --no-cache-dir --force-reinstall --index-url https://download.pytorch.org/whl/cu126 torch==2.11.0 torchvision==0.26.0 torchaudio==2.11.0",
-        "uv pip install --system --compile-bytecode huggingface_hub[hf_transfer]==0.28.1",
-        # Install ComfyUI to default location
-        "comfy --skip-prompt install --nvidia"
-    ])
-    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
 )
 
-# Bake custom nodes into the image; runtime sync_custom_node_repos keeps them updated.
-for repo, install_reqs in CUSTOM_NODE_REPOS:
-    image = image.run_commands([git_clone_cmd(repo, install_reqs=install_reqs)])
+# Bake custom nodes into the image as a single parallel-clone layer keyed by the
+# pinned node set; runtime sync_custom_node_repos keeps them updated.
+image = image.run_commands([
+    # Depth-1 ComfyUI: the runtime sync fetches origin/<branch> itself, so the
+    # shared base keeps its full clone for the other launchers.
+    git_compact_history_cmd(DEFAULT_COMFY_DIR),
+    custom_node_layer_cmd(CUSTOM_NODE_REPOS, CUSTOM_NODE_PINS),
+    # Precompiled bytecode for the local code layout (and the first copy to the volume).
+    f"python -m compileall -q -j 0 --invalidation-mode unchecked-hash {DEFAULT_COMFY_DIR}",
+])
+image = image.env({"COMFY_CODE_LAYOUT": CODE_LAYOUT, "COMFY_PREWARM_MODE": PREWARM_MODE})
+
+# Launcher hooks are copied into custom_nodes/ at runtime by install_launcher_hooks().
+image = image.add_local_dir(LAUNCHER_HOOKS_SRC, remote_path=f"/root/{LAUNCHER_HOOKS_NAME}")
+# The base image, gateway and result cache modules are imported at container start too.
+image = image.add_local_python_source("comfyui_base_image", "comfyui_gateway", "comfyui_result_cache")
 
 # Krea 2 Turbo assets.
 #   - Model: FP8 (mixed) quant of the FLUX 2-architecture Krea 2 Turbo, ideal for L40S (Ada/RTX 40xx).
@@ -497,49 +2128,115 @@ vol = modal.Volume.from_name("comfyui-krea2", create_if_missing=True)
 
 app = modal.App(name=APP_NAME, image=image)
 
-@app.function(
+@app.cls(
     max_containers=1,
-    scaledown_window=300,
+    scaledown_window=SCALEDOWN_WINDOW,
     timeout=7200,
     gpu=GPU_TYPE,
     volumes={DATA_ROOT: vol},
 )
 @modal.concurrent(max_inputs=10)
-@modal.web_server(8000, startup_timeout=1800)
-def ui():
-    ensure_comfyui_on_volume()
-
-    update_comfyui_backend_author_style()
-    ensure_comfy_kitchen_upgraded()
-    # v2: removed upgrade_runtime_tools_author_style() — pip/comfy-cli baked in image (~9s saved)
-    # v2: replaced update_comfyui_frontend with hash-based sync (~23s saved)
-    sync_frontend_requirements(os.path.join(DATA_BASE, "requirements.txt"))
-    strip_workflow_template_media()
-    update_comfyui_manager_author_style()
-    configure_comfyui_manager_author_style()
+class ComfyUIServer:
+    """The GPU container: gateway on GATEWAY_PORT, ComfyUI behind it, drained on exit."""
+
+    gateway = None
+    processes = ()
+
+    @modal.web_server(GATEWAY_PORT, startup_timeout=300)
+    def ui(self):
+        # The public port answers right away with bootstrap status; the bootstrap
+        # itself runs in the background, so its length no longer counts against the
+        # web server startup timeout. aiohttp is only importable inside the container.
+        from comfyui_gateway import BootstrapStatus, start_gateway
+        from comfyui_result_cache import ResultCache
+
+        status = BootstrapStatus(expected_seconds=load_bootstrap_duration())
+        os.makedirs(RUNTIME_STATE_DIR, exist_ok=True)
+        threading.Thread(target=commit_volume_when_dirty, name="volume-commit", daemon=True).start()
+        result_cache = None
+        if RESULT_CACHE_BUDGET_BYTES > 0:
+            result_cache = ResultCache(
+                RESULT_CACHE_DIR,
+                RESULT_CACHE_BUDGET_BYTES,
+                MODELS_DIR,
+                {kind: os.path.join(COMFY_CODE_DIR, kind) for kind in ("output", "temp", "input")},
+            )
+        self.gateway = start_gateway(
+            status,
+            GATEWAY_PORT,
+            COMFYUI_LOCAL_URL,
+            journal_path=PROMPT_JOURNAL_PATH,
+            on_journal_change=volume_dirty.set,
+            coalesce_wait=PROMPT_COALESCE_WAIT,
+            lanes=PROMPT_LANES,
+            result_cache=result_cache,
+            on_result_change=volume_dirty.set,
+        )
+        self.processes = []
+        threading.Thread(target=run_bootstrap, args=(status, self.gateway, self.processes), name="bootstrap", daemon=True).start()
+        try:
+            web_url = ui_endpoint().get_web_url()
+        except Exception as e:
+            web_url = None
+            print(f"Keepalive pings disabled, web URL unavailable: {e}")
+        threading.Thread(target=monitor_activity, args=(self.gateway, status, web_url), name="activity-monitor", daemon=True).start()
 
-    # Uninstall pip-installed comfyui-manager so the git-cloned version in
-    # custom_nodes/ is not "Blocked by policy".  The pip package provides
-    # backend middleware but its frontend JS (Manager button) is missing,
-    # while the git clone ships both.
-    print("Removing pip-installed comfyui-manager to avoid policy block...")
-    subprocess.run(
-        ["/usr/local/bin/python", "-m", "pip", "uninstall", "-y", "comfyui-manager"],
-        capture_output=True, text=True,
-    )
+    @modal.exit()
+    def drain(self):
+        drain_on_exit(self.gateway, self.processes, commit=vol.commit)
 
-    try:
-        sync_custom_node_repos()
-    except Exception as e:
-        print(f"Unexpected error during custom node sync: {e}")
 
-    print("Probing runtime dependencies before launching ComfyUI...")
+def ui_endpoint():
+    """The deployed ui web endpoint, for its URL and container stats."""
+    return ComfyUIServer().ui
+
+
+def run_bootstrap(status, gateway, processes: list):
+    started = time.perf_counter()
     try:
-        probe_runtime_dependencies()
+        bootstrap_and_launch(status, gateway, processes)
     except Exception as e:
-        print(f"Runtime dependency probe failed: {e}")
-        raise
-    print("Runtime dependency probe passed.")
+        print(f"Bootstrap failed: {e}")
+        status.fail(str(e))
+        return
+    if status.ready:
+        save_bootstrap_duration(time.perf_counter() - started)
+    flush_telemetry()
+
+
+def prepare_environment(status, gpu: bool = True, fresh_until: Optional[float] = None) -> Optional[str]:
+    """Bring code, packages, models and bytecode on the volume up to date.
+
+    Everything before the ComfyUI launch, shared by the GPU bootstrap and the
+    CPU hydration run of the prewarm scheduler (gpu=False skips the kernel
+    cache). Returns the kernel cache directory, or None without a GPU.
+    """
+    status.set_phase("preparing volume")
+    code_on_volume = CODE_LAYOUT == "volume"
+    if code_on_volume:
+        ensure_comfyui_on_volume()
+
+    # Image package set, before any overlay or runtime pip work touches it.
+    baseline_packages = installed_package_versions()
+    stored_fingerprint = load_environment_fingerprint()
+    current_fingerprint = compute_environment_fingerprint()
+    # A hydration run ahead of a session treats a fingerprint that expires before
+    # fresh_until as stale already, so the session itself boots on the fast path.
+    checked_at = max(time.time(), fresh_until or 0.0)
+    volume_fresh, _ = check_environment_fingerprint(current_fingerprint, stored_fingerprint, checked_at)
+    # Whether a stored overlay replaced the runtime pip steps in this container.
+    overlay = {"mounted": False}
+    if volume_fresh:
+        overlay_dir = site_packages_overlay_dir(dependency_fingerprint(baseline_packages, current_fingerprint["requirements"]))
+        if mount_site_packages_overlay(overlay_dir):
+            overlay["mounted"] = True
+            current_fingerprint["packages"] = installed_packages_digest()
+    volume_fresh, packages_fresh = check_environment_fingerprint(current_fingerprint, stored_fingerprint, checked_at)
+    if volume_fresh:
+        age_hours = (time.time() - stored_fingerprint["refreshed_at"]) / 3600
+        print(f"Environment fingerprint unchanged ({age_hours:.1f}h old): skipping backend, manager and custom node git sync.")
+    if packages_fresh:
+        print("Installed packages already match the fingerprint: skipping runtime pip steps.")
 
     # Ensure all required directories exist for the Krea 2 Turbo stack
     required_dirs = [
@@ -555,28 +2252,114 @@ def ui():
 
     for d in required_dirs:
         os.makedirs(d, exist_ok=True)
-
+    kernel_cache_key_now = kernel_cache_dir = None
+    if gpu:
+        kernel_cache_key_now = current_kernel_cache_key()
+        kernel_cache_dir = os.path.join(KERNEL_CACHE_ROOT, kernel_cache_key_now)
+        os.makedirs(kernel_cache_dir, exist_ok=True)
+        configure_kernel_cache(kernel_cache_dir)
+        print(f"Kernel caches (inductor/Triton/CUDA) at {kernel_cache_dir}")
+    if not code_on_volume:
+        link_volume_data_dirs()
+
+    # Steps run concurrently unless they share a resource; all pip work is
+    # serialized on "site_packages" in the order declared here.
+    status.set_phase("bootstrap")
+    graph = BootstrapGraph(listener=status)
+    # With the local layout the code is immutable per image: no git steps at boot.
+    if not volume_fresh and code_on_volume:
+        graph.add("backend_pull", update_comfyui_backend_author_style, outputs=("comfyui_code",))
+        graph.add("manager_update", update_comfyui_manager_author_style, outputs=("custom_nodes",))
+        graph.add("custom_node_sync", partial(sync_custom_node_repos, install_reqs=False), outputs=("custom_nodes",))
+    graph.add("manager_config", configure_comfyui_manager_author_style, outputs=("user_config",))
+    if not packages_fresh:
+        def mount_synced_overlay():
+            # After the git steps: the synced requirement files pick the overlay,
+            # so an expired TTL or an unrelated code update still skips pip.
+            if overlay["mounted"]:
+                return
+            fingerprint = dependency_fingerprint(baseline_packages, requirement_file_hashes())
+            overlay["mounted"] = mount_site_packages_overlay(site_packages_overlay_dir(fingerprint))
+            if overlay["mounted"]:
+                print("Site-packages overlay matches the synced requirements: skipping runtime pip steps.")
+
+        def unless_overlay(step):
+            return lambda: None if overlay["mounted"] else step()
+
+        graph.add("overlay_mount", mount_synced_overlay, inputs=("comfyui_code", "custom_nodes"), outputs=("site_packages",))
+        graph.add("comfy_kitchen_upgrade", unless_overlay(ensure_comfy_kitchen_upgraded), outputs=("site_packages",))
+        # v2: removed upgrade_runtime_tools_author_style() — pip/comfy-cli baked in image (~9s saved)
+        # v2: replaced update_comfyui_frontend with hash-based sync (~23s saved)
+        graph.add(
+            "frontend_requirements",
+            unless_overlay(partial(sync_frontend_requirements, os.path.join(COMFY_CODE_DIR, "requirements.txt"))),
+            inputs=("comfyui_code",),
+            outputs=("site_packages",),
+        )
+        graph.add("strip_template_media", unless_overlay(strip_workflow_template_media), outputs=("site_packages",))
+        graph.add("manager_pip_uninstall", unless_overlay(uninstall_pip_comfyui_manager), outputs=("site_packages",))
+        graph.add(
+            "custom_node_requirements",
+            unless_overlay(install_all_custom_node_requirements),
+            inputs=("custom_nodes",),
+            outputs=("site_packages",),
+        )
+    graph.add("launcher_hooks", install_launcher_hooks, outputs=("launcher_hooks",))
     # Download Krea 2 Turbo models at runtime (only if missing)
-    print(f"Checking and downloading missing {BASE_MODEL_NAME} models...")
-    for task in model_tasks:
-        sub, fn, repo, subf = task[:4]
-        local_fn = task[4] if len(task) > 4 else None
+    graph.add("model_downloads", partial(download_missing_models, status), outputs=("models",))
+    if gpu:
+        graph.add(
+            "kernel_cache_evict",
+            partial(evict_kernel_caches, KERNEL_CACHE_ROOT, kernel_cache_key_now, KERNEL_CACHE_BUDGET_BYTES),
+            outputs=("kernel_cache",),
+        )
+    # Only a git sync changes the code tree; on the fast path just the freshly
+    # copied launcher hooks are checked instead of every .py on the volume.
+    synced_code = not volume_fresh and code_on_volume
+    bytecode_root = COMFY_CODE_DIR if synced_code else os.path.join(CUSTOM_NODES_DIR, LAUNCHER_HOOKS_NAME)
+    graph.add(
+        "bytecode_compile",
+        partial(compile_stale_bytecode, bytecode_root),
+        inputs=("comfyui_code", "custom_nodes", "launcher_hooks"),
+        outputs=("bytecode",),
+    )
+    graph.run()
+    flush_telemetry()
 
-        display_name = local_fn if local_fn else fn
-        target = os.path.join(MODELS_DIR, sub, display_name)
+    if not packages_fresh and not overlay["mounted"]:
+        try:
+            capture_site_packages_overlay(
+                baseline_packages,
+                site_packages_overlay_dir(dependency_fingerprint(baseline_packages, requirement_file_hashes())),
+            )
+        except OSError as e:
+            print(f"Failed to capture site-packages overlay: {e}")
 
-        if not os.path.exists(target):
-            print(f"Downloading {fn} as {display_name} to {target}...")
-            primary = {"repo_id": repo, "subfolder": subf}
-            download_model(sub, fn, primary, local_filename=local_fn)
-        else:
-            print(f"Model {display_name} already exists, skipping download")
+    if not (volume_fresh and packages_fresh):
+        refreshed_at = stored_fingerprint["refreshed_at"] if volume_fresh else time.time()
+        save_environment_fingerprint(compute_environment_fingerprint(), refreshed_at)
+    return kernel_cache_dir
+
+
+def bootstrap_and_launch(status, gateway, processes: list):
+    wait_for_volume_lease(status)
+    # Warm the page cache with the base models while git/pip steps run.
+    start_model_prefetch()
+    kernel_cache_dir = prepare_environment(status)
+
+    status.set_phase("probing dependencies")
+    print("Probing runtime dependencies before launching ComfyUI...")
+    try:
+        probe_runtime_dependencies()
+    except Exception as e:
+        print(f"Runtime dependency probe failed: {e}")
+        raise
+    print("Runtime dependency probe passed.")
 
-    # Set COMFY_DIR environment variable to volume location
-    os.environ["COMFY_DIR"] = DATA_BASE
+    # Set COMFY_DIR environment variable to the code location for this layout
+    os.environ["COMFY_DIR"] = COMFY_CODE_DIR
 
-    # Launch ComfyUI from volume location
-    print(f"Starting ComfyUI from {DATA_BASE} on {GPU_TYPE} with {BASE_MODEL_NAME} support...")
+    print(f"Starting ComfyUI from {COMFY_CODE_DIR} ({CODE_LAYOUT} layout) on {GPU_TYPE} with {BASE_MODEL_NAME} support...")
 
     # v2: let ComfyUI use the version-matched frontend from comfyui-frontend-package
     # (installed via sync_frontend_requirements). Avoids GitHub lookup and ensures
@@ -586,16 +2369,182 @@ def ui():
         "launch",
         "--",
         "--listen",
-        "0.0.0.0",
+        "127.0.0.1",
         "--port",
-        "8000",
+        str(COMFYUI_PORT),
         "--enable-cors-header",
         "--enable-manager",
     ]
+    if PRUNE_UNLISTED_CUSTOM_NODES:
+        allowlist = custom_node_allowlist()
+        report_pruned_custom_nodes(allowlist)
+        cmd += ["--disable-all-custom-nodes", "--whitelist-custom-nodes"] + allowlist
+    os.environ["LAUNCHER_IMPORT_PROFILE_PATH"] = IMPORT_PROFILE_PATH
+    if MODEL_CACHE_BUDGET_BYTES > 0:
+        os.environ["LAUNCHER_MODEL_CACHE_DIR"] = MODEL_CACHE_DIR
+        os.environ["LAUNCHER_MODEL_CACHE_SOURCE"] = MODELS_DIR
+        os.environ["LAUNCHER_MODEL_CACHE_BYTES"] = str(MODEL_CACHE_BUDGET_BYTES)
     print(f"Executing: {' '.join(cmd)}")
 
-    subprocess.Popen(
+    status.set_phase("starting ComfyUI")
+    process = subprocess.Popen(
         cmd,
-        cwd=DATA_BASE,
+        cwd=COMFY_CODE_DIR,
         env=os.environ.copy()
     )
+    processes.append(process)
+    if not wait_for_comfyui(process=process):
+        exit_code = process.poll()
+        reason = f"exited with code {exit_code}" if exit_code is not None else f"did not answer within {COMFYUI_READY_TIMEOUT}s"
+        raise RuntimeError(f"ComfyUI {reason}")
+    status.set_ready()
+    print(f"ComfyUI is ready; gateway on :{GATEWAY_PORT} now proxies to {COMFYUI_LOCAL_URL}")
+
+    # Hot-register models that appear after launch (volume reloads, late downloads);
+    # the gateway's /object_info snapshot follows the same model snapshot.
+    start_model_watcher(on_change=partial(refresh_frontend_inventory, gateway))
+    if WARMUP_ENABLED:
+        start_warmup(kernel_cache_dir)
+
+
+def comfyui_container_running() -> bool:
+    try:
+        return bool(ui_endpoint().get_current_stats().num_total_runners)
+    except Exception as e:
+        print(f"Prewarm: could not read container stats: {e}")
+        return False
+
+
+@app.function(
+    volumes={DATA_ROOT: vol},
+    timeout=PREWARM_HYDRATE_TIMEOUT,
+    schedule=modal.Period(minutes=PREWARM_CHECK_MINUTES) if PREWARM_MODE != "off" else None,
+)
+def prewarm_scheduler():
+    """Warm up ahead of sessions predicted from past session start times.
+
+    Runs every PREWARM_CHECK_MINUTES on CPU. Decisions are recorded as
+    prewarm_check telemetry; spend is tracked in PREWARM_LEDGER_PATH.
+    """
+    now = time.time()
+    ledger = load_prewarm_ledger()
+    if PREWARM_MODE == "container":
+        lead = load_bootstrap_duration() or PREWARM_DEFAULT_BOOTSTRAP_SECONDS
+        cost = lead + PREWARM_WINDOW_SECONDS + SCALEDOWN_WINDOW
+    else:
+        # Hydration stays useful until the fingerprint TTL. It is budgeted with the
+        # previous run's duration and charged with its actual runtime afterwards.
+        lead = 0.0
+        cost = ledger.get("hydrate_seconds", PREWARM_DEFAULT_BOOTSTRAP_SECONDS)
+    warm, reason, probability = prewarm_decision(load_session_starts(), now, lead, cost, ledger)
+    if warm and volume_lease_active(read_volume_lease(), now):
+        warm, reason = False, "volume lease held by another hydration"
+    if warm and comfyui_container_running():
+        warm, reason = False, "ComfyUI container already running"
+    if warm and PREWARM_MODE != "container":
+        # GPU bootstraps starting after this commit see the lease and wait; one
+        # that started before it shows up as a runner on the recheck.
+        write_volume_lease("prewarm_scheduler", PREWARM_HYDRATE_TIMEOUT)
+        vol.commit()
+        if comfyui_container_running():
+            release_volume_lease()
+            warm, reason = False, "ComfyUI container started while taking the volume lease"
+    print(f"Prewarm ({PREWARM_MODE}): {'warming' if warm else 'skipping'}, {reason}")
+    record_telemetry("prewarm_check", mode=PREWARM_MODE, warm=warm, reason=reason, probability=round(probability, 3))
+
+    if warm:
+        covered_until = now + lead + PREWARM_WINDOW_SECONDS
+        if PREWARM_MODE == "container":
+            hold = int(covered_until - time.time())
+            with urllib.request.urlopen(f"{ui_endpoint().get_web_url()}/launcher/keepalive?hold={hold}", timeout=60):
+                pass
+            print(f"Prewarm: ComfyUI container requested, held for {hold}s")
+        else:
+            from comfyui_gateway import BootstrapStatus
+
+            started = time.perf_counter()
+            try:
+                prepare_environment(BootstrapStatus(), gpu=False, fresh_until=covered_until)
+            finally:
+                release_volume_lease()
+            cost = time.perf_counter() - started
+            print(f"Prewarm: volume hydrated in {cost:.1f}s")
+        ledger = charge_prewarm_ledger(ledger, now, cost, covered_until)
+        if PREWARM_MODE != "container":
+            ledger["hydrate_seconds"] = round(cost, 1)
+        save_prewarm_ledger(ledger)
+        record_telemetry("prewarm", mode=PREWARM_MODE, seconds=round(cost, 1), spent_today=ledger["spent_seconds"])
+    flush_telemetry()
+    vol.commit()
+    return {"warm": warm, "reason": reason, "probability": probability, "ledger": ledger}
+
+
+def run_prompt_burst(base_url: str, prompts: int, coalesce: bool, timeout: float = 900) -> dict:
+    """Submit prompts concurrently through the gateway and wait until all have history."""
+    headers = {"X-Launcher-Coalesce": "on"} if coalesce else {}
+
+    def submit(index: int) -> str:
+        graph = build_warmup_prompt()
+        # -1 lets the gateway draw the seed, which is what makes a prompt coalescible.
+        graph["6"]["inputs"]["seed"] = -1 if coalesce else index
+        return comfy_api("/prompt", {"prompt": graph, "client_id": "launcher-benchmark"}, base_url=base_url, timeout=60, headers=headers)["prompt_id"]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=prompts) as pool:
+        pending = set(pool.map(submit, range(prompts)))
+    images = 0
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for prompt_id in list(pending):
+            entry = comfy_api(f"/history/{prompt_id}", base_url=base_url, timeout=60).get(prompt_id)
+            if entry is not None:
+                pending.discard(prompt_id)
+                images += sum(len(output.get("images", [])) for output in entry.get("outputs", {}).values())
+        time.sleep(0.5)
+    seconds = time.perf_counter() - started
+    return {"seconds": round(seconds, 2), "images": images, "images_per_second": round(images / seconds, 3), "unfinished": len(pending)}
+
+
+@app.function(timeout=3600)
+def benchmark_prompt_coalescing(prompts: int = 8, rounds: int = 2):
+    """Compare throughput of a burst of seed-only variants with and without coalescing.
+
+    Run with: modal run comfyui_app_l40s_krea2_turbo_v2.py::benchmark_prompt_coalescing
+    Requests go through the deployed ComfyUIServer gateway; the first round warms it up.
+    """
+    base_url = ui_endpoint().get_web_url()
+    results = {}
+    for _ in range(rounds):
+        for coalesce in (False, True):
+            results[coalesce] = run_prompt_burst(base_url, prompts, coalesce)
+    for coalesce, result in results.items():
+        label = "coalesced" if coalesce else "one by one"
+        print(f"{label:<11} {result['seconds']:7.1f}s  {result['images_per_second']:6.3f} images/s  ({result['images']} images)")
+    return {"coalesced" if coalesce else "sequential": result for coalesce, result in results.items()}
+
+
+@app.function(volumes={DATA_ROOT: vol}, timeout=1800)
+def benchmark_code_layouts(runs: int = 3):
+    """Compare ComfyUI startup (imports + custom node init) from image-local disk vs the volume.
+
+    Run with: modal run comfyui_app_l40s_krea2_turbo_v2.py::benchmark_code_layouts
+    The first run of each layout is cold (empty page cache); best-of-N shows the warm cost.
+    """
+    results = {}
+    for layout, root in (("local", DEFAULT_COMFY_DIR), ("volume", DATA_BASE)):
+        if not os.path.exists(os.path.join(root, "main.py")):
+            print(f"Skipping {layout} layout: no ComfyUI at {root}")
+            continue
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            run_streaming(
+                ["/usr/local/bin/python", "main.py", "--quick-test-for-ci", "--cpu"],
+                f"bench {layout}",
+                cwd=root,
+                echo=False,
+            )
+            timings.append(round(time.perf_counter() - started, 2))
+        results[layout] = timings
+        print(f"{layout:<7} cold {timings[0]:6.1f}s  best {min(timings):6.1f}s  ({root})")
+    return results
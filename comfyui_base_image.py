@@ -0,0 +1,63 @@
+"""Shared, versioned base image for the ComfyUI launchers.
+
+Every comfyui_app_*.py launcher derives its image from comfyui_base_image()
+and only adds its stack-specific layers (extra pip packages, custom nodes) on
+top. Identical layer definitions are cached once per Modal workspace, so the
+apt packages, the pinned torch trio and `comfy install` are built and pulled
+once for all deployments instead of once per launcher.
+
+Bump BASE_IMAGE_VERSION to rebuild the base for every launcher, e.g. to pick
+up a newer ComfyUI release (the `comfy install` layer is otherwise cached).
+"""
+import modal
+
+BASE_IMAGE_VERSION = "2026.10.1"
+PYTHON_VERSION = "3.12"
+
+# ComfyUI default install location
+DEFAULT_COMFY_DIR = "/root/comfy/ComfyUI"
+
+APT_PACKAGES = ("git", "wget", "libgl1-mesa-glx", "libglib2.0-0", "ffmpeg", "imagemagick", "libmagickwand-dev")
+# Pinned as a unit: mixing versions crashes at import time (torchvision::nms).
+TORCH_INDEX_URL = "https://download.pytorch.org/whl/cu126"
+TORCH_PACKAGES = ("torch==2.11.0", "torchvision==0.26.0", "torchaudio==2.11.0")
+
+
+def git_compact_history_cmd(repo_dir: str) -> str:
+    """Cut an existing clone down to its checked-out commit (depth 1).
+
+    comfy-cli clones ComfyUI with full history; this drops every ref except a
+    detached HEAD, marks HEAD as the shallow boundary and prunes the rest, so
+    the image layer and the first copy onto the volume stay small.
+
+    Only for stacks whose runtime sync re-fetches the branch it needs (see
+    update_git_repo in comfyui_app_l40s_krea2_turbo_v2.py): launchers that run
+    `git checkout -B main origin/main` or a plain `git pull` need the refs.
+    """
+    return (
+        f"cd {repo_dir}"
+        " && git checkout -q --detach"
+        " && git for-each-ref --format='%(refname)' refs/heads refs/remotes refs/tags | xargs -r -n1 git update-ref -d"
+        " && git rev-parse HEAD > .git/shallow"
+        " && git reflog expire --expire=now --all"
+        " && git gc -q --prune=now"
+    )
+
+
+def comfyui_base_image() -> modal.Image:
+    """debian_slim + system packages + pinned torch + ComfyUI at DEFAULT_COMFY_DIR."""
+    return (
+        modal.Image.debian_slim(python_version=PYTHON_VERSION)
+        # First layer on purpose: a version bump invalidates the whole base.
+        .env({"COMFYUI_BASE_IMAGE_VERSION": BASE_IMAGE_VERSION})
+        .apt_install(*APT_PACKAGES)
+        .run_commands([
+            # Bake latest pip/comfy-cli/uv into image to avoid runtime upgrades
+            "pip install --no-cache-dir --upgrade pip comfy-cli uv",
+            f"pip install --no-cache-dir --force-reinstall --index-url {TORCH_INDEX_URL} {' '.join(TORCH_PACKAGES)}",
+            "uv pip install --system --compile-bytecode huggingface_hub[hf_transfer]==0.28.1",
+            # Install ComfyUI to default location
+            "comfy --skip-prompt install --nvidia",
+        ])
+        .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
+    )
@@ -0,0 +1,1419 @@
+"""Front server on the public port of a ComfyUI launcher.
+
+While the launcher bootstraps (git, pip, model downloads) the gateway serves a
+status page and ``/launcher/status`` JSON, so the Modal web endpoint answers
+within seconds instead of waiting for ComfyUI. Once the launcher marks the
+status ready, every request and websocket is proxied to ComfyUI on its
+internal port.
+
+Text responses (JSON, JS, CSS, HTML) are compressed with brotli when the
+``brotli`` module is available and the client accepts it, gzip otherwise.
+Content-hashed frontend assets get immutable caching headers, and inventory
+dependent routes (``/object_info``, global subgraphs) are cached in memory
+under the inventory key the launcher sets, so they are recomputed only when
+the node or model set changes. Websockets pass through unchanged.
+
+With a journal path, every prompt accepted through ``/prompt`` is recorded in
+SQLite and reconciled against ComfyUI's queue and history. Prompts still
+unfinished when a container dies are resubmitted once the next ComfyUI is
+ready, and ``/history/<original id>`` follows them to their new prompt id.
+
+With a coalescing wait, prompts sent with ``X-Launcher-Coalesce: on`` that
+reach ``/prompt`` within that window from the same client id, and differ only
+in their latent batch size, are submitted to ComfyUI as one prompt whose
+latent batch covers all of them. Only prompts that leave the seed to the
+gateway (every seed input -1) qualify; the gateway draws the seeds, so the
+stored workflow names the seed each batch really ran with. Prompts from the
+ComfyUI editor are never coalesced. Each prompt gets its own prompt id, and
+``/history/<id>`` returns its slice of the batched outputs; the mapping is
+journaled, so it survives a restart.
+
+With priority lanes, prompts wait in the gateway instead of ComfyUI's FIFO
+queue, and ComfyUI only ever holds the running prompt plus a small pending
+reserve. Between prompts the next one is picked by weighted fair sharing
+across lanes (``X-Launcher-Lane`` header, ``extra_data.launcher_lane``, or
+"interactive" for prompts from the ComfyUI frontend and "bulk" otherwise).
+A pending lower-priority prompt is pulled back out of ComfyUI's queue when
+an interactive prompt arrives. ``/prompt`` replies with the prompt id as soon
+as the prompt is held, so bulk clients never wait for the prompts ahead of
+them; ComfyUI's own validation happens at dispatch and its rejections are
+served from ``/history/<id>``. Prompts held in the lanes are listed as pending
+in ``/queue`` and can be deleted or cleared through it like ComfyUI's own.
+``/launcher/lanes`` reports the queue wait of each lane.
+
+With a result cache (``comfyui_result_cache``), a prompt whose canonical graph
+and referenced files match an earlier completed prompt is answered from the
+cache: ``/history/<id>`` returns the stored outputs and a websocket client
+with the prompt's client id receives the usual execution messages.
+``/launcher/results`` reports hit rate and size. ``X-Launcher-Result-Cache:
+off`` bypasses it.
+
+Imported only inside the container (aiohttp ships with ComfyUI).
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from aiohttp import ClientSession, ClientTimeout, WSMsgType, web
+from multidict import CIMultiDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Headers that describe a single hop and must not be forwarded.
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+PROXY_CHUNK_BYTES = 64 * 1024
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/", "image/svg+xml")
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MAX_BYTES = 64 * 2**20
+# Compressed bodies kept for repeat requests (frontend assets, cached routes).
+COMPRESSED_CACHE_BYTES = 256 * 2**20
+# Vite emits content-hashed file names (index-BkX7a1Qf.js), safe to cache forever.
+HASHED_ASSET_RE = re.compile(r"/assets/.+[-.][A-Za-z0-9_]{8,}\.(?:js|mjs|css|woff2?|ttf|svg|png|webp|json)$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# GET routes whose responses only change with the installed nodes / models.
+INVENTORY_CACHED_ROUTES = ("/object_info", "/global_subgraphs")
+JOURNAL_POLL_INTERVAL = 5
+# A prompt that was running in this many containers without finishing (for
+# example because it crashes the process) is marked failed instead of replayed.
+JOURNAL_MAX_ATTEMPTS = 3
+JOURNAL_RETENTION_SECONDS = 7 * 24 * 3600
+# Prompt coalescing: seed inputs the gateway fills in (only when sent as
+# COALESCE_RANDOM_SEED), the input scaled to the merged batch, and the largest
+# merged batch (in images). Prompts opt in with COALESCE_HEADER: on.
+COALESCE_SEED_INPUTS = ("seed", "noise_seed")
+COALESCE_RANDOM_SEED = -1
+COALESCE_SEED_MAX = 2**53 - 1
+COALESCE_BATCH_INPUT = "batch_size"
+COALESCE_MAX_BATCH = 8
+COALESCE_HEADER = "X-Launcher-Coalesce"
+# Request prompt ids of coalesced prompts remembered for /history lookups.
+COALESCED_IDS_KEEP = 10000
+# Priority lanes: name -> weight for weighted fair sharing between prompts.
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+DEFAULT_LANE_WEIGHTS = {LANE_INTERACTIVE: 4, LANE_BULK: 1}
+LANE_HEADER = "X-Launcher-Lane"
+# Prompts handed to ComfyUI ahead of the running one, so it never idles between
+# prompts; anything beyond this waits in the lanes where it can be reordered.
+LANE_DISPATCH_DEPTH = 1
+LANE_POLL_INTERVAL = 0.5
+# /prompt is acknowledged as soon as the prompt is journaled and held in its
+# lane, after the structural checks of validate_prompt. A prompt ComfyUI rejects
+# at dispatch, or one cancelled through /queue, shows up as an error in
+# /history/<id> and as an execution_error on the client's websocket.
+# extra_data keys ComfyUI keeps out of its /queue listing; held prompts hide them too.
+QUEUE_HIDDEN_EXTRA_DATA = ("auth_token_comfy_org", "api_key_comfy_org")
+LANE_WAIT_SAMPLES = 1000
+LANE_TRACKED_IDS_KEEP = 10000
+# Recently dispatched prompts kept for preemption; only pending ones qualify.
+LANE_PREEMPTIBLE_KEEP = 32
+RESULT_CACHE_OPT_OUT_HEADER = "X-Launcher-Result-Cache"
+# Completed prompts are checked for results to store this often, and given up
+# on when they have neither finished nor left the queue after RESULT_WATCH_SECONDS.
+RESULT_POLL_INTERVAL = 2
+RESULT_WATCH_SECONDS = 6 * 3600
+
+
+class PromptJournal:
+    """SQLite record of prompts accepted through the gateway.
+
+    ``id`` is the prompt id the client was given; ``prompt_id`` is the id of
+    the current ComfyUI submission, which changes when a job is replayed.
+    All methods are called from a single worker thread.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, prompt_id TEXT NOT NULL, payload TEXT NOT NULL,"
+            " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 1,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        # Coalesced prompts: the id each client was given -> its slice of a batched job.
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS aliases ("
+            " id TEXT PRIMARY KEY, job_id TEXT NOT NULL,"
+            " batch_offset INTEGER NOT NULL, batch_count INTEGER NOT NULL, batch_total INTEGER NOT NULL)"
+        )
+
+    def record(self, prompt_id: str, payload: str):
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR IGNORE INTO jobs (id, prompt_id, payload, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (prompt_id, prompt_id, payload, now, now),
+        )
+
+    def unfinished(self, submitted_before: Optional[float] = None) -> list:
+        """Queued jobs, optionally only those last submitted before a given time."""
+        return self.connection.execute(
+            "SELECT id, prompt_id, payload, attempts FROM jobs WHERE status = 'queued' AND updated_at < ? ORDER BY created_at",
+            (submitted_before if submitted_before is not None else float("inf"),),
+        ).fetchall()
+
+    def replayed(self, job_id: str, prompt_id: str):
+        self.connection.execute(
+            "UPDATE jobs SET prompt_id = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            (prompt_id, time.time(), job_id),
+        )
+
+    def finish(self, job_id: str, status: str):
+        self.connection.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def record_alias(self, alias_id: str, job_id: str, offset: int, count: int, total: int):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO aliases (id, job_id, batch_offset, batch_count, batch_total) VALUES (?, ?, ?, ?, ?)",
+            (alias_id, job_id, offset, count, total),
+        )
+
+    def alias(self, alias_id: str) -> Optional[tuple]:
+        """(current prompt id, offset, count, total) of a coalesced prompt, or None."""
+        return self.connection.execute(
+            "SELECT jobs.prompt_id, batch_offset, batch_count, batch_total FROM aliases"
+            " JOIN jobs ON jobs.id = aliases.job_id WHERE aliases.id = ?",
+            (alias_id,),
+        ).fetchone()
+
+    def purge(self, older_than: float):
+        self.connection.execute("DELETE FROM jobs WHERE status != 'queued' AND updated_at < ?", (older_than,))
+        self.connection.execute("DELETE FROM aliases WHERE job_id NOT IN (SELECT id FROM jobs)")
+
+    def counts(self) -> dict:
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class BootstrapStatus:
+    """Thread-safe bootstrap progress shared between the launcher and the gateway."""
+
+    def __init__(self, expected_seconds: Optional[float] = None):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.expected_seconds = expected_seconds
+        self.phase = "starting"
+        self.steps = {}
+        self.download = None
+        self.downloads_done = 0
+        self.downloads_total = 0
+        self.ready = False
+        self.error = None
+
+    def set_phase(self, phase: str):
+        with self.lock:
+            self.phase = phase
+
+    def step_started(self, name: str):
+        with self.lock:
+            self.steps[name] = {"state": "running", "started_at": time.time(), "duration": None}
+
+    def step_finished(self, name: str, duration: float, ok: bool):
+        with self.lock:
+            step = self.steps.setdefault(name, {"started_at": time.time()})
+            step.update(state="ok" if ok else "failed", duration=round(duration, 1))
+
+    def downloads_planned(self, count: int):
+        with self.lock:
+            self.downloads_total = count
+            self.downloads_done = 0
+
+    def download_progress(self, name: str, done_bytes: int, total_bytes: Optional[int]):
+        with self.lock:
+            if not self.download or self.download["name"] != name:
+                self.download = {"name": name, "started_at": time.time()}
+            self.download.update(done_bytes=done_bytes, total_bytes=total_bytes)
+
+    def download_finished(self, name: str):
+        with self.lock:
+            self.downloads_done += 1
+            if self.download and self.download["name"] == name:
+                self.download = None
+
+    def set_ready(self):
+        with self.lock:
+            self.phase = "ready"
+            self.ready = True
+
+    def fail(self, error: str):
+        with self.lock:
+            self.phase = "failed"
+            self.error = error
+
+    def _download_eta(self) -> Optional[float]:
+        download = self.download
+        if not download or not download.get("total_bytes") or not download.get("done_bytes"):
+            return None
+        elapsed = time.time() - download["started_at"]
+        rate = download["done_bytes"] / max(elapsed, 1e-6)
+        return (download["total_bytes"] - download["done_bytes"]) / max(rate, 1e-6)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            elapsed = time.time() - self.started_at
+            eta = None
+            if not self.ready and not self.error:
+                candidates = [self._download_eta()]
+                if self.expected_seconds:
+                    candidates.append(self.expected_seconds - elapsed)
+                candidates = [value for value in candidates if value is not None]
+                eta = round(max(max(candidates), 0.0), 1) if candidates else None
+            return {
+                "phase": self.phase,
+                "ready": self.ready,
+                "error": self.error,
+                "elapsed": round(elapsed, 1),
+                "eta": eta,
+                "steps": {name: dict(step) for name, step in self.steps.items()},
+                "download": dict(self.download) if self.download else None,
+                "downloads": {"done": self.downloads_done, "total": self.downloads_total},
+            }
+
+
+STATUS_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>ComfyUI is starting</title>
+<style>
+body { font: 15px system-ui, sans-serif; background: #1b1b1b; color: #ddd; margin: 3em auto; max-width: 44em; }
+h1 { font-size: 1.3em; } td { padding: 2px 12px 2px 0; } .failed { color: #f66; } .running { color: #fc6; }
+progress { width: 100%; }
+</style></head>
+<body>
+<h1>ComfyUI is starting&hellip;</h1>
+<p id="summary">Loading status&hellip;</p>
+<div id="download"></div>
+<table id="steps"></table>
+<script>
+function fmt(s) { return s == null ? "?" : (s >= 60 ? Math.floor(s / 60) + "m " : "") + Math.round(s % 60) + "s"; }
+async function poll() {
+  try {
+    const st = await (await fetch("/launcher/status", {cache: "no-store"})).json();
+    if (st.ready) { location.reload(); return; }
+    document.getElementById("summary").textContent = st.error
+      ? "Startup failed: " + st.error
+      : "Phase: " + st.phase + " \\u2014 elapsed " + fmt(st.elapsed) + ", ETA " + fmt(st.eta);
+    const d = st.download;
+    document.getElementById("download").innerHTML = d
+      ? "<p>Downloading " + d.name + " (" + (st.downloads.done + 1) + "/" + st.downloads.total + ")</p>" +
+        (d.total_bytes ? "<progress max='" + d.total_bytes + "' value='" + d.done_bytes + "'></progress>" : "")
+      : "";
+    document.getElementById("steps").innerHTML = Object.entries(st.steps).map(([name, s]) =>
+      "<tr class='" + s.state + "'><td>" + name + "</td><td>" + s.state + "</td><td>" +
+      (s.duration == null ? "" : s.duration + "s") + "</td></tr>").join("");
+  } catch (e) {}
+  setTimeout(poll, 2000);
+}
+poll();
+</script>
+</body></html>
+"""
+
+
+def forward_headers(headers, drop: tuple = ()) -> CIMultiDict:
+    return CIMultiDict(
+        (key, value) for key, value in headers.items() if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() not in drop
+    )
+
+
+def route_path(path: str) -> str:
+    """ComfyUI serves its API both at / and /api/; compare routes without the prefix."""
+    return path[4:] if path.startswith("/api/") else path
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {token.split(";")[0].strip().lower() for token in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def is_compressible(headers) -> bool:
+    content_type = headers.get("Content-Type", "").lower()
+    return (
+        content_type.startswith(COMPRESSIBLE_TYPES)
+        and "Content-Encoding" not in headers
+        and COMPRESS_MIN_BYTES <= int(headers.get("Content-Length", COMPRESS_MIN_BYTES)) <= COMPRESS_MAX_BYTES
+    )
+
+
+def coalesce_key(body: dict) -> Optional[str]:
+    """Group key for /prompt bodies that can share one batched execution, or None.
+
+    The key is the client id plus the graph with batch sizes blanked out.
+    Prompts qualify when every seed input is COALESCE_RANDOM_SEED (a seed the
+    caller chose is never replaced), the graph has latent batch inputs that
+    all hold the same integer, the body carries no editor workflow, and it
+    asks for nothing tied to queue position or a subset of outputs.
+    """
+    prompt = body.get("prompt")
+    if not isinstance(prompt, dict) or any(key in body for key in ("front", "number", "partial_execution_targets")):
+        return None
+    extra_data = body.get("extra_data")
+    if isinstance(extra_data, dict) and isinstance(extra_data.get("extra_pnginfo"), dict) and "workflow" in extra_data["extra_pnginfo"]:
+        return None
+    sizes = set()
+    blanked = {}
+    for node_id, node in prompt.items():
+        if not isinstance(node, dict) or not isinstance(node.get("inputs"), dict):
+            return None
+        inputs = dict(node["inputs"])
+        if any(name in inputs and inputs[name] != COALESCE_RANDOM_SEED for name in COALESCE_SEED_INPUTS):
+            return None
+        if COALESCE_BATCH_INPUT in inputs:
+            if not isinstance(inputs[COALESCE_BATCH_INPUT], int):
+                return None
+            sizes.add(inputs[COALESCE_BATCH_INPUT])
+            inputs[COALESCE_BATCH_INPUT] = None
+        blanked[node_id] = {**node, "inputs": inputs}
+    if len(sizes) != 1:
+        return None
+    material = {"client_id": body.get("client_id"), "prompt": blanked}
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def prompt_batch_size(prompt: dict) -> int:
+    for node in prompt.values():
+        if COALESCE_BATCH_INPUT in node["inputs"]:
+            return node["inputs"][COALESCE_BATCH_INPUT]
+    return 1
+
+
+def draw_seeds(body: dict, rng=random) -> dict:
+    """Copy of a /prompt body with every COALESCE_RANDOM_SEED input replaced by a drawn seed."""
+    drawn = json.loads(json.dumps(body))
+    for node in drawn["prompt"].values():
+        for name in COALESCE_SEED_INPUTS:
+            if node["inputs"].get(name) == COALESCE_RANDOM_SEED:
+                node["inputs"][name] = rng.randint(0, COALESCE_SEED_MAX)
+    return drawn
+
+
+def merge_prompts(bodies: list, rng=random) -> dict:
+    """One /prompt body that runs every body of a coalesce group as a single latent batch."""
+    merged = draw_seeds(bodies[0], rng)
+    merged.pop("prompt_id", None)
+    total = sum(prompt_batch_size(body["prompt"]) for body in bodies)
+    for node in merged["prompt"].values():
+        if COALESCE_BATCH_INPUT in node["inputs"]:
+            node["inputs"][COALESCE_BATCH_INPUT] = total
+    return merged
+
+
+def split_history_entry(entry: dict, offset: int, count: int, total: int) -> dict:
+    """Cut a batched history entry down to the outputs of one coalesced prompt.
+
+    Output lists whose length is a multiple of the merged batch are sliced to
+    items [offset, offset + count) of it; anything else is passed through.
+    """
+    outputs = {}
+    for node_id, node_output in entry.get("outputs", {}).items():
+        sliced = {}
+        for name, values in node_output.items():
+            if isinstance(values, list) and values and len(values) % total == 0:
+                per_item = len(values) // total
+                values = values[offset * per_item:(offset + count) * per_item]
+            sliced[name] = values
+        outputs[node_id] = sliced
+    return {**entry, "outputs": outputs}
+
+
+def prompt_lane(body: dict, headers, lanes) -> str:
+    """Lane a /prompt body belongs to: explicit choice, else by who sent it."""
+    extra_data = body.get("extra_data") if isinstance(body.get("extra_data"), dict) else {}
+    requested = headers.get(LANE_HEADER) or extra_data.get("launcher_lane")
+    if requested in lanes:
+        return requested
+    # The ComfyUI frontend always attaches the editor workflow; API clients rarely do.
+    pnginfo = extra_data.get("extra_pnginfo")
+    lane = LANE_INTERACTIVE if isinstance(pnginfo, dict) and "workflow" in pnginfo else LANE_BULK
+    return lane if lane in lanes else next(iter(lanes))
+
+
+def prompt_error(error_type: str, message: str, details: str = "") -> dict:
+    return {"error": {"type": error_type, "message": message, "details": details, "extra_info": {}}, "node_errors": {}}
+
+
+def validate_prompt(prompt, output_classes: Optional[set] = None) -> Optional[dict]:
+    """ComfyUI's structural /prompt checks, as its error body; None if they pass.
+
+    Input values and model files are still validated by ComfyUI at dispatch.
+    The output check only runs when the output node classes are known.
+    """
+    if not isinstance(prompt, dict) or not prompt:
+        return prompt_error("invalid_prompt", "Prompt must be a non-empty object of nodes")
+    for node_id, node in prompt.items():
+        if not isinstance(node, dict) or not isinstance(node.get("class_type"), str):
+            return prompt_error(
+                "invalid_prompt", "Cannot execute because a node is missing the class_type property.", f"Node ID '#{node_id}'"
+            )
+    if output_classes and not any(node["class_type"] in output_classes for node in prompt.values()):
+        return prompt_error("prompt_no_outputs", "Prompt has no outputs")
+    return None
+
+
+def pick_lane(queued: dict, virtual_time: dict) -> Optional[str]:
+    """Weighted fair sharing: the non-empty lane that has received the least service per weight."""
+    candidates = [lane for lane, count in queued.items() if count]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda lane: virtual_time[lane])
+
+
+def wait_summary(samples) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"samples": 0, "p50": None, "p95": None, "max": None}
+    return {
+        "samples": len(ordered),
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+class Gateway:
+    def __init__(
+        self,
+        status: BootstrapStatus,
+        upstream_url: str,
+        journal_path: Optional[str] = None,
+        on_journal_change=None,
+        coalesce_wait: float = 0.0,
+        coalesce_max_batch: int = COALESCE_MAX_BATCH,
+        lanes: Optional[dict] = None,
+        result_cache=None,
+        on_result_change=None,
+    ):
+        self.status = status
+        self.upstream_url = upstream_url.rstrip("/")
+        self.session = None
+        # Durable prompt journal; sqlite work runs on one dedicated thread.
+        self.journal = PromptJournal(journal_path) if journal_path else None
+        self.journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prompt-journal")
+        self.on_journal_change = on_journal_change
+        self.replayed_ids = {}  # original prompt id -> prompt id of its replay
+        self.replay_done = False
+        # Jobs last submitted before this gateway started belong to a dead ComfyUI.
+        self.started_at = time.time()
+        self.draining = False
+        # Set by the launcher from node SHAs and model names; None disables route caching.
+        self.inventory_key = None
+        self.environment_key = None
+        self.route_cache = {}  # route path + query (no /api prefix) -> (inventory key, status, headers, body)
+        self.compressed_cache = OrderedDict()  # (body digest, encoding) -> compressed body
+        self.compressed_cache_bytes = 0
+        self.stats = {
+            "route_hits": 0,
+            "route_misses": 0,
+            "compressed_hits": 0,
+            "compressed_misses": 0,
+            "coalesced_prompts": 0,
+            "coalesced_batches": 0,
+        }
+        # Prompt coalescing; a wait of 0 submits every prompt as it arrives.
+        self.coalesce_wait = coalesce_wait
+        self.coalesce_max_batch = coalesce_max_batch
+        self.coalesce_groups = {}  # coalesce key -> [(body, request headers, future)]
+        self.coalesced_ids = OrderedDict()  # request prompt id -> (prompt id, offset, count, total)
+        # Priority lanes; without weights prompts go straight to ComfyUI's queue.
+        self.lane_weights = dict(lanes or {})
+        self.lanes = {lane: deque() for lane in self.lane_weights}
+        self.lane_virtual_time = {lane: 0.0 for lane in self.lane_weights}
+        self.lane_waits = {lane: deque(maxlen=LANE_WAIT_SAMPLES) for lane in self.lane_weights}
+        self.lane_counts = {lane: {"dispatched": 0, "preempted": 0, "rejected": 0, "cancelled": 0} for lane in self.lane_weights}
+        self.held_ids = set()  # journaled prompts not (or no longer) in ComfyUI's queue
+        self.dispatched = OrderedDict()  # prompt id -> lane entry, so pending ones can be pulled back
+        self.lane_rejections = OrderedDict()  # prompt id -> ComfyUI's rejection, served as history
+        self.lane_wakeup = None
+        # Result cache; its sqlite index and file copies run on one dedicated thread.
+        self.result_cache = result_cache
+        self.result_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache")
+        self.on_result_change = on_result_change
+        self.result_watch = OrderedDict()  # prompt id -> (result key, watched at)
+        self.cached_prompts = OrderedDict()  # prompt id -> history entry answered from the cache
+        self.output_classes = None
+        self.output_classes_key = None
+        self.client_sockets = {}  # websocket clientId -> client websocket
+        # Client activity, read by the launcher's keepalive monitor.
+        self.active_websockets = 0
+        self.last_request_at = time.time()
+        self.activity_report = {}
+        # First client request of this container (a session start) and any
+        # prewarm hold bought by the scheduler through /launcher/keepalive?hold=.
+        self.first_request_at = None
+        self.first_request_ready = None
+        self.prewarmed = False
+        self.hold_until = 0.0
+
+    def activity(self) -> dict:
+        return {
+            "active_websockets": self.active_websockets,
+            "last_request_at": self.last_request_at,
+            "first_request_at": self.first_request_at,
+            "first_request_ready": self.first_request_ready,
+            "prewarmed": self.prewarmed,
+            "hold_until": self.hold_until,
+        }
+
+    def set_activity_report(self, report: dict):
+        """Latest keepalive decision and counters from the launcher, served at /launcher/activity."""
+        self.activity_report = report
+
+    def start_draining(self):
+        """Refuse new prompts and freeze the journal so unfinished jobs are replayed later."""
+        self.draining = True
+
+    def set_inventory_key(self, key: Optional[str], environment_key: Optional[str] = None):
+        """Inventory key for the route cache; environment_key (code and packages only) for the result cache."""
+        self.inventory_key = key
+        self.environment_key = environment_key
+
+    def seed_route(self, path_qs: str, key: str, body: bytes, content_type: str = "application/json"):
+        """Serve a precomputed body for path_qs while the inventory key stays key."""
+        self.route_cache[route_path(path_qs)] = (key, 200, (("Content-Type", f"{content_type}; charset=utf-8"),), body)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=0)
+        app.router.add_get("/launcher/status", self.handle_status)
+        app.router.add_get("/launcher/gateway", self.handle_gateway_stats)
+        app.router.add_get("/launcher/queue", self.handle_journal_stats)
+        app.router.add_get("/launcher/activity", self.handle_activity)
+        app.router.add_get("/launcher/keepalive", self.handle_keepalive)
+        app.router.add_get("/launcher/lanes", self.handle_lane_stats)
+        app.router.add_get("/launcher/results", self.handle_result_stats)
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+    async def on_startup(self, app):
+        self.session = ClientSession(auto_decompress=False, timeout=ClientTimeout(total=None, sock_connect=10))
+        if self.journal:
+            app["journal_task"] = asyncio.ensure_future(self.journal_loop())
+        if self.lanes:
+            self.lane_wakeup = asyncio.Event()
+            app["lane_task"] = asyncio.ensure_future(self.lane_loop())
+        if self.result_cache:
+            app["result_task"] = asyncio.ensure_future(self.result_loop())
+
+    async def on_cleanup(self, app):
+        for task in ("journal_task", "lane_task", "result_task"):
+            if task in app:
+                app[task].cancel()
+        await self.session.close()
+
+    async def journal_call(self, fn, *args, write: bool = True):
+        result = await asyncio.get_running_loop().run_in_executor(self.journal_executor, fn, *args)
+        if write and self.on_journal_change:
+            self.on_journal_change()
+        return result
+
+    async def upstream_json(self, method: str, path: str, payload: Optional[dict] = None):
+        async with self.session.request(method, f"{self.upstream_url}{path}", json=payload) as response:
+            body = await response.read()
+            return response.status, (json.loads(body) if body else {})
+
+    async def journal_loop(self):
+        while True:
+            await asyncio.sleep(JOURNAL_POLL_INTERVAL)
+            if not self.status.ready or self.draining:
+                continue
+            try:
+                if not self.replay_done:
+                    await self.replay_unfinished()
+                    await self.journal_call(self.journal.purge, time.time() - JOURNAL_RETENTION_SECONDS)
+                    self.replay_done = True
+                await self.reconcile_journal()
+            except Exception as e:
+                print(f"[gateway] Prompt journal update failed: {e}")
+
+    async def replay_unfinished(self):
+        """Resubmit prompts a previous container accepted but never finished."""
+        jobs = await self.journal_call(self.journal.unfinished, self.started_at, write=False)
+        for job_id, _, payload, attempts in jobs:
+            if attempts >= JOURNAL_MAX_ATTEMPTS:
+                print(f"[gateway] Not replaying {job_id}: {attempts} attempts already")
+                await self.journal_call(self.journal.finish, job_id, "failed")
+                continue
+            status, reply = await self.upstream_json("POST", "/prompt", json.loads(payload))
+            if status != 200 or "prompt_id" not in reply:
+                print(f"[gateway] Replay of {job_id} rejected ({status}): {reply}")
+                await self.journal_call(self.journal.finish, job_id, "failed")
+                continue
+            self.replayed_ids[job_id] = reply["prompt_id"]
+            await self.journal_call(self.journal.replayed, job_id, reply["prompt_id"])
+        if jobs:
+            print(f"[gateway] Replayed {len(self.replayed_ids)} of {len(jobs)} unfinished prompts from the journal")
+
+    async def reconcile_journal(self):
+        """Mark journaled prompts finished once they leave ComfyUI's queue."""
+        jobs = await self.journal_call(self.journal.unfinished, write=False)
+        if not jobs:
+            return
+        _, queue = await self.upstream_json("GET", "/queue")
+        active = {entry[1] for entry in queue.get("queue_running", []) + queue.get("queue_pending", []) if len(entry) > 1}
+        for job_id, prompt_id, _, _ in jobs:
+            if prompt_id in active or prompt_id in self.held_ids:
+                continue
+            _, history = await self.upstream_json("GET", f"/history/{prompt_id}")
+            entry = history.get(prompt_id)
+            if entry is None:
+                # Left the queue without a history entry: deleted by the user.
+                await self.journal_call(self.journal.finish, job_id, "cancelled")
+            else:
+                ok = entry.get("status", {}).get("status_str", "success") == "success"
+                await self.journal_call(self.journal.finish, job_id, "done" if ok else "failed")
+
+    async def handle_activity(self, request):
+        return web.json_response({**self.activity(), **self.activity_report})
+
+    async def handle_keepalive(self, request):
+        # Reaching this route through the public URL is what keeps the container up.
+        # The prewarm scheduler also asks for a hold until the expected session.
+        try:
+            hold = float(request.query.get("hold", 0))
+        except ValueError:
+            return web.json_response({"error": "hold must be a number of seconds"}, status=400)
+        if hold > 0:
+            self.prewarmed = True
+            self.hold_until = max(self.hold_until, time.time() + hold)
+        return web.json_response({"ok": True, "hold_until": self.hold_until})
+
+    async def handle_journal_stats(self, request):
+        if not self.journal:
+            return web.json_response({"enabled": False})
+        counts = await self.journal_call(self.journal.counts, write=False)
+        return web.json_response({"enabled": True, "jobs": counts, "replayed": self.replayed_ids})
+
+    async def submit_prompt(self, request):
+        payload = await request.read()
+        try:
+            body = json.loads(payload)
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            body = None
+        coalesce = None
+        if body is not None and self.coalesce_wait > 0 and request.headers.get(COALESCE_HEADER, "").lower() == "on":
+            coalesce = coalesce_key(body)
+        if coalesce is not None:
+            # Drawn seeds make the outputs unrepeatable, so the result cache is skipped.
+            return await self.coalesce_prompt(coalesce, body, request.headers)
+        result_key = None
+        if (
+            body is not None
+            and self.result_cache
+            and isinstance(body.get("prompt"), dict)
+            and request.headers.get(RESULT_CACHE_OPT_OUT_HEADER, "").lower() != "off"
+        ):
+            result_key = await self.result_key(body["prompt"])
+            if result_key is not None:
+                outputs = await self.result_call(self.result_cache.lookup, result_key)
+                if outputs is not None:
+                    return self.serve_cached_result(body, outputs)
+        status, headers, reply = await self.dispatch_prompt(payload, request.headers)
+        self.watch_result(result_key, status, reply)
+        return web.Response(status=status, headers=headers, body=reply)
+
+    def watch_result(self, result_key: Optional[str], status: int, reply: bytes):
+        """Store the outputs of an accepted prompt under result_key once it completes."""
+        if result_key is None or status != 200:
+            return
+        try:
+            self.remember(self.result_watch, json.loads(reply)["prompt_id"], (result_key, time.time()))
+        except (ValueError, KeyError):
+            pass
+
+    async def result_call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.result_executor, fn, *args)
+
+    async def load_output_classes(self) -> Optional[set]:
+        """Node classes ComfyUI runs as outputs, from /object_info (the seeded snapshot when present)."""
+        cached = self.route_cache.get("/object_info")
+        marker = cached[0] if cached else None
+        if self.output_classes is None or self.output_classes_key != marker:
+            try:
+                if cached:
+                    body = cached[3]
+                else:
+                    async with self.session.get(f"{self.upstream_url}/object_info") as upstream:
+                        body = await upstream.read()
+                info = await asyncio.get_running_loop().run_in_executor(None, json.loads, body)
+            except Exception as e:
+                print(f"[gateway] Result cache disabled until /object_info loads: {e}")
+                return None
+            self.output_classes = {name for name, node in info.items() if isinstance(node, dict) and node.get("output_node")}
+            self.output_classes_key = marker
+        return self.output_classes
+
+    async def result_key(self, prompt: dict) -> Optional[str]:
+        # Without the code/package fingerprint a stored result could come from other node code.
+        environment_key = self.environment_key
+        if environment_key is None:
+            return None
+        output_classes = await self.load_output_classes()
+        if not output_classes:
+            return None
+        try:
+            return await self.result_call(self.result_cache.key_for, prompt, output_classes, environment_key)
+        except Exception as e:
+            print(f"[gateway] Result cache key failed: {e}")
+            return None
+
+    def serve_cached_result(self, body: dict, outputs: dict):
+        prompt_id = str(body.get("prompt_id") or uuid.uuid4())
+        timestamp = int(time.time() * 1000)
+        self.remember(self.cached_prompts, prompt_id, {
+            "prompt": [0, prompt_id, body["prompt"], body.get("extra_data", {}), list(outputs)],
+            "outputs": outputs,
+            "status": {
+                "status_str": "success",
+                "completed": True,
+                "messages": [["execution_cached_result", {"prompt_id": prompt_id, "timestamp": timestamp}]],
+            },
+            "meta": {},
+        })
+        client = self.client_sockets.get(body.get("client_id"))
+        if client is not None:
+            asyncio.ensure_future(self.announce_cached_result(client, prompt_id, body["prompt"], outputs))
+        return web.json_response({"prompt_id": prompt_id, "number": 0, "node_errors": {}})
+
+    async def announce_cached_result(self, client, prompt_id: str, prompt: dict, outputs: dict):
+        """Replay the websocket messages of a run in which every node came from cache."""
+        await asyncio.sleep(0.1)  # let the client see the /prompt reply first
+        timestamp = int(time.time() * 1000)
+        messages = [
+            {"type": "execution_start", "data": {"prompt_id": prompt_id, "timestamp": timestamp}},
+            {"type": "execution_cached", "data": {"nodes": list(prompt), "prompt_id": prompt_id, "timestamp": timestamp}},
+        ]
+        messages += [
+            {"type": "executed", "data": {"node": node_id, "display_node": node_id, "output": output, "prompt_id": prompt_id}}
+            for node_id, output in outputs.items()
+        ]
+        messages += [
+            {"type": "execution_success", "data": {"prompt_id": prompt_id, "timestamp": timestamp}},
+            {"type": "executing", "data": {"node": None, "display_node": None, "prompt_id": prompt_id}},
+        ]
+        try:
+            for message in messages:
+                await client.send_str(json.dumps(message))
+        except (ConnectionError, RuntimeError) as e:
+            print(f"[gateway] Could not announce cached result {prompt_id}: {e}")
+
+    async def result_loop(self):
+        while True:
+            await asyncio.sleep(RESULT_POLL_INTERVAL)
+            if not self.result_watch or not self.status.ready:
+                continue
+            try:
+                await self.store_finished_results()
+            except Exception as e:
+                print(f"[gateway] Result cache update failed: {e}")
+
+    async def store_finished_results(self):
+        """Store the outputs of watched prompts that have left ComfyUI's queue."""
+        _, queue = await self.upstream_json("GET", "/queue")
+        active = {entry[1] for entry in queue.get("queue_running", []) + queue.get("queue_pending", []) if len(entry) > 1}
+        for prompt_id, (key, watched_at) in list(self.result_watch.items()):
+            if prompt_id in active or prompt_id in self.held_ids:
+                continue
+            _, history = await self.upstream_json("GET", f"/history/{prompt_id}")
+            entry = history.get(prompt_id)
+            if entry is None:
+                if time.time() - watched_at > RESULT_WATCH_SECONDS:
+                    self.result_watch.pop(prompt_id, None)
+                continue
+            self.result_watch.pop(prompt_id, None)
+            if entry.get("status", {}).get("status_str", "success") != "success":
+                continue
+            if await self.result_call(self.result_cache.store, key, entry.get("outputs", {})) and self.on_result_change:
+                self.on_result_change()
+
+    async def handle_result_stats(self, request):
+        if not self.result_cache:
+            return web.json_response({"enabled": False})
+        stats = await self.result_call(self.result_cache.stats)
+        return web.json_response({"enabled": True, **stats, "watched": len(self.result_watch)})
+
+    async def dispatch_prompt(self, payload: bytes, request_headers) -> tuple:
+        """Queue a prompt in its lane, or send it straight to ComfyUI without lanes."""
+        if self.lanes:
+            try:
+                body = json.loads(payload)
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                return await self.enqueue_prompt(body, request_headers)
+        return await self.forward_prompt(payload, request_headers)
+
+    async def forward_prompt(self, payload: bytes, request_headers, journal: bool = True) -> tuple:
+        """POST a prompt to ComfyUI and journal it once accepted; returns (status, headers, body)."""
+        async with self.session.post(
+            f"{self.upstream_url}/prompt",
+            data=payload,
+            headers=forward_headers(request_headers, drop=("accept-encoding", "content-length")),
+        ) as upstream:
+            reply = await upstream.read()
+            headers = forward_headers(upstream.headers, drop=("content-length",))
+            if upstream.status == 200 and self.journal and journal:
+                try:
+                    prompt_id = json.loads(reply)["prompt_id"]
+                    await self.journal_call(self.journal.record, prompt_id, payload.decode("utf-8"))
+                except (ValueError, KeyError, sqlite3.Error) as e:
+                    print(f"[gateway] Prompt accepted but not journaled: {e}")
+            return upstream.status, headers, reply
+
+    async def coalesce_prompt(self, key: str, body: dict, request_headers):
+        """Hold a prompt until its group fills up or the coalescing wait ends."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = self.coalesce_groups.get(key)
+        if group is None:
+            group = self.coalesce_groups[key] = []
+            loop.call_later(self.coalesce_wait, self.flush_coalesce_group, key, group)
+        group.append((body, request_headers, future))
+        if sum(prompt_batch_size(member[0]["prompt"]) for member in group) >= self.coalesce_max_batch:
+            self.flush_coalesce_group(key, group)
+        return await future
+
+    def flush_coalesce_group(self, key: str, group: list):
+        if self.coalesce_groups.get(key) is group:
+            del self.coalesce_groups[key]
+            asyncio.ensure_future(self.run_coalesce_group(group))
+
+    async def run_coalesce_group(self, group: list):
+        try:
+            if len(group) > 1:
+                merged = merge_prompts([body for body, _, _ in group])
+                status, headers, reply = await self.dispatch_prompt(json.dumps(merged).encode("utf-8"), group[0][1])
+                if status == 200:
+                    await self.resolve_coalesced(group, json.loads(reply))
+                    return
+                # Let each prompt get its own validation errors.
+                print(f"[gateway] Coalesced batch of {len(group)} prompts rejected ({status}), submitting them one by one")
+            for body, request_headers, future in group:
+                payload = json.dumps(draw_seeds(body)).encode("utf-8")
+                status, headers, reply = await self.dispatch_prompt(payload, request_headers)
+                future.set_result(web.Response(status=status, headers=headers, body=reply))
+        except Exception as e:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def resolve_coalesced(self, group: list, reply: dict):
+        total = sum(prompt_batch_size(body["prompt"]) for body, _, _ in group)
+        offset = 0
+        for body, _, future in group:
+            count = prompt_batch_size(body["prompt"])
+            request_id = body.get("prompt_id") or str(uuid.uuid4())
+            self.coalesced_ids[request_id] = (reply["prompt_id"], offset, count, total)
+            while len(self.coalesced_ids) > COALESCED_IDS_KEEP:
+                self.coalesced_ids.popitem(last=False)
+            if self.journal:
+                try:
+                    await self.journal_call(self.journal.record_alias, request_id, reply["prompt_id"], offset, count, total)
+                except sqlite3.Error as e:
+                    print(f"[gateway] Coalesced prompt {request_id} not journaled: {e}")
+            future.set_result(web.json_response({**reply, "prompt_id": request_id}))
+            offset += count
+        self.stats["coalesced_prompts"] += len(group)
+        self.stats["coalesced_batches"] += 1
+
+    async def enqueue_prompt(self, body: dict, request_headers) -> tuple:
+        """Hold a prompt in its lane until the dispatcher hands it to ComfyUI.
+
+        The prompt id is fixed here (ComfyUI accepts a client supplied one), so
+        the prompt can be journaled and acknowledged while it waits.
+        """
+        output_classes = await self.load_output_classes() if "/object_info" in self.route_cache else self.output_classes
+        error = validate_prompt(body.get("prompt"), output_classes)
+        if error is not None:
+            return 400, CIMultiDict({"Content-Type": "application/json"}), json.dumps(error).encode("utf-8")
+        lane = prompt_lane(body, request_headers, self.lanes)
+        prompt_id = str(body.get("prompt_id") or uuid.uuid4())
+        payload = json.dumps({**body, "prompt_id": prompt_id}).encode("utf-8")
+        if self.journal:
+            try:
+                await self.journal_call(self.journal.record, prompt_id, payload.decode("utf-8"))
+            except sqlite3.Error as e:
+                print(f"[gateway] Prompt queued but not journaled: {e}")
+        entry = {
+            "prompt_id": prompt_id,
+            "lane": lane,
+            "payload": payload,
+            "headers": request_headers,
+            "enqueued_at": time.time(),
+            "client_id": body.get("client_id"),
+        }
+        self.hold(entry)
+        if self.lane_weights[lane] == max(self.lane_weights.values()):
+            asyncio.ensure_future(self.preempt_pending(lane))
+        position = sum(len(queue) for queue in self.lanes.values())
+        reply = {"prompt_id": prompt_id, "number": position, "node_errors": {}, "lane": lane, "validated": False}
+        return 200, CIMultiDict({"Content-Type": "application/json"}), json.dumps(reply).encode("utf-8")
+
+    def hold(self, entry: dict, requeue: bool = False):
+        lane = entry["lane"]
+        if not self.lanes[lane]:
+            # A lane that sat idle does not bank service credit against busy lanes.
+            busy = [self.lane_virtual_time[name] for name, queue in self.lanes.items() if queue]
+            if busy:
+                self.lane_virtual_time[lane] = max(self.lane_virtual_time[lane], min(busy))
+        if requeue:
+            # Back in arrival order among the prompts still waiting in its lane.
+            queue = self.lanes[lane]
+            position = next((i for i, queued in enumerate(queue) if queued["enqueued_at"] > entry["enqueued_at"]), len(queue))
+            queue.insert(position, entry)
+        else:
+            self.lanes[lane].append(entry)
+        self.held_ids.add(entry["prompt_id"])
+        self.lane_wakeup.set()
+
+    async def lane_loop(self):
+        while True:
+            await self.lane_wakeup.wait()
+            self.lane_wakeup.clear()
+            while any(self.lanes.values()):
+                try:
+                    if not self.status.ready or self.draining:
+                        await asyncio.sleep(LANE_POLL_INTERVAL)
+                        continue
+                    _, queue = await self.upstream_json("GET", "/queue")
+                    if len(queue.get("queue_pending", [])) >= LANE_DISPATCH_DEPTH:
+                        # Poll again, or sooner when a prompt arrives or is pulled back.
+                        try:
+                            await asyncio.wait_for(self.lane_wakeup.wait(), LANE_POLL_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+                        self.lane_wakeup.clear()
+                        continue
+                    lane = pick_lane({name: len(entries) for name, entries in self.lanes.items()}, self.lane_virtual_time)
+                    entry = self.lanes[lane].popleft()
+                    self.lane_virtual_time[lane] += 1 / self.lane_weights[lane]
+                    await self.dispatch_entry(entry)
+                except Exception as e:
+                    print(f"[gateway] Lane dispatch failed: {e}")
+                    await asyncio.sleep(LANE_POLL_INTERVAL)
+
+    async def dispatch_entry(self, entry: dict):
+        prompt_id, lane = entry["prompt_id"], entry["lane"]
+        try:
+            status, headers, reply = await self.forward_prompt(entry["payload"], entry["headers"], journal=False)
+        except Exception:
+            self.hold(entry, requeue=True)
+            raise
+        self.held_ids.discard(prompt_id)
+        if not entry.get("dispatched_at"):
+            self.lane_waits[lane].append(time.time() - entry["enqueued_at"])
+        entry["dispatched_at"] = time.time()
+        if status == 200:
+            self.lane_counts[lane]["dispatched"] += 1
+            self.remember(self.dispatched, prompt_id, entry, LANE_PREEMPTIBLE_KEEP)
+        else:
+            self.lane_counts[lane]["rejected"] += 1
+            self.reject_held(entry, status, reply)
+            if self.journal:
+                await self.journal_call(self.journal.finish, prompt_id, "failed")
+
+    def reject_held(self, entry: dict, status: int, reply: bytes):
+        """Serve a held prompt that will never run as an error in /history and on its client's websocket."""
+        self.remember(self.lane_rejections, entry["prompt_id"], (status, reply))
+        client = self.client_sockets.get(entry.get("client_id"))
+        if client is not None:
+            asyncio.ensure_future(self.announce_rejection(client, entry["prompt_id"], reply))
+
+    async def announce_rejection(self, client, prompt_id: str, reply: bytes):
+        try:
+            error = json.loads(reply).get("error") or {}
+        except (ValueError, AttributeError):
+            error = {}
+        if not isinstance(error, dict):
+            error = {"message": str(error)}
+        message = {
+            "type": "execution_error",
+            "data": {
+                "prompt_id": prompt_id,
+                "node_id": None,
+                "node_type": None,
+                "executed": [],
+                "exception_type": error.get("type", "launcher_rejected"),
+                "exception_message": " ".join(filter(None, (error.get("message"), error.get("details")))),
+                "traceback": [],
+                "current_inputs": {},
+                "current_outputs": {},
+                "timestamp": int(time.time() * 1000),
+            },
+        }
+        try:
+            await client.send_str(json.dumps(message))
+        except (ConnectionError, RuntimeError) as e:
+            print(f"[gateway] Could not announce rejected prompt {prompt_id}: {e}")
+
+    @staticmethod
+    def remember(mapping: OrderedDict, key: str, value, keep: int = LANE_TRACKED_IDS_KEEP):
+        mapping[key] = value
+        while len(mapping) > keep:
+            mapping.popitem(last=False)
+
+    async def preempt_pending(self, lane: str):
+        """Pull lower-priority prompts back out of ComfyUI's pending queue into their lanes."""
+        weight = self.lane_weights[lane]
+        victims = []
+        try:
+            _, queue = await self.upstream_json("GET", "/queue")
+            pending = [entry[1] for entry in queue.get("queue_pending", []) if len(entry) > 1]
+            victims = [
+                prompt_id for prompt_id in pending
+                if prompt_id in self.dispatched and self.lane_weights[self.dispatched[prompt_id]["lane"]] < weight
+            ]
+            if not victims:
+                return
+            # Held from before the delete, so the journal never sees them neither
+            # queued nor held and marks them cancelled.
+            self.held_ids.update(victims)
+            await self.upstream_json("POST", "/queue", {"delete": victims})
+            _, queue = await self.upstream_json("GET", "/queue")
+            still_queued = {entry[1] for entry in queue.get("queue_running", []) + queue.get("queue_pending", []) if len(entry) > 1}
+            for prompt_id in reversed(victims):
+                if prompt_id in still_queued:
+                    self.held_ids.discard(prompt_id)
+                    continue  # started running before the delete landed
+                _, history = await self.upstream_json("GET", f"/history/{prompt_id}")
+                if prompt_id in history:
+                    self.held_ids.discard(prompt_id)
+                    continue
+                entry = self.dispatched.pop(prompt_id)
+                self.lane_counts[entry["lane"]]["preempted"] += 1
+                self.hold(entry, requeue=True)
+        except Exception as e:
+            print(f"[gateway] Lane preemption failed: {e}")
+            # Victims not back in a lane are left to the journal reconciliation.
+            requeued = {entry["prompt_id"] for entries in self.lanes.values() for entry in entries}
+            self.held_ids.difference_update(set(victims) - requeued)
+
+    def held_entries(self) -> list:
+        """Prompts waiting in the lanes, oldest first."""
+        return sorted((entry for entries in self.lanes.values() for entry in entries), key=lambda entry: entry["enqueued_at"])
+
+    async def lane_queue(self, request):
+        """ComfyUI's /queue with the prompts held in the lanes appended as pending."""
+        status, queue = await self.upstream_json("GET", "/queue")
+        if status != 200:
+            return web.json_response(queue, status=status)
+        listed = queue.get("queue_running", []) + queue.get("queue_pending", [])
+        number = max((item[0] for item in listed if item and isinstance(item[0], (int, float))), default=-1) + 1
+        held = []
+        for entry in self.held_entries():
+            body = entry.setdefault("body", json.loads(entry["payload"]))
+            extra_data = {key: value for key, value in (body.get("extra_data") or {}).items() if key not in QUEUE_HIDDEN_EXTRA_DATA}
+            held.append([number, entry["prompt_id"], body.get("prompt", {}), extra_data, []])
+            number += 1
+        return web.json_response({**queue, "queue_pending": queue.get("queue_pending", []) + held})
+
+    async def lane_queue_edit(self, request):
+        """Apply a /queue delete or clear to the prompts held in the lanes, then forward it to ComfyUI."""
+        try:
+            body = json.loads(await request.read())
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            return web.json_response({"error": "expected a JSON object"}, status=400)
+        delete = set(body.get("delete") or [])
+        cancelled = [entry for entry in self.held_entries() if body.get("clear") or entry["prompt_id"] in delete]
+        reply = json.dumps({
+            "error": {"type": "prompt_cancelled", "message": "Prompt was removed from the queue before it ran", "details": "", "extra_info": {}},
+            "node_errors": {},
+        }).encode("utf-8")
+        # Out of the lanes before the first await, so the dispatcher cannot pick them up.
+        for entry in cancelled:
+            self.lanes[entry["lane"]].remove(entry)
+            self.held_ids.discard(entry["prompt_id"])
+            self.lane_counts[entry["lane"]]["cancelled"] += 1
+            self.reject_held(entry, 409, reply)
+        cancelled_ids = {entry["prompt_id"] for entry in cancelled}
+        if self.journal:
+            for prompt_id in cancelled_ids:
+                await self.journal_call(self.journal.finish, prompt_id, "cancelled")
+        forwarded = dict(body)
+        if "delete" in body:
+            forwarded["delete"] = [prompt_id for prompt_id in body["delete"] if prompt_id not in cancelled_ids]
+        if not forwarded.get("clear") and not forwarded.get("delete"):
+            return web.Response(status=200)
+        status, upstream_reply = await self.upstream_json("POST", "/queue", forwarded)
+        return web.json_response(upstream_reply, status=status) if upstream_reply else web.Response(status=status)
+
+    async def handle_lane_stats(self, request):
+        if not self.lanes:
+            return web.json_response({"enabled": False})
+        now = time.time()
+        lanes = {}
+        for lane, entries in self.lanes.items():
+            lanes[lane] = {
+                "weight": self.lane_weights[lane],
+                "queued": len(entries),
+                "oldest_wait": round(now - entries[0]["enqueued_at"], 3) if entries else 0.0,
+                "wait": wait_summary(self.lane_waits[lane]),
+                **self.lane_counts[lane],
+            }
+        return web.json_response({"enabled": True, "lanes": lanes})
+
+    async def rejected_history(self, request, prompt_id: str, request_id: Optional[str] = None):
+        status, reply = self.lane_rejections[prompt_id]
+        try:
+            error = json.loads(reply)
+        except ValueError:
+            error = {"message": reply.decode("utf-8", "replace")}
+        entry = {
+            "prompt": [],
+            "outputs": {},
+            "status": {"status_str": "error", "completed": False, "messages": [["launcher_rejected", {"status": status, **error}]]},
+        }
+        return web.json_response({request_id or prompt_id: entry})
+
+    async def coalesced_alias(self, request_id: str) -> Optional[tuple]:
+        """(prompt id, offset, count, total) of a coalesced prompt: from memory, else the journal."""
+        if request_id in self.coalesced_ids:
+            prompt_id, offset, count, total = self.coalesced_ids[request_id]
+            return self.replayed_ids.get(prompt_id, prompt_id), offset, count, total
+        if not self.journal:
+            return None
+        try:
+            return await self.journal_call(self.journal.alias, request_id, write=False)
+        except sqlite3.Error as e:
+            print(f"[gateway] Coalesced prompt lookup failed: {e}")
+            return None
+
+    async def coalesced_history(self, request, request_id: str, alias: tuple):
+        prompt_id, offset, count, total = alias
+        if prompt_id in self.lane_rejections:
+            return await self.rejected_history(request, prompt_id, request_id)
+        status, history = await self.upstream_json("GET", f"/history/{prompt_id}")
+        return web.json_response(
+            {request_id: split_history_entry(entry, offset, count, total) for entry in history.values()},
+            status=status,
+        )
+
+    async def replayed_history(self, request, original_id: str):
+        status, history = await self.upstream_json("GET", f"/history/{self.replayed_ids[original_id]}")
+        return web.json_response({original_id: entry for entry in history.values()}, status=status)
+
+    async def handle_status(self, request):
+        return web.json_response(self.status.snapshot())
+
+    async def handle_gateway_stats(self, request):
+        return web.json_response({
+            **self.stats,
+            "inventory_key": self.inventory_key,
+            "cached_routes": sorted(self.route_cache),
+            "compressed_cache_bytes": self.compressed_cache_bytes,
+            "brotli": brotli is not None,
+        })
+
+    async def handle(self, request):
+        self.last_request_at = time.time()
+        if self.first_request_at is None:
+            self.first_request_at = self.last_request_at
+            self.first_request_ready = self.status.ready
+            # The session has arrived; activity keeps the container from here.
+            self.hold_until = 0.0
+        if not self.status.ready:
+            if request.method == "GET" and "text/html" in request.headers.get("Accept", ""):
+                return web.Response(text=STATUS_PAGE, content_type="text/html", headers={"Cache-Control": "no-store"})
+            return web.json_response(self.status.snapshot(), status=503, headers={"Retry-After": "5"})
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            return await self.proxy_websocket(request)
+        path = route_path(request.path)
+        if self.draining and request.method == "POST" and path == "/prompt":
+            return web.json_response(
+                {"error": {"type": "server_draining", "message": "Server is shutting down, retry shortly"}},
+                status=503,
+                headers={"Retry-After": "30"},
+            )
+        if (self.journal or self.coalesce_wait > 0 or self.lanes or self.result_cache) and request.method == "POST" and path == "/prompt":
+            return await self.submit_prompt(request)
+        if self.lanes and path == "/queue" and request.method == "GET":
+            return await self.lane_queue(request)
+        if self.lanes and path == "/queue" and request.method == "POST":
+            return await self.lane_queue_edit(request)
+        if request.method == "GET" and path.startswith("/history/") and (self.coalesce_wait > 0 or self.coalesced_ids):
+            alias = await self.coalesced_alias(path[len("/history/"):])
+            if alias is not None:
+                return await self.coalesced_history(request, path[len("/history/"):], alias)
+        if request.method == "GET" and path.startswith("/history/") and path[len("/history/"):] in self.cached_prompts:
+            prompt_id = path[len("/history/"):]
+            return web.json_response({prompt_id: self.cached_prompts[prompt_id]})
+        if request.method == "GET" and path.startswith("/history/") and path[len("/history/"):] in self.lane_rejections:
+            return await self.rejected_history(request, path[len("/history/"):])
+        if request.method == "GET" and path.startswith("/history/") and path[len("/history/"):] in self.replayed_ids:
+            return await self.replayed_history(request, path[len("/history/"):])
+        if self.is_inventory_cached(request):
+            cached = self.route_cache.get(route_path(request.path_qs))
+            if cached and cached[0] == self.inventory_key:
+                self.stats["route_hits"] += 1
+                return await self.buffered_response(request, cached[1], CIMultiDict(cached[2]), cached[3])
+            self.stats["route_misses"] += 1
+        return await self.proxy_http(request)
+
+    def is_inventory_cached(self, request) -> bool:
+        return (
+            request.method == "GET"
+            and self.inventory_key is not None
+            and route_path(request.path).startswith(INVENTORY_CACHED_ROUTES)
+        )
+
+    async def proxy_http(self, request):
+        inventory_key = self.inventory_key
+        async with self.session.request(
+            request.method,
+            f"{self.upstream_url}{request.rel_url}",
+            # Always fetch identity bodies: the gateway does the compressing.
+            headers=forward_headers(request.headers, drop=("accept-encoding",)),
+            data=request.content if request.body_exists else None,
+            allow_redirects=False,
+        ) as upstream:
+            headers = forward_headers(upstream.headers)
+            if request.method == "GET" and upstream.status == 200 and HASHED_ASSET_RE.search(request.path):
+                headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+            if request.method == "GET" and upstream.status == 200 and is_compressible(headers):
+                body = await upstream.read()
+                if self.is_inventory_cached(request) and inventory_key == self.inventory_key:
+                    self.route_cache[route_path(request.path_qs)] = (inventory_key, upstream.status, tuple(headers.items()), body)
+                return await self.buffered_response(request, upstream.status, headers, body)
+
+            response = web.StreamResponse(status=upstream.status, reason=upstream.reason, headers=headers)
+            await response.prepare(request)
+            async for chunk in upstream.content.iter_chunked(PROXY_CHUNK_BYTES):
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+
+    async def buffered_response(self, request, status: int, headers: CIMultiDict, body: bytes):
+        headers.pop("Content-Length", None)
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding and len(body) >= COMPRESS_MIN_BYTES:
+            body = await self.compressed(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Vary"] = "Accept-Encoding"
+        return web.Response(status=status, headers=headers, body=body)
+
+    async def compressed(self, body: bytes, encoding: str) -> bytes:
+        key = (hashlib.sha1(body).digest(), encoding)
+        if key in self.compressed_cache:
+            self.compressed_cache.move_to_end(key)
+            self.stats["compressed_hits"] += 1
+            return self.compressed_cache[key]
+        self.stats["compressed_misses"] += 1
+        result = await asyncio.get_running_loop().run_in_executor(None, compress_body, body, encoding)
+        self.compressed_cache[key] = result
+        self.compressed_cache_bytes += len(result)
+        while self.compressed_cache_bytes > COMPRESSED_CACHE_BYTES and len(self.compressed_cache) > 1:
+            _, evicted = self.compressed_cache.popitem(last=False)
+            self.compressed_cache_bytes -= len(evicted)
+        return result
+
+    async def proxy_websocket(self, request):
+        client = web.WebSocketResponse(max_msg_size=0, autoping=True)
+        await client.prepare(request)
+        self.active_websockets += 1
+        client_id = request.query.get("clientId")
+        if client_id:
+            self.client_sockets[client_id] = client
+        try:
+            return await self.pump_websocket(request, client)
+        finally:
+            self.active_websockets -= 1
+            if client_id and self.client_sockets.get(client_id) is client:
+                del self.client_sockets[client_id]
+
+    async def pump_websocket(self, request, client):
+        headers = CIMultiDict((key, value) for key, value in forward_headers(request.headers).items() if not key.lower().startswith("sec-websocket"))
+        async with self.session.ws_connect(
+            f"{self.upstream_url.replace('http', 'ws', 1)}{request.rel_url}",
+            headers=headers,
+            max_msg_size=0,
+        ) as upstream:
+
+            async def pump(source, target):
+                async for message in source:
+                    if message.type == WSMsgType.TEXT:
+                        await target.send_str(message.data)
+                    elif message.type == WSMsgType.BINARY:
+                        await target.send_bytes(message.data)
+                    else:
+                        break
+
+            tasks = [asyncio.ensure_future(pump(client, upstream)), asyncio.ensure_future(pump(upstream, client))]
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                task.cancel()
+        await client.close()
+        return client
+
+
+def start_gateway(
+    status: BootstrapStatus,
+    port: int,
+    upstream_url: str,
+    journal_path: Optional[str] = None,
+    on_journal_change=None,
+    coalesce_wait: float = 0.0,
+    lanes: Optional[dict] = None,
+    result_cache=None,
+    on_result_change=None,
+) -> Gateway:
+    """Serve the gateway on 0.0.0.0:port from a background thread; returns once listening."""
+    listening = threading.Event()
+    gateway = Gateway(
+        status,
+        upstream_url,
+        journal_path,
+        on_journal_change,
+        coalesce_wait,
+        lanes=lanes,
+        result_cache=result_cache,
+        on_result_change=on_result_change,
+    )
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(gateway.build_app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "0.0.0.0", port).start())
+        listening.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, name="gateway", daemon=True)
+    thread.start()
+    listening.wait(timeout=30)
+    print(f"Gateway listening on :{port}, proxying to {upstream_url} once ComfyUI is ready")
+    return gateway
@@ -0,0 +1,63 @@
+"""Launcher-side hooks loaded by ComfyUI as a regular custom node.
+
+The Modal launcher copies this package into ``custom_nodes/`` on every boot.
+It exposes a small HTTP surface the launcher talks to from outside the
+ComfyUI process and ships a frontend extension under ``web/``.
+"""
+import os
+
+import folder_paths
+from aiohttp import web
+from server import PromptServer
+
+from .model_cache import ModelCacheTier
+
+NODE_CLASS_MAPPINGS = {}
+NODE_DISPLAY_NAME_MAPPINGS = {}
+WEB_DIRECTORY = "./web"
+
+MODELS_CHANGED_EVENT = "launcher.models_changed"
+
+routes = PromptServer.instance.routes
+
+# Container-local model cache tier, configured by the launcher through the
+# environment. Loaders resolve model files through folder_paths.get_full_path,
+# so wrapping it redirects cached models to the local copy.
+model_cache = None
+if os.environ.get("LAUNCHER_MODEL_CACHE_DIR") and os.environ.get("LAUNCHER_MODEL_CACHE_SOURCE"):
+    model_cache = ModelCacheTier(
+        os.environ["LAUNCHER_MODEL_CACHE_SOURCE"],
+        os.environ["LAUNCHER_MODEL_CACHE_DIR"],
+        int(os.environ.get("LAUNCHER_MODEL_CACHE_BYTES", 0)),
+    )
+    _get_full_path = folder_paths.get_full_path
+
+    def get_full_path(folder_name, filename):
+        return model_cache.resolve(_get_full_path(folder_name, filename))
+
+    folder_paths.get_full_path = get_full_path
+    print(f"[launcher] Model cache tier: {model_cache.cache_root} ({model_cache.budget_bytes / 2**30:.1f} GiB budget)")
+
+
+@routes.post("/launcher/models/refresh")
+async def refresh_models(request):
+    """Drop ComfyUI's cached folder listings and tell frontends to re-read them."""
+    payload = await request.json() if request.can_read_body else {}
+    added = payload.get("added", [])
+    removed = payload.get("removed", [])
+
+    folder_paths.filename_list_cache.clear()
+    PromptServer.instance.send_sync(MODELS_CHANGED_EVENT, {"added": added, "removed": removed})
+    print(f"[launcher] Model lists refreshed: {len(added)} added, {len(removed)} removed.")
+    return web.json_response({"ok": True, "added": len(added), "removed": len(removed)})
+
+
+@routes.get("/launcher/models/cache")
+async def model_cache_stats(request):
+    """Hit/miss and occupancy statistics of the local model cache tier."""
+    if model_cache is None:
+        return web.json_response({"enabled": False})
+    return web.json_response({"enabled": True, **model_cache.stats()})
+
+
+__all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS", "WEB_DIRECTORY"]
@@ -0,0 +1,107 @@
+"""Container-local LRU cache tier in front of the models directory on the volume.
+
+``resolve()`` maps a model path under ``source_root`` to its local copy when
+one exists (a hit) and otherwise returns the volume path unchanged (a miss)
+while a background worker copies the file to ``cache_root``. Copies appear
+atomically, least recently used files are evicted to stay within the byte
+budget, and a copy is dropped when its volume source changes.
+"""
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ModelCacheTier:
+    def __init__(self, source_root: str, cache_root: str, budget_bytes: int):
+        self.source_root = os.path.abspath(source_root)
+        self.cache_root = os.path.abspath(cache_root)
+        os.makedirs(self.cache_root, exist_ok=True)
+        usage = shutil.disk_usage(self.cache_root)
+        self.budget_bytes = min(budget_bytes, int(usage.free * 0.9))
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # relative path -> (size, source mtime), oldest first
+        self.pending = set()
+        self.stats_counters = {"hits": 0, "misses": 0, "promotions": 0, "evictions": 0, "failures": 0}
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-cache")
+
+    def cached_path(self, rel: str) -> str:
+        return os.path.join(self.cache_root, rel)
+
+    def used_bytes(self) -> int:
+        return sum(size for size, _ in self.entries.values())
+
+    def resolve(self, path: str) -> str:
+        if not path:
+            return path
+        source = os.path.abspath(path)
+        if not source.startswith(self.source_root + os.sep):
+            return path
+        rel = os.path.relpath(source, self.source_root)
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return path
+        signature = (stat.st_size, stat.st_mtime)
+
+        with self.lock:
+            entry = self.entries.get(rel)
+            if entry == signature and os.path.exists(self.cached_path(rel)):
+                self.entries.move_to_end(rel)
+                self.stats_counters["hits"] += 1
+                return self.cached_path(rel)
+            if entry is not None:
+                self._drop(rel)
+            self.stats_counters["misses"] += 1
+            if rel not in self.pending and stat.st_size <= self.budget_bytes:
+                self.pending.add(rel)
+                self.pool.submit(self._promote, rel, source, signature)
+        return path
+
+    def _drop(self, rel: str):
+        self.entries.pop(rel, None)
+        try:
+            os.remove(self.cached_path(rel))
+        except OSError:
+            pass
+
+    def _promote(self, rel: str, source: str, signature: tuple):
+        target = self.cached_path(rel)
+        partial = target + ".partial"
+        try:
+            with self.lock:
+                while self.entries and self.used_bytes() + signature[0] > self.budget_bytes:
+                    oldest = next(iter(self.entries))
+                    self._drop(oldest)
+                    self.stats_counters["evictions"] += 1
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, partial)
+            os.replace(partial, target)
+            with self.lock:
+                self.entries[rel] = signature
+                self.stats_counters["promotions"] += 1
+        except OSError as e:
+            print(f"[launcher] Model cache: failed to promote {rel}: {e}")
+            with self.lock:
+                self.stats_counters["failures"] += 1
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+        finally:
+            with self.lock:
+                self.pending.discard(rel)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.stats_counters["hits"] + self.stats_counters["misses"]
+            return {
+                **self.stats_counters,
+                "hit_rate": round(self.stats_counters["hits"] / lookups, 3) if lookups else None,
+                "cached_files": len(self.entries),
+                "used_bytes": self.used_bytes(),
+                "budget_bytes": self.budget_bytes,
+                "pending": sorted(self.pending),
+                "cached": list(self.entries),
+            }
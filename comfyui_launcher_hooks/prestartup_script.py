@@ -0,0 +1,127 @@
+"""Custom node import profiler, installed before ComfyUI imports ``nodes``.
+
+ComfyUI runs ``prestartup_script.py`` of every custom node before loading the
+node graph. This one wraps ``nodes.load_custom_node`` as soon as the ``nodes``
+module is imported and records wall time and RSS growth per custom node. When
+``init_external_custom_nodes`` returns, the slowest nodes are printed and the
+full report is written to ``LAUNCHER_IMPORT_PROFILE_PATH`` (if set) for the
+launcher to pick up.
+"""
+import importlib.abc
+import importlib.util
+import inspect
+import json
+import os
+import sys
+import time
+
+PROFILE_PATH_ENV = "LAUNCHER_IMPORT_PROFILE_PATH"
+REPORT_TOP = 10
+
+_profile = []
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _record(module_path: str, started: float, rss_before: int, ok: bool):
+    _profile.append({
+        "node": os.path.basename(os.path.normpath(module_path)),
+        "seconds": round(time.perf_counter() - started, 3),
+        "rss_mb": round((_rss_bytes() - rss_before) / 2**20, 1),
+        "ok": ok,
+    })
+
+
+def _report():
+    if not _profile:
+        return
+    ranked = sorted(_profile, key=lambda entry: entry["seconds"], reverse=True)
+    total = sum(entry["seconds"] for entry in ranked)
+    print(f"[launcher] Custom node imports: {len(ranked)} nodes in {total:.1f}s, slowest first:")
+    for entry in ranked[:REPORT_TOP]:
+        status = "" if entry["ok"] else "  (failed)"
+        print(f"[launcher]   {entry['seconds']:6.2f}s  {entry['rss_mb']:+7.1f} MB  {entry['node']}{status}")
+
+    path = os.environ.get(PROFILE_PATH_ENV)
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as handle:
+                json.dump({"recorded_at": time.time(), "total_seconds": round(total, 3), "nodes": ranked}, handle, indent=2)
+        except OSError as e:
+            print(f"[launcher] Failed to write import profile: {e}")
+
+
+def _wrap_load_custom_node(original):
+    if inspect.iscoroutinefunction(original):
+        async def load_custom_node(module_path, *args, **kwargs):
+            started, rss_before, ok = time.perf_counter(), _rss_bytes(), False
+            try:
+                ok = await original(module_path, *args, **kwargs)
+                return ok
+            finally:
+                _record(module_path, started, rss_before, bool(ok))
+    else:
+        def load_custom_node(module_path, *args, **kwargs):
+            started, rss_before, ok = time.perf_counter(), _rss_bytes(), False
+            try:
+                ok = original(module_path, *args, **kwargs)
+                return ok
+            finally:
+                _record(module_path, started, rss_before, bool(ok))
+    return load_custom_node
+
+
+def _wrap_init_external_custom_nodes(original):
+    if inspect.iscoroutinefunction(original):
+        async def init_external_custom_nodes(*args, **kwargs):
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                _report()
+    else:
+        def init_external_custom_nodes(*args, **kwargs):
+            try:
+                return original(*args, **kwargs)
+            finally:
+                _report()
+    return init_external_custom_nodes
+
+
+def _patch_nodes(module):
+    if hasattr(module, "load_custom_node"):
+        module.load_custom_node = _wrap_load_custom_node(module.load_custom_node)
+    if hasattr(module, "init_external_custom_nodes"):
+        module.init_external_custom_nodes = _wrap_init_external_custom_nodes(module.init_external_custom_nodes)
+
+
+class _NodesImportHook(importlib.abc.MetaPathFinder):
+    """Patch ComfyUI's ``nodes`` module right after it executes, once."""
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname != "nodes":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def exec_and_patch(module):
+            exec_module(module)
+            _patch_nodes(module)
+
+        spec.loader.exec_module = exec_and_patch
+        return spec
+
+
+if "nodes" in sys.modules:
+    _patch_nodes(sys.modules["nodes"])
+else:
+    sys.meta_path.insert(0, _NodesImportHook())
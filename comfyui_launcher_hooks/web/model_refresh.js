@@ -0,0 +1,16 @@
+import { app } from "../../scripts/app.js";
+import { api } from "../../scripts/api.js";
+
+// Re-read /object_info when the launcher reports new or removed model files,
+// so LoRA / VAE / checkpoint dropdowns update without reloading the page.
+app.registerExtension({
+  name: "ModalLauncher.ModelRefresh",
+  setup() {
+    api.addEventListener("launcher.models_changed", async ({ detail }) => {
+      const added = detail?.added?.length ?? 0;
+      const removed = detail?.removed?.length ?? 0;
+      console.log(`[launcher] models changed (+${added} / -${removed}), refreshing combo lists`);
+      await app.refreshComboInNodes();
+    });
+  },
+});
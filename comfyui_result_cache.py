@@ -0,0 +1,273 @@
+"""Result cache for ComfyUI prompts, stored on the volume.
+
+A prompt's key is its canonical API graph combined with the content hashes of
+the model and input files it references and a fingerprint of the environment
+(ComfyUI and custom node revisions, installed packages). The canonical graph
+keeps only the nodes some output node depends on, drops UI metadata and sorts
+keys, so resubmitting the same fully seeded workflow produces the same key,
+while a git or pip sync that changes node behaviour starts a fresh set of keys
+(entries of the old environment age out of the LRU). When a
+keyed prompt finishes, its outputs and the files they name are copied under
+the cache root. A later submission with the same key is answered from there
+without running ComfyUI: the files are restored into ComfyUI's temp directory
+(subfolder ``launcher_cache/<key>``) and served by its ``/view`` route.
+
+Entries are evicted least recently used first to stay within the byte budget.
+Model hashes are computed once per (size, mtime) on a background thread and
+kept in ``file_hashes.json``; until every referenced file has a hash, a
+prompt is not cached. All ``ResultCache`` methods are called from a single
+worker thread.
+
+Imported only inside the container, by the gateway.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+# String inputs with these suffixes name model or input files and are hashed into the key.
+REFERENCED_FILE_SUFFIXES = (
+    ".safetensors", ".sft", ".ckpt", ".pt", ".pth", ".bin", ".gguf", ".onnx",
+    ".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp4", ".webm", ".wav", ".flac", ".mp3",
+)
+HASH_CHUNK_BYTES = 8 * 2**20
+RESTORED_SUBFOLDER = "launcher_cache"
+
+
+def is_link(value) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def canonical_prompt(prompt: dict, output_classes: set) -> Optional[dict]:
+    """The part of an API prompt that determines its outputs, or None without output nodes.
+
+    Nodes that no output node depends on are dropped (ComfyUI never runs them)
+    along with ``_meta`` and any other UI-only fields.
+    """
+    needed = [node_id for node_id, node in prompt.items() if node.get("class_type") in output_classes]
+    if not needed:
+        return None
+    canonical = {}
+    while needed:
+        node_id = needed.pop()
+        if node_id in canonical or node_id not in prompt:
+            continue
+        node = prompt[node_id]
+        canonical[node_id] = {"class_type": node.get("class_type"), "inputs": node.get("inputs", {})}
+        needed.extend(value[0] for value in canonical[node_id]["inputs"].values() if is_link(value))
+    return canonical
+
+
+def referenced_names(prompt: dict) -> set:
+    return {
+        value
+        for node in prompt.values()
+        for value in node.get("inputs", {}).values()
+        if isinstance(value, str) and value.lower().endswith(REFERENCED_FILE_SUFFIXES)
+    }
+
+
+def result_cache_key(canonical: dict, file_hashes: dict, environment: str) -> str:
+    """Key of a canonical prompt run in environment against the files named in file_hashes (name -> sha256s)."""
+    material = json.dumps(
+        {"prompt": canonical, "files": file_hashes, "environment": environment}, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def output_file_refs(outputs: dict) -> list:
+    """(node id, output name, index) of every file reference in a history entry's outputs."""
+    refs = []
+    for node_id, node_output in outputs.items():
+        for name, values in node_output.items():
+            if not isinstance(values, list):
+                continue
+            for index, value in enumerate(values):
+                if isinstance(value, dict) and "filename" in value and "type" in value:
+                    refs.append((node_id, name, index))
+    return refs
+
+
+class FileHasher:
+    """sha256 of files, cached by (size, mtime) and computed in the background."""
+
+    def __init__(self, state_path: str):
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-hasher")
+        try:
+            with open(state_path, "r", encoding="utf-8") as handle:
+                self.hashes = json.load(handle)
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def get(self, path: str) -> Optional[str]:
+        """Hash of path if known for its current size and mtime; otherwise schedule it."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        signature = [stat.st_size, stat.st_mtime]
+        with self.lock:
+            known = self.hashes.get(path)
+            if known and known[:2] == signature:
+                return known[2]
+            if path not in self.pending:
+                self.pending.add(path)
+                self.pool.submit(self._compute, path, signature)
+        return None
+
+    def _compute(self, path: str, signature: list):
+        try:
+            digest = hashlib.sha256()
+            with open(path, "rb") as handle:
+                for chunk in iter(lambda: handle.read(HASH_CHUNK_BYTES), b""):
+                    digest.update(chunk)
+            with self.lock:
+                self.hashes[path] = signature + [digest.hexdigest()]
+                snapshot = dict(self.hashes)
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            partial = self.state_path + ".partial"
+            with open(partial, "w", encoding="utf-8") as handle:
+                json.dump(snapshot, handle)
+            os.replace(partial, self.state_path)
+        except OSError as e:
+            print(f"[result-cache] Failed to hash {path}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+
+class ResultCache:
+    def __init__(self, root: str, budget_bytes: int, models_dir: str, comfy_dirs: dict):
+        """comfy_dirs maps ComfyUI's file types (output, temp, input) to their directories."""
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.models_dir = models_dir
+        self.comfy_dirs = comfy_dirs
+        os.makedirs(root, exist_ok=True)
+        self.hasher = FileHasher(os.path.join(root, "file_hashes.json"))
+        self.connection = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, outputs TEXT NOT NULL, bytes INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.counters = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "evictions": 0}
+
+    def resolve(self, name: str) -> list:
+        """Files a referenced name can mean: an input file or a model in any category."""
+        candidates = [os.path.join(self.comfy_dirs["input"], name)]
+        try:
+            categories = os.listdir(self.models_dir)
+        except OSError:
+            categories = []
+        candidates += [os.path.join(self.models_dir, category, name) for category in categories]
+        return sorted(path for path in candidates if os.path.isfile(path))
+
+    def key_for(self, prompt: dict, output_classes: set, environment: str) -> Optional[str]:
+        """Cache key of an API prompt in environment, or None while it cannot be keyed (no outputs, hashes pending)."""
+        canonical = canonical_prompt(prompt, output_classes)
+        file_hashes = {}
+        for name in sorted(referenced_names(canonical or {})):
+            file_hashes[name] = [self.hasher.get(path) for path in self.resolve(name)]
+        if canonical is None or any(None in hashes for hashes in file_hashes.values()):
+            self.counters["bypassed"] += 1
+            return None
+        return result_cache_key(canonical, file_hashes, environment)
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def restored_dir(self, key: str) -> str:
+        return os.path.join(self.comfy_dirs["temp"], RESTORED_SUBFOLDER, key[:16])
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Outputs stored for key with their files restored for /view, or None on a miss."""
+        row = self.connection.execute("SELECT outputs FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        outputs = json.loads(row[0])
+        try:
+            os.makedirs(self.restored_dir(key), exist_ok=True)
+            for node_id, name, index in output_file_refs(outputs):
+                filename = outputs[node_id][name][index]["filename"]
+                target = os.path.join(self.restored_dir(key), filename)
+                if not os.path.exists(target):
+                    shutil.copyfile(os.path.join(self.entry_dir(key), filename), target)
+        except OSError as e:
+            print(f"[result-cache] Dropping entry {key[:12]} with missing files: {e}")
+            self.drop(key)
+            self.counters["misses"] += 1
+            return None
+        self.connection.execute("UPDATE results SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        self.counters["hits"] += 1
+        return outputs
+
+    def store(self, key: str, outputs: dict) -> bool:
+        """Copy the files named in outputs under the cache root and index them under key."""
+        stored = json.loads(json.dumps(outputs))
+        entry_dir = self.entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        total = 0
+        try:
+            for number, (node_id, name, index) in enumerate(output_file_refs(stored)):
+                ref = stored[node_id][name][index]
+                source = os.path.join(self.comfy_dirs[ref["type"]], ref.get("subfolder", ""), ref["filename"])
+                filename = f"{number}_{os.path.basename(ref['filename'])}"
+                shutil.copyfile(source, os.path.join(entry_dir, filename))
+                total += os.path.getsize(source)
+                stored[node_id][name][index] = {
+                    **ref,
+                    "filename": filename,
+                    "subfolder": f"{RESTORED_SUBFOLDER}/{key[:16]}",
+                    "type": "temp",
+                }
+        except (OSError, KeyError) as e:
+            print(f"[result-cache] Not caching {key[:12]}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return False
+        if total > self.budget_bytes:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return False
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, outputs, bytes, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(stored), total, now, now),
+        )
+        self.counters["stored"] += 1
+        self.evict()
+        return True
+
+    def drop(self, key: str):
+        self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def evict(self):
+        used = self.connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+        for key, size in self.connection.execute("SELECT key, bytes FROM results ORDER BY last_used").fetchall():
+            if used <= self.budget_bytes:
+                break
+            self.drop(key)
+            used -= size
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        entries, used = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM results").fetchone()
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else None,
+            "entries": entries,
+            "used_bytes": used,
+            "budget_bytes": self.budget_bytes,
+            "hashes_pending": len(self.hasher.pending),
+        }
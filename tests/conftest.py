@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def launcher():
+    import comfyui_app_l40s_krea2_turbo_v2
+
+    return comfyui_app_l40s_krea2_turbo_v2
+
+
+class FakeComfyUI(ThreadingHTTPServer):
+    """Just enough of ComfyUI's HTTP API for the launcher's clients.
+
+    queue_running/queue_pending hold prompt ids, history maps ids to entries,
+    requests records (method, path, body). on_prompt(server, prompt_id) runs
+    after every POST /prompt and decides where the new prompt goes.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeComfyUIHandler)
+        self.lock = threading.Lock()
+        self.queue_running = []
+        self.queue_pending = []
+        self.history = {}
+        self.requests = []
+        self.on_prompt = lambda server, prompt_id: server.queue_pending.append(prompt_id)
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def posted(self, path: str) -> list:
+        return [body for method, request_path, body in self.requests if method == "POST" and request_path == path]
+
+
+class FakeComfyUIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(("GET", self.path, None))
+            if self.path == "/queue":
+                self.reply({
+                    "queue_running": [[0, prompt_id, {}, {}, []] for prompt_id in server.queue_running],
+                    "queue_pending": [[1, prompt_id, {}, {}, []] for prompt_id in server.queue_pending],
+                })
+            elif self.path.startswith("/history/"):
+                prompt_id = self.path[len("/history/"):]
+                self.reply({prompt_id: server.history[prompt_id]} if prompt_id in server.history else {})
+            else:
+                self.reply({})
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with server.lock:
+            server.requests.append(("POST", self.path, body))
+            if self.path == "/prompt":
+                prompt_id = f"prompt-{len(server.posted('/prompt'))}"
+                server.on_prompt(server, prompt_id)
+                self.reply({"prompt_id": prompt_id, "number": 0, "node_errors": {}})
+                return
+            if self.path == "/queue":
+                if body.get("clear"):
+                    server.queue_pending.clear()
+                for prompt_id in body.get("delete", []):
+                    if prompt_id in server.queue_pending:
+                        server.queue_pending.remove(prompt_id)
+            elif self.path == "/interrupt":
+                server.queue_running.clear()
+            self.reply({})
+
+
+@pytest.fixture
+def fake_comfyui():
+    server = FakeComfyUI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def gateway_module():
+    import comfyui_gateway
+
+    return comfyui_gateway
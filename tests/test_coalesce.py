@@ -0,0 +1,51 @@
+import random
+
+
+def body(seed=-1, batch_size=1, client_id="api", **extra):
+    return {
+        "client_id": client_id,
+        "prompt": {
+            "1": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": batch_size}},
+            "2": {"class_type": "KSampler", "inputs": {"seed": seed, "latent_image": ["1", 0]}},
+            "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}},
+        },
+        **extra,
+    }
+
+
+def test_coalesce_key_groups_random_seed_prompts_of_one_client(gateway_module):
+    key = gateway_module.coalesce_key(body())
+    assert key is not None
+    assert gateway_module.coalesce_key(body(batch_size=2)) == key
+    assert gateway_module.coalesce_key(body(client_id="other")) != key
+
+
+def test_coalesce_key_refuses_caller_seeds_and_editor_prompts(gateway_module):
+    assert gateway_module.coalesce_key(body(seed=42)) is None
+    assert gateway_module.coalesce_key(body(extra_data={"extra_pnginfo": {"workflow": {}}})) is None
+    assert gateway_module.coalesce_key(body(front=True)) is None
+
+
+def test_merge_prompts_draws_one_seed_and_sums_batches(gateway_module):
+    merged = gateway_module.merge_prompts([body(batch_size=2, prompt_id="a"), body(prompt_id="b")], random.Random(0))
+    assert "prompt_id" not in merged
+    assert merged["prompt"]["1"]["inputs"]["batch_size"] == 3
+    assert 0 <= merged["prompt"]["2"]["inputs"]["seed"] <= gateway_module.COALESCE_SEED_MAX
+
+
+def test_split_history_entry_slices_batched_outputs(gateway_module):
+    entry = {"outputs": {"3": {"images": ["a", "b", "c"], "text": ["x"]}}, "status": {}}
+    assert gateway_module.split_history_entry(entry, 1, 2, 3)["outputs"] == {"3": {"images": ["b", "c"], "text": ["x"]}}
+
+
+def test_journal_aliases_follow_replays_and_purge(gateway_module, tmp_path):
+    journal = gateway_module.PromptJournal(str(tmp_path / "journal.sqlite"))
+    journal.record("merged", "{}")
+    journal.record_alias("request", "merged", 1, 2, 3)
+    assert journal.alias("request") == ("merged", 1, 2, 3)
+    journal.replayed("merged", "replay")
+    assert journal.alias("request") == ("replay", 1, 2, 3)
+    assert journal.alias("unknown") is None
+    journal.finish("merged", "done")
+    journal.purge(older_than=float("inf"))
+    assert journal.alias("request") is None
@@ -0,0 +1,119 @@
+import signal
+import subprocess
+import threading
+import time
+
+import pytest
+
+
+class FakeProcess:
+    """Stands in for the ComfyUI Popen; ignore_terminate makes it need a kill."""
+
+    def __init__(self, ignore_terminate: bool = False):
+        self.returncode = None
+        self.ignore_terminate = ignore_terminate
+        self.calls = []
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.calls.append("terminate")
+        if not self.ignore_terminate:
+            self.returncode = -signal.SIGTERM
+
+    def kill(self):
+        self.calls.append("kill")
+        self.returncode = -signal.SIGKILL
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            raise subprocess.TimeoutExpired("comfyui", timeout)
+        return self.returncode
+
+
+class FakeGateway:
+    draining = False
+
+    def start_draining(self):
+        self.draining = True
+
+
+@pytest.fixture(autouse=True)
+def drain_state(launcher, monkeypatch, tmp_path):
+    monkeypatch.setattr(launcher, "DRAIN_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(launcher, "TELEMETRY_PATH", str(tmp_path / "telemetry.jsonl"))
+    monkeypatch.setattr(launcher, "RUNTIME_STATE_DIR", str(tmp_path))
+    launcher.shutdown_requested.clear()
+    yield
+    launcher.shutdown_requested.clear()
+
+
+def test_drain_lets_running_prompt_finish(launcher, fake_comfyui):
+    fake_comfyui.queue_running.append("running")
+    fake_comfyui.queue_pending.append("pending")
+    threading.Timer(0.1, fake_comfyui.queue_running.clear).start()
+    gateway, process, commits = FakeGateway(), FakeProcess(), []
+
+    outcome = launcher.drain_comfyui(process, gateway, fake_comfyui.base_url, grace=5, commit=lambda: commits.append(1))
+
+    assert outcome["interrupted"] is False and outcome["committed"] is True
+    assert gateway.draining and launcher.shutdown_requested.is_set()
+    assert fake_comfyui.posted("/queue") == [{"clear": True}]
+    assert fake_comfyui.queue_pending == []
+    assert process.calls == ["terminate"] and commits == [1]
+
+
+def test_drain_interrupts_prompt_outliving_grace(launcher, fake_comfyui):
+    fake_comfyui.queue_running.append("running")
+    outcome = launcher.drain_comfyui(FakeProcess(), None, fake_comfyui.base_url, grace=0.1)
+    assert outcome["interrupted"] is True
+    assert fake_comfyui.posted("/interrupt") == [{}]
+
+
+def test_drain_grace_is_capped_by_budget(launcher, fake_comfyui, monkeypatch):
+    monkeypatch.setattr(launcher, "DRAIN_TERMINATE_SECONDS", 0.1)
+    monkeypatch.setattr(launcher, "DRAIN_COMMIT_RESERVE_SECONDS", 0.1)
+    fake_comfyui.queue_running.append("running")
+    outcome = launcher.drain_comfyui(FakeProcess(), None, fake_comfyui.base_url, grace=20, budget=0.5)
+    assert outcome["interrupted"] is True
+    assert outcome["duration"] < 1
+
+
+def test_drain_kills_process_ignoring_terminate(launcher, fake_comfyui, monkeypatch):
+    monkeypatch.setattr(launcher, "DRAIN_TERMINATE_SECONDS", 0.1)
+    process = FakeProcess(ignore_terminate=True)
+    launcher.drain_comfyui(process, None, fake_comfyui.base_url, grace=1)
+    assert process.calls == ["terminate", "kill"]
+
+
+def test_drain_abandons_commit_at_deadline(launcher):
+    release = threading.Event()
+    started = time.monotonic()
+    outcome = launcher.drain_comfyui(None, None, grace=1, commit=lambda: release.wait(5), budget=0.3)
+    release.set()
+    assert outcome["committed"] is False
+    assert time.monotonic() - started < 1
+
+
+def test_drain_without_comfyui_api_still_stops_process(launcher, fake_comfyui):
+    base_url = fake_comfyui.base_url
+    fake_comfyui.shutdown()
+    fake_comfyui.server_close()
+    process = FakeProcess()
+    outcome = launcher.drain_comfyui(process, None, base_url, grace=1)
+    assert process.calls == ["terminate"] and outcome["interrupted"] is False
+
+
+def test_exit_hook_drains_started_comfyui_once(launcher, fake_comfyui):
+    process, commits = FakeProcess(), []
+    outcome = launcher.drain_on_exit(FakeGateway(), [process], commit=lambda: commits.append(1), base_url=fake_comfyui.base_url, grace=1)
+    assert outcome["committed"] is True
+    assert launcher.drain_on_exit(FakeGateway(), [process], commit=lambda: commits.append(1)) is None
+    assert process.calls == ["terminate"] and commits == [1]
+
+
+def test_exit_hook_before_startup_still_persists(launcher):
+    commits = []
+    outcome = launcher.drain_on_exit(None, (), commit=lambda: commits.append(1))
+    assert outcome["committed"] is True and commits == [1]
@@ -0,0 +1,74 @@
+import subprocess
+
+import pytest
+
+
+@pytest.fixture
+def git_env(monkeypatch):
+    for key, value in {
+        "GIT_AUTHOR_NAME": "test",
+        "GIT_AUTHOR_EMAIL": "test@example.com",
+        "GIT_COMMITTER_NAME": "test",
+        "GIT_COMMITTER_EMAIL": "test@example.com",
+        "GIT_CONFIG_GLOBAL": "/dev/null",
+    }.items():
+        monkeypatch.setenv(key, value)
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit(work, name: str) -> str:
+    (work / name).write_text(name)
+    git("add", name, cwd=work)
+    git("commit", "-q", "-m", name, cwd=work)
+    return git("rev-parse", "HEAD", cwd=work)
+
+
+@pytest.fixture
+def remote(tmp_path, git_env):
+    """Bare repo whose default branch is neither main nor master, plus a work tree that pushes to it."""
+    bare = tmp_path / "remote.git"
+    work = tmp_path / "work"
+    git("init", "-q", "--bare", "-b", "trunk", str(bare))
+    git("init", "-q", "-b", "trunk", str(work))
+    git("remote", "add", "origin", str(bare), cwd=work)
+    commit(work, "first")
+    commit(work, "second")
+    git("push", "-q", "origin", "trunk", cwd=work)
+    return bare, work
+
+
+@pytest.mark.parametrize("shallow", [True, False])
+def test_update_git_repo_follows_remote_default_branch(launcher, remote, tmp_path, shallow):
+    bare, work = remote
+    clone = tmp_path / "clone"
+    depth = ["--depth", "1", "--single-branch"] if shallow else []
+    git("clone", "-q", *depth, f"file://{bare}", str(clone))
+    assert launcher.detect_remote_branch(str(clone)) == "trunk"
+
+    tip = commit(work, "third")
+    git("push", "-q", "origin", "trunk", cwd=work)
+    launcher.update_git_repo(str(clone), "test repo")
+
+    assert git("rev-parse", "HEAD", cwd=clone) == tip
+    assert launcher.is_shallow_repo(str(clone)) is shallow
+
+
+def test_update_git_repo_resets_local_edits(launcher, remote, tmp_path):
+    bare, work = remote
+    clone = tmp_path / "clone"
+    git("clone", "-q", "--depth", "1", "--single-branch", f"file://{bare}", str(clone))
+    (clone / "second").write_text("local edit")
+
+    tip = commit(work, "third")
+    git("push", "-q", "origin", "trunk", cwd=work)
+    launcher.update_git_repo(str(clone), "test repo")
+
+    assert git("rev-parse", "HEAD", cwd=clone) == tip
+
+
+def test_update_git_repo_skips_non_repo(launcher, tmp_path, capsys):
+    launcher.update_git_repo(str(tmp_path), "plain dir")
+    assert "not a git repository" in capsys.readouterr().out
@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "kwargs, keep, reason",
+    [
+        ({}, False, "idle"),
+        ({"bootstrapping": True}, True, "bootstrap"),
+        ({"queue_running": 1, "queue_pending": 2}, True, "queue 1 running / 2 pending"),
+        ({"active_websockets": 2}, True, "2 websocket(s) open"),
+        ({"held": True}, True, "prewarm hold"),
+        ({"draining": True, "bootstrapping": True, "queue_running": 1, "active_websockets": 1}, False, "draining"),
+        ({"queue_pending": 1, "active_websockets": 1, "held": True}, True, "queue 0 running / 1 pending"),
+    ],
+)
+def test_keepalive_decision(launcher, kwargs, keep, reason):
+    args = {"bootstrapping": False, "queue_running": 0, "queue_pending": 0, "draining": False, **kwargs}
+    assert launcher.keepalive_decision(**args) == (keep, reason)
@@ -0,0 +1,56 @@
+import os
+
+
+def make_cache(launcher, root, key: str, files: dict, last_used: float) -> str:
+    cache_dir = root / key
+    cache_dir.mkdir()
+    for name, size in files.items():
+        (cache_dir / name).write_bytes(b"x" * size)
+    marker = cache_dir / launcher.KERNEL_CACHE_MARKER
+    marker.write_text(str(last_used))
+    os.utime(marker, (last_used, last_used))
+    return str(cache_dir)
+
+
+def test_kernel_cache_key_is_path_safe(launcher):
+    assert launcher.kernel_cache_key("L40S", "2.5.1+cu124", "550.54 / x") == "L40S-torch2.5.1+cu124-driver550.54___x"
+
+
+def test_configure_kernel_cache_points_env_into_cache_dir(launcher, tmp_path):
+    environ = {}
+    cache_env = launcher.configure_kernel_cache(str(tmp_path), environ)
+    assert environ == cache_env
+    for key in ("TORCHINDUCTOR_CACHE_DIR", "TRITON_CACHE_DIR", "CUDA_CACHE_PATH"):
+        assert os.path.isdir(environ[key])
+        assert environ[key].startswith(str(tmp_path))
+    assert (tmp_path / launcher.KERNEL_CACHE_MARKER).exists()
+
+
+def test_evict_keeps_everything_under_budget(launcher, tmp_path):
+    make_cache(launcher, tmp_path, "old", {"a.bin": 100}, last_used=1000)
+    make_cache(launcher, tmp_path, "current", {"b.bin": 100}, last_used=2000)
+    assert launcher.evict_kernel_caches(str(tmp_path), "current", budget=1000) == []
+    assert sorted(os.listdir(tmp_path)) == ["current", "old"]
+
+
+def test_evict_drops_least_recently_used_keys_first(launcher, tmp_path):
+    make_cache(launcher, tmp_path, "oldest", {"a.bin": 400}, last_used=1000)
+    make_cache(launcher, tmp_path, "older", {"a.bin": 400}, last_used=2000)
+    make_cache(launcher, tmp_path, "current", {"a.bin": 400}, last_used=500)
+    removed = launcher.evict_kernel_caches(str(tmp_path), "current", budget=900)
+    assert removed == ["oldest"]
+    assert sorted(os.listdir(tmp_path)) == ["current", "older"]
+
+
+def test_evict_trims_oldest_files_of_current_key_last(launcher, tmp_path):
+    make_cache(launcher, tmp_path, "other", {"a.bin": 300}, last_used=1000)
+    cache_dir = make_cache(launcher, tmp_path, "current", {"old.bin": 300, "new.bin": 300}, last_used=2000)
+    os.utime(os.path.join(cache_dir, "old.bin"), (100, 100))
+    os.utime(os.path.join(cache_dir, "new.bin"), (200, 200))
+    removed = launcher.evict_kernel_caches(str(tmp_path), "current", budget=400)
+    assert removed == ["other", os.path.join("current", "old.bin")]
+    assert sorted(os.listdir(cache_dir)) == [launcher.KERNEL_CACHE_MARKER, "new.bin"]
+
+
+def test_evict_missing_root(launcher, tmp_path):
+    assert launcher.evict_kernel_caches(str(tmp_path / "missing"), "current", budget=0) == []
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+INTERACTIVE = {"X-Launcher-Lane": "interactive"}
+GRAPH = {"1": {"class_type": "SaveImage", "inputs": {}}}
+
+
+class StubComfyUI:
+    """ComfyUI queue that never runs anything: accepted prompts stay pending."""
+
+    def __init__(self):
+        self.pending = []
+        self.deleted = []
+        self.on_delete = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/prompt", self.prompt)
+        app.router.add_route("*", "/queue", self.queue)
+        app.router.add_get("/history/{prompt_id}", lambda request: web.json_response({}))
+        return app
+
+    async def prompt(self, request):
+        body = await request.json()
+        if body["prompt"]["1"]["class_type"] == "Missing":
+            return web.json_response({"error": {"type": "prompt_no_outputs"}, "node_errors": {}}, status=400)
+        self.pending.append(body["prompt_id"])
+        return web.json_response({"prompt_id": body["prompt_id"], "number": len(self.pending), "node_errors": {}})
+
+    async def queue(self, request):
+        if request.method == "POST":
+            body = await request.json()
+            if self.on_delete:
+                self.on_delete(body.get("delete", []))
+            self.deleted += body.get("delete", [])
+            self.pending = [prompt_id for prompt_id in self.pending if prompt_id not in body.get("delete", [])]
+            return web.Response()
+        return web.json_response({"queue_running": [], "queue_pending": [[i, p, {}, {}, []] for i, p in enumerate(self.pending)]})
+
+
+def run_with_gateway(gateway_module, tmp_path, scenario):
+    async def main():
+        stub = StubComfyUI()
+        upstream = TestServer(stub.app())
+        await upstream.start_server()
+        status = gateway_module.BootstrapStatus()
+        status.set_ready()
+        gateway = gateway_module.Gateway(
+            status, str(upstream.make_url("")), journal_path=str(tmp_path / "journal.sqlite"), lanes={"interactive": 4, "bulk": 1}
+        )
+        client = TestClient(TestServer(gateway.build_app()))
+        await client.start_server()
+        try:
+            await scenario(stub, gateway, client)
+        finally:
+            await client.close()
+            await upstream.close()
+
+    asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def fast_lanes(gateway_module, monkeypatch):
+    monkeypatch.setattr(gateway_module, "LANE_POLL_INTERVAL", 0.02)
+
+
+async def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.02)
+
+
+def test_prompt_is_acknowledged_without_waiting_for_dispatch(gateway_module, tmp_path):
+    async def scenario(stub, gateway, client):
+        await client.post("/prompt", json={"prompt": GRAPH, "prompt_id": "b0"})
+        await wait_for(lambda: stub.pending == ["b0"])
+        # ComfyUI's pending reserve is full, so b1 and b2 stay held in the bulk lane.
+        for prompt_id in ("b1", "b2"):
+            reply = await client.post("/prompt", json={"prompt": GRAPH, "prompt_id": prompt_id})
+            assert reply.status == 200
+            assert await reply.json() == {"prompt_id": prompt_id, "number": int(prompt_id[1]), "node_errors": {}, "lane": "bulk", "validated": False}
+        assert gateway.held_ids == {"b1", "b2"}
+        assert gateway.journal.counts() == {"queued": 3}
+
+    run_with_gateway(gateway_module, tmp_path, scenario)
+
+
+def test_held_prompts_are_listed_and_deletable_via_queue(gateway_module, tmp_path):
+    async def scenario(stub, gateway, client):
+        for prompt_id in ("b0", "b1", "b2"):
+            assert (await client.post("/prompt", json={"prompt": GRAPH, "prompt_id": prompt_id})).status == 200
+        await wait_for(lambda: stub.pending == ["b0"])
+
+        queue = await (await client.get("/api/queue")).json()
+        assert [item[1] for item in queue["queue_pending"]] == ["b0", "b1", "b2"]
+
+        await client.post("/queue", json={"delete": ["b1", "b0"]})
+        assert stub.deleted == ["b0"]
+        history = await (await client.get("/history/b1")).json()
+        assert history["b1"]["status"]["messages"][0][1]["error"]["type"] == "prompt_cancelled"
+        await client.post("/queue", json={"clear": True})
+        queue = await (await client.get("/queue")).json()
+        assert queue["queue_pending"] == []
+        assert gateway.held_ids == set()
+        assert gateway.journal.counts() == {"cancelled": 2, "queued": 1}
+
+    run_with_gateway(gateway_module, tmp_path, scenario)
+
+
+def test_structurally_invalid_prompts_are_rejected_up_front(gateway_module, tmp_path):
+    async def scenario(stub, gateway, client):
+        reply = await client.post("/prompt", json={"prompt": {"1": {"inputs": {}}}})
+        assert reply.status == 400
+        assert (await reply.json())["error"]["type"] == "invalid_prompt"
+        # Output classes come from the cached /object_info once there is one.
+        gateway.seed_route("/object_info", "inventory", b'{"SaveImage": {"output_node": true}}')
+        reply = await client.post("/prompt", json={"prompt": {"1": {"class_type": "LoadImage", "inputs": {}}}})
+        assert reply.status == 400
+        assert (await reply.json())["error"]["type"] == "prompt_no_outputs"
+        assert gateway.held_ids == set() and stub.pending == []
+
+    run_with_gateway(gateway_module, tmp_path, scenario)
+
+
+def test_rejection_at_dispatch_is_served_from_history(gateway_module, tmp_path):
+    async def scenario(stub, gateway, client):
+        graph = {"1": {"class_type": "Missing", "inputs": {}}}
+        reply = await client.post("/prompt", json={"prompt": graph, "prompt_id": "bad"})
+        assert reply.status == 200
+        await wait_for(lambda: "bad" in gateway.lane_rejections)
+        history = await (await client.get("/history/bad")).json()
+        assert history["bad"]["status"]["status_str"] == "error"
+        assert history["bad"]["status"]["messages"][0][1]["error"]["type"] == "prompt_no_outputs"
+        assert gateway.journal.counts() == {"failed": 1}
+
+    run_with_gateway(gateway_module, tmp_path, scenario)
+
+
+def test_preempted_prompts_stay_held_while_pulled_back(gateway_module, tmp_path):
+    async def scenario(stub, gateway, client):
+        await client.post("/prompt", json={"prompt": GRAPH, "prompt_id": "bulk"})
+        await wait_for(lambda: stub.pending == ["bulk"])
+        held_at_delete = []
+        stub.on_delete = lambda ids: held_at_delete.extend(prompt_id in gateway.held_ids for prompt_id in ids)
+        reply = await client.post("/prompt", json={"prompt": GRAPH, "prompt_id": "urgent"}, headers=INTERACTIVE)
+        assert reply.status == 200
+        await wait_for(lambda: stub.pending == ["urgent"])
+        assert held_at_delete == [True]
+        assert stub.pending == ["urgent"]
+        assert "bulk" in gateway.held_ids
+        await gateway.reconcile_journal()
+        assert gateway.journal.counts() == {"queued": 2}
+
+    run_with_gateway(gateway_module, tmp_path, scenario)
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+DAY = 86400
+# 2026-10-19 00:00 UTC, a session at 09:00-09:10 most days before it.
+MIDNIGHT = 1792368000.0
+
+
+def daily_sessions(days: int, hour: float = 9.0, skip=()) -> list:
+    return [MIDNIGHT - age * DAY + hour * 3600 + 300 for age in range(days, 0, -1) if age not in skip]
+
+
+def test_session_probability_needs_minimum_history(launcher):
+    window = MIDNIGHT + 9 * 3600
+    assert launcher.session_probability(daily_sessions(2), window, 1800, min_history_days=3) == 0.0
+    assert launcher.session_probability([], window, 1800) == 0.0
+
+
+def test_session_probability_of_daily_habit(launcher):
+    sessions = daily_sessions(14)
+    assert launcher.session_probability(sessions, MIDNIGHT + 9 * 3600, 1800) == pytest.approx(1.0)
+    assert launcher.session_probability(sessions, MIDNIGHT + 15 * 3600, 1800) == 0.0
+
+
+def test_session_probability_weights_recent_days(launcher):
+    window = MIDNIGHT + 9 * 3600
+    missed_recently = launcher.session_probability(daily_sessions(14, skip=(1, 2)), window, 1800)
+    missed_long_ago = launcher.session_probability(daily_sessions(14, skip=(12, 13)), window, 1800)
+    assert 0.5 < missed_recently < missed_long_ago < 1.0
+
+
+def test_session_probability_ignores_days_before_first_session(launcher):
+    # Five days of history, all hits: the sixteen empty days before it do not count as misses.
+    assert launcher.session_probability(daily_sessions(5), MIDNIGHT + 9 * 3600, 1800, lookback_days=21) == pytest.approx(1.0)
+
+
+def test_prewarm_decision_warms_ahead_of_lead_time(launcher):
+    now = MIDNIGHT + 9 * 3600 - 300
+    warm, reason, probability = launcher.prewarm_decision(daily_sessions(14), now, 300, 600, {})
+    assert warm and probability == pytest.approx(1.0)
+    # Without the lead the window starts too late and misses the 09:05 sessions.
+    assert launcher.prewarm_decision(daily_sessions(14), now + 900, 0, 600, {})[0] is False
+
+
+def test_prewarm_decision_vetoes(launcher):
+    now = MIDNIGHT + 9 * 3600
+    sessions = daily_sessions(14)
+    covered = {"covered_until": now + 60}
+    assert launcher.prewarm_decision(sessions, now, 0, 600, covered)[1] == "window already covered by an earlier warm-up"
+
+    today = launcher.prewarm_budget_day(now)
+    warm, reason, _ = launcher.prewarm_decision(sessions, now, 0, 600, {"day": today, "spent_seconds": 3300}, budget_seconds=3600)
+    assert not warm and reason.startswith("daily budget reached")
+    # Yesterday's spend does not count against today.
+    assert launcher.prewarm_decision(sessions, now, 0, 600, {"day": "2026-10-18", "spent_seconds": 3600})[0] is True
+
+
+def test_charge_prewarm_ledger_rolls_over_daily(launcher):
+    now = MIDNIGHT + 9 * 3600
+    ledger = launcher.charge_prewarm_ledger({"hydrate_seconds": 120}, now, 100, now + 1800)
+    ledger = launcher.charge_prewarm_ledger(ledger, now + 600, 50, now + 900)
+    assert ledger == {
+        "day": "2026-10-19",
+        "spent_seconds": 150,
+        "warms": 2,
+        "covered_until": now + 1800,
+        "hydrate_seconds": 120,
+    }
+    next_day = launcher.charge_prewarm_ledger(ledger, now + DAY, 10, now + DAY)
+    assert next_day["spent_seconds"] == 10 and next_day["warms"] == 1
+
+
+def test_load_session_starts_skips_other_events(launcher, tmp_path):
+    path = tmp_path / "telemetry.jsonl"
+    path.write_text(
+        "\n".join([
+            json.dumps({"event": "session_start", "ts": 20.0}),
+            json.dumps({"event": "keepalive", "ts": 15.0}),
+            "not json",
+            json.dumps({"event": "session_start", "ts": 10.0}),
+        ])
+    )
+    assert launcher.load_session_starts(str(path)) == [10.0, 20.0]
+
+
+def test_volume_lease_expires(launcher, tmp_path):
+    path = str(tmp_path / "state" / "volume_sync.lease")
+    assert launcher.read_volume_lease(path) == {}
+    lease = launcher.write_volume_lease("test", 60, path)
+    assert launcher.volume_lease_active(launcher.read_volume_lease(path), lease["acquired_at"])
+    assert not launcher.volume_lease_active(lease, lease["until"] + 1)
+    launcher.release_volume_lease(path)
+    launcher.release_volume_lease(path)
+    assert launcher.read_volume_lease(path) == {}
@@ -0,0 +1,136 @@
+import os
+import types
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def result_cache_module():
+    import comfyui_result_cache
+
+    return comfyui_result_cache
+
+
+PROMPT = {
+    "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}, "_meta": {"title": "Load"}},
+    "2": {"class_type": "KSampler", "inputs": {"seed": 1, "model": ["1", 0]}},
+    "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}},
+    "4": {"class_type": "Note", "inputs": {"text": "unused"}},
+}
+
+
+def test_canonical_prompt_keeps_only_output_dependencies(result_cache_module):
+    canonical = result_cache_module.canonical_prompt(PROMPT, {"SaveImage"})
+    assert sorted(canonical) == ["1", "2", "3"]
+    assert "_meta" not in canonical["1"]
+    assert result_cache_module.canonical_prompt(PROMPT, {"PreviewImage"}) is None
+
+
+def test_result_cache_key_changes_with_environment(result_cache_module):
+    canonical = result_cache_module.canonical_prompt(PROMPT, {"SaveImage"})
+    files = {"model.safetensors": ["abc"]}
+    key = result_cache_module.result_cache_key(canonical, files, "env-a")
+    assert result_cache_module.result_cache_key(canonical, files, "env-a") == key
+    assert result_cache_module.result_cache_key(canonical, files, "env-b") != key
+    assert result_cache_module.result_cache_key(canonical, {"model.safetensors": ["def"]}, "env-a") != key
+
+
+def test_key_for_waits_for_file_hashes(result_cache_module, tmp_path):
+    models = tmp_path / "models" / "checkpoints"
+    models.mkdir(parents=True)
+    (models / "model.safetensors").write_bytes(b"weights")
+    comfy_dirs = {kind: str(tmp_path / kind) for kind in ("output", "temp", "input")}
+    cache = result_cache_module.ResultCache(str(tmp_path / "cache"), 2**20, str(tmp_path / "models"), comfy_dirs)
+    assert cache.key_for(PROMPT, {"SaveImage"}, "env-a") is None
+    cache.hasher.pool.shutdown(wait=True)
+    key = cache.key_for(PROMPT, {"SaveImage"}, "env-a")
+    assert key is not None
+    assert cache.key_for(PROMPT, {"SaveImage"}, "env-b") not in (None, key)
+    assert cache.counters["bypassed"] == 1
+
+
+@pytest.fixture
+def cache_dirs(tmp_path):
+    comfy_dirs = {kind: tmp_path / kind for kind in ("output", "temp", "input")}
+    for path in comfy_dirs.values():
+        path.mkdir()
+    return {kind: str(path) for kind, path in comfy_dirs.items()}
+
+
+@pytest.fixture
+def make_cache(result_cache_module, tmp_path, cache_dirs, monkeypatch):
+    # A clock that ticks once per call keeps last_used ordering deterministic.
+    ticks = iter(range(1, 10**6))
+    monkeypatch.setattr(result_cache_module, "time", types.SimpleNamespace(time=lambda: float(next(ticks))))
+
+    def make(budget_bytes: int = 2**20):
+        return result_cache_module.ResultCache(str(tmp_path / "cache"), budget_bytes, str(tmp_path / "models"), cache_dirs)
+
+    return make
+
+
+def saved_image(cache_dirs, name: str, size: int) -> dict:
+    subfolder = os.path.join(cache_dirs["output"], "krea")
+    os.makedirs(subfolder, exist_ok=True)
+    with open(os.path.join(subfolder, name), "wb") as handle:
+        handle.write(b"x" * size)
+    return {"3": {"images": [{"filename": name, "subfolder": "krea", "type": "output"}]}}
+
+
+def test_store_and_lookup_restore_files_into_temp(make_cache, cache_dirs):
+    cache = make_cache()
+    key = "a" * 64
+    assert cache.store(key, saved_image(cache_dirs, "image.png", 10)) is True
+
+    outputs = cache.lookup(key)
+    ref = outputs["3"]["images"][0]
+    assert ref == {"filename": "0_image.png", "subfolder": f"launcher_cache/{key[:16]}", "type": "temp"}
+    restored = os.path.join(cache_dirs["temp"], ref["subfolder"], ref["filename"])
+    with open(restored, "rb") as handle:
+        assert handle.read() == b"x" * 10
+    assert cache.stats()["entries"] == 1 and cache.stats()["used_bytes"] == 10
+
+
+def test_evict_drops_least_recently_used_over_budget(make_cache, cache_dirs):
+    cache = make_cache(budget_bytes=25)
+    assert cache.store("a" * 64, saved_image(cache_dirs, "a.png", 10))
+    assert cache.store("b" * 64, saved_image(cache_dirs, "b.png", 10))
+    assert cache.lookup("a" * 64) is not None
+    assert cache.store("c" * 64, saved_image(cache_dirs, "c.png", 10))
+
+    assert cache.lookup("b" * 64) is None
+    assert cache.lookup("a" * 64) is not None and cache.lookup("c" * 64) is not None
+    assert not os.path.exists(cache.entry_dir("b" * 64))
+    assert cache.counters["evictions"] == 1
+    assert cache.stats()["used_bytes"] == 20
+
+
+def test_store_refuses_entry_larger_than_budget(make_cache, cache_dirs):
+    cache = make_cache(budget_bytes=5)
+    key = "a" * 64
+    assert cache.store(key, saved_image(cache_dirs, "big.png", 10)) is False
+    assert not os.path.exists(cache.entry_dir(key))
+    assert cache.stats()["entries"] == 0 and cache.counters["stored"] == 0
+
+
+def test_stats_report_hit_rate(make_cache, cache_dirs):
+    cache = make_cache()
+    assert cache.stats()["hit_rate"] is None
+    cache.store("a" * 64, saved_image(cache_dirs, "image.png", 10))
+    cache.lookup("a" * 64)
+    cache.lookup("a" * 64)
+    cache.lookup("b" * 64)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hit_rate"] == pytest.approx(0.667)
+
+
+def test_lookup_drops_entry_with_missing_files(make_cache, cache_dirs):
+    cache = make_cache()
+    key = "a" * 64
+    cache.store(key, saved_image(cache_dirs, "image.png", 10))
+    os.remove(os.path.join(cache.entry_dir(key), "0_image.png"))
+
+    assert cache.lookup(key) is None
+    assert not os.path.exists(cache.entry_dir(key))
+    assert cache.stats()["entries"] == 0 and cache.counters["misses"] == 1
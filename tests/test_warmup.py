@@ -0,0 +1,64 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(launcher, monkeypatch):
+    monkeypatch.setattr(launcher, "WARMUP_POLL_INTERVAL", 0.01)
+
+
+def test_warmup_completes(launcher, fake_comfyui):
+    fake_comfyui.on_prompt = lambda server, prompt_id: server.history.update(
+        {prompt_id: {"status": {"status_str": "success"}, "outputs": {}}}
+    )
+    outcome = launcher.run_warmup(fake_comfyui.base_url, timeout=5)
+    assert outcome["status"] == "completed"
+    assert fake_comfyui.posted("/prompt")[0]["client_id"] == launcher.WARMUP_CLIENT_ID
+
+
+def test_warmup_reports_failed_prompt(launcher, fake_comfyui):
+    fake_comfyui.on_prompt = lambda server, prompt_id: server.history.update(
+        {prompt_id: {"status": {"status_str": "error"}, "outputs": {}}}
+    )
+    assert launcher.run_warmup(fake_comfyui.base_url, timeout=5)["status"] == "failed"
+
+
+def test_warmup_skipped_when_queue_busy(launcher, fake_comfyui):
+    fake_comfyui.queue_running.append("real")
+    outcome = launcher.run_warmup(fake_comfyui.base_url, timeout=5)
+    assert outcome == {**outcome, "status": "skipped", "reason": "queue busy"}
+    assert fake_comfyui.posted("/prompt") == []
+
+
+def test_warmup_dropped_while_pending_behind_real_prompt(launcher, fake_comfyui):
+    def arrive_together(server, prompt_id):
+        server.queue_running.append("real")
+        server.queue_pending.append(prompt_id)
+
+    fake_comfyui.on_prompt = arrive_together
+    outcome = launcher.run_warmup(fake_comfyui.base_url, timeout=5)
+    assert outcome["status"] == "cancelled"
+    assert fake_comfyui.posted("/queue") == [{"delete": [outcome["prompt_id"]]}]
+    assert fake_comfyui.posted("/interrupt") == []
+
+
+def test_warmup_interrupted_when_real_prompt_waits(launcher, fake_comfyui):
+    def arrive_behind(server, prompt_id):
+        server.queue_running.append(prompt_id)
+        server.queue_pending.append("real")
+
+    fake_comfyui.on_prompt = arrive_behind
+    outcome = launcher.run_warmup(fake_comfyui.base_url, timeout=5)
+    assert outcome["status"] == "cancelled"
+    assert fake_comfyui.posted("/interrupt") == [{"prompt_id": outcome["prompt_id"]}]
+
+
+def test_warmup_times_out(launcher, fake_comfyui):
+    fake_comfyui.on_prompt = lambda server, prompt_id: server.queue_running.append(prompt_id)
+    assert launcher.run_warmup(fake_comfyui.base_url, timeout=0.05)["status"] == "timeout"
+
+
+def test_warmup_fails_without_server(launcher, fake_comfyui):
+    base_url = fake_comfyui.base_url
+    fake_comfyui.shutdown()
+    fake_comfyui.server_close()
+    assert launcher.run_warmup(base_url, timeout=1)["status"] == "failed"